@@ -0,0 +1,251 @@
+"""
+Benchmarks of what staircase itself costs, using synthetic tests whose steps do no work.
+
+    python benchmarks/run_benchmarks.py --output results.json
+    python benchmarks/run_benchmarks.py --compare results.json
+
+Each benchmark is run several times and the fastest and median times are reported, in seconds. With --compare, the
+results are compared with an earlier output file, and the exit code is 1 if any benchmark got slower by more than the
+threshold.
+"""
+import sys
+import os
+
+# Benchmark the staircase in this checkout, rather than needing it to be installed
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from staircase import StaircaseTest, StaircaseLogger, StaircasePrinter, StaircasePrintMode, Task, Test, Teardown, Substep
+from staircase.plan import StaircasePlan
+import statistics
+import subprocess
+import argparse
+import platform
+import json
+import time
+
+
+class NullLogger(StaircaseLogger):
+    def info(self, *args, **kwargs):
+        pass
+
+    def error(self, *args, **kwargs):
+        pass
+
+
+def make_step(decorator, name, **kwargs):
+    def step(self):
+        return True
+
+    # Steps store their results under the name of their function
+    step.__name__ = name
+    step.__qualname__ = name
+    return decorator(**kwargs)(step)
+
+
+def make_test_class(name, steps) -> type:
+    return type(name, (StaircaseTest,), {'__module__': __name__, **steps})
+
+
+def wide_steps(count):
+    """
+    count independent steps.
+    """
+    return {f'step_{i}': make_step(Task, f'step_{i}') for i in range(count)}
+
+
+def chain_steps(count):
+    """
+    count steps, each depending on the one before it.
+    """
+    steps = {'step_0': make_step(Task, 'step_0')}
+    for i in range(1, count):
+        steps[f'step_{i}'] = make_step(Task, f'step_{i}', on_pass=f'step_{i - 1}')
+    return steps
+
+
+def diamond_steps(count):
+    """
+    count diamonds in a row, each a step that two steps depend on, which a fourth step depends on. The last step
+    depends on every other step, with $ALL.
+    """
+    steps = {}
+    previous = None
+    for i in range(count):
+        top, left, right, bottom = (f'diamond_{i}_{part}' for part in ('top', 'left', 'right', 'bottom'))
+        steps[top] = make_step(Task, top, on_pass=previous)
+        steps[left] = make_step(Task, left, on_pass=top)
+        steps[right] = make_step(Task, right, on_pass=top)
+        steps[bottom] = make_step(Test, bottom, on_pass=(left, right))
+        previous = bottom
+
+    steps['collect'] = make_step(Teardown, 'collect', on_pass='$ALL')
+    return steps
+
+
+def substep_steps(count):
+    """
+    One step calling a substep count times, and one step mapping a substep over count items.
+    """
+    @Test
+    def call_substeps(self):
+        @Substep(desc='Is even')
+        def is_even(number):
+            return number % 2 == 0
+
+        for number in range(count):
+            is_even(number)
+        return True
+
+    @Test
+    def map_substeps(self):
+        @Substep(desc='Is even')
+        def is_even(number):
+            return number % 2 == 0
+
+        is_even.map(range(count))
+        return True
+
+    return {'call_substeps': call_substeps, 'map_substeps': map_substeps}
+
+
+SHAPES = {
+    'wide': (wide_steps, 5000),
+    'chain': (chain_steps, 5000),
+    'diamond': (diamond_steps, 1000),
+    'substeps': (substep_steps, 100000),
+}
+
+
+def get_benchmarks(scale=1.0):
+    """
+    Get (name, function) for each benchmark. scale multiplies the size of every synthetic test.
+    """
+    benchmarks = []
+
+    for shape, (build_steps, size) in SHAPES.items():
+        steps = build_steps(max(int(size * scale), 1))
+        test_class = make_test_class(f'{shape.capitalize()}Test', steps)
+
+        if shape != 'substeps':
+            benchmarks.append((f'{shape}.register_steps', lambda test_class=test_class: _register_steps(test_class)))
+            benchmarks.append((f'{shape}.sort_steps', lambda test_class=test_class: _sort_steps(test_class)))
+            benchmarks.append((f'{shape}.define_class', lambda steps=steps: make_test_class('DefinedTest', steps)))
+            benchmarks.append((f'{shape}.instantiate', lambda test_class=test_class: test_class(logger=NullLogger())))
+
+        benchmarks.append((f'{shape}.run', lambda test_class=test_class: _run(test_class)))
+        benchmarks.append((f'{shape}.print', lambda test_class=test_class: _print(test_class)))
+
+    return benchmarks
+
+
+def _register_steps(test_class):
+    plan = StaircasePlan.__new__(StaircasePlan)
+    plan.step_registry = {}
+    plan._register_steps(test_class)
+
+
+def _sort_steps(test_class):
+    test_class._plan._get_sorted_steps()
+
+
+def _run(test_class):
+    test_class(logger=NullLogger()).run(show_all=False)
+
+
+_ran_tests = {}
+
+
+def _print(test_class):
+    # Print the results of a run, so that the table has statuses and substeps
+    if test_class not in _ran_tests:
+        _ran_tests[test_class] = test_class(logger=NullLogger())
+        _ran_tests[test_class].run()
+
+    test = _ran_tests[test_class]
+    StaircasePrinter(test.ordered_list, test.step_registry, test.logger).print(StaircasePrintMode.SUMMARY)
+
+
+def time_benchmark(function, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    return {'min': min(times), 'median': statistics.median(times), 'repeat': repeat}
+
+
+def get_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results, baseline, threshold):
+    """
+    Print how each benchmark changed from the baseline, returning the names of those that got slower than threshold.
+    """
+    regressions = []
+    for name, result in results['benchmarks'].items():
+        if name not in baseline['benchmarks']:
+            print(f'{name:<28}{result["min"]:>12.6f}s  (new)')
+            continue
+
+        ratio = result['min'] / baseline['benchmarks'][name]['min']
+        flag = ''
+        if ratio > threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f'{name:<28}{result["min"]:>12.6f}s  {ratio:>6.2f}x{flag}')
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='compare with the results in this JSON file')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='slowdown ratio reported as a regression (default: 1.2)')
+    parser.add_argument('--repeat', type=int, default=5, help='times to run each benchmark (default: 5)')
+    parser.add_argument('--scale', type=float, default=1.0, help='multiply the size of every synthetic test')
+    parser.add_argument('--filter', default='', help='only run benchmarks whose name contains this')
+    args = parser.parse_args(argv)
+
+    results = {
+        'commit': get_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'scale': args.scale,
+        'benchmarks': {},
+    }
+
+    for name, function in get_benchmarks(args.scale):
+        if args.filter in name:
+            results['benchmarks'][name] = time_benchmark(function, args.repeat)
+            if not args.compare:
+                print(f'{name:<28}{results["benchmarks"][name]["min"]:>12.6f}s')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get('scale') != args.scale:
+            print(f'Cannot compare with {args.compare}, it was run with scale {baseline.get("scale")}.')
+            return 2
+
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f'\n{len(regressions)} benchmarks got slower by more than {args.threshold}x.')
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
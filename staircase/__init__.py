@@ -1,4 +1,12 @@
 from staircase.decorators import Task, Setup, Test, Teardown, Substep
 from staircase.printer import StaircasePrinter, StaircasePrintMode
-from staircase.logger import StaircaseLogger, DefaultLogger
+from staircase.logger import StaircaseLogger, DefaultLogger, QueueLogger
 from staircase.test import StaircaseTest
+from staircase.types import SubstepRetention, StepMetrics, FixtureScope
+from staircase.cache import StepCache
+from staircase.history import DurationStore
+from staircase.fixtures import Fixture
+from staircase.results import ResultStore
+from staircase.sinks import ResultSink, JsonLinesSink, JUnitXmlSink
+from staircase.progress import ProgressSink
+from staircase.distributed import Coordinator, run_worker
@@ -0,0 +1,77 @@
+from staircase.suite import PATTERN, discover_tests, get_shard, run_suite, print_suite_summary
+from staircase.logger import DefaultLogger
+from staircase.watch import Watcher
+import argparse
+import sys
+
+
+def _parse_shard(shard):
+    try:
+        index, count = (int(part) for part in shard.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'Invalid shard {shard}. Must be of the form i/n, e.g. 1/4.')
+
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(f'Invalid shard {shard}. The shard must be between 1 and {count}.')
+    return index, count
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog='python -m staircase', description='Run a suite of staircase tests.')
+    parser.add_argument('paths', nargs='+', help='Modules, files or directories to find StaircaseTest subclasses in.')
+    parser.add_argument('--pattern', default=PATTERN, help='Pattern for the files to search in directories.')
+    parser.add_argument('--shard', type=_parse_shard, default=(1, 1),
+                        help='Only run shard i of n, e.g. 2/4. Shards are numbered from 1.')
+    parser.add_argument('-j', '--processes', type=int, default=None,
+                        help='Number of worker processes. Defaults to the number of CPUs.')
+    parser.add_argument('--cache-dir', default=None, help='Directory to cache steps declared with cache=True in.')
+    parser.add_argument('--no-cache', action='store_true', help='Run every step, even if it is cached.')
+    parser.add_argument('--fail-fast', choices=('flight', 'test', 'suite'), default=None,
+                        help='Stop starting new steps after a step fails, in the same flight, the same test, or '
+                             'also stop starting new tests.')
+    parser.add_argument('--results-only', action='store_true', help='Only show Test steps in the summary.')
+    parser.add_argument('--list', action='store_true', help='List the tests that would run, without running them.')
+    parser.add_argument('-v', '--verbose', action='store_true', help="Show each test's own output.")
+    parser.add_argument('--watch', action='store_true',
+                        help='Keep watching the paths, re-running the steps affected by each change to the source.')
+    parser.add_argument('--poll-interval', type=float, default=Watcher.POLL_INTERVAL,
+                        help='Seconds between checks for changes when watching.')
+    parser.add_argument('--debounce', type=float, default=Watcher.DEBOUNCE,
+                        help='Seconds without further changes to wait for before re-running when watching.')
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    logger = DefaultLogger.get_default()
+    run_kwargs = {'show_all': not args.results_only, 'cache_dir': args.cache_dir, 'no_cache': args.no_cache,
+                  'fail_fast': args.fail_fast}
+
+    if args.watch:
+        # Watched tests run in this process, which keeps their results between runs
+        Watcher(args.paths, args.pattern, run_kwargs, logger, args.poll_interval, args.debounce).watch()
+        return 0
+
+    tests = get_shard(discover_tests(args.paths, args.pattern), *args.shard)
+
+    if args.list:
+        for test in tests:
+            if test.error is not None:
+                logger.error(f'{test.test_id} ({test.error})')
+            else:
+                logger.info(test.test_id)
+        return 0
+
+    reports = run_suite(tests, args.processes, run_kwargs)
+
+    if args.verbose:
+        for report in reports:
+            for line in report.output:
+                logger.info(line)
+
+    print_suite_summary(reports, logger, show_all=not args.results_only)
+    return 0 if all(report.passed for report in reports) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,126 @@
+import tempfile
+import hashlib
+import inspect
+import pickle
+import time
+import os
+
+
+class StepCache:
+    """
+    Stores the results of cacheable steps on disk, so that a later run can replay them instead of running the step.
+
+    Each entry is keyed on a hash of the step's source, the results of the steps it depends on and the step's declared
+    cache inputs, so changing any of these runs the step again. Entries older than max_age seconds are removed, and the
+    oldest entries are removed while the cache is larger than max_size bytes.
+    """
+    MAX_SIZE = 1024 ** 3
+    MAX_AGE = 7 * 24 * 60 * 60
+
+    def __init__(self, cache_dir, max_size=MAX_SIZE, max_age=MAX_AGE):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.max_age = max_age
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def get_key(self, test, step_name, dependency_keys):
+        """
+        Get the cache key of a step, given a key for each of the steps it depends on.
+        """
+        step = test.step_registry[step_name].method_reference
+
+        key = hashlib.sha256()
+        key.update(f'{type(test).__module__}.{type(test).__qualname__}.{step_name}'.encode())
+        key.update(self._get_source(step.function).encode())
+
+        for dependency in sorted(dependency_keys):
+            key.update(f'{dependency}={dependency_keys[dependency]}'.encode())
+
+        if step.cache_inputs is not None:
+            try:
+                key.update(pickle.dumps(step.cache_inputs(test)))
+            except Exception as e:
+                raise Exception(f'The cache inputs of step {step_name} cannot be pickled. {str(e)}')
+
+        return key.hexdigest()
+
+    @staticmethod
+    def get_results_key(step_name, results):
+        """
+        Get a key for the results of a step that was not cached.
+        """
+        try:
+            return hashlib.sha256(pickle.dumps(results)).hexdigest()
+        except Exception as e:
+            raise Exception(f'The results of step {step_name} cannot be pickled, '
+                            f'so steps that depend on it cannot be cached. {str(e)}')
+
+    def load(self, key):
+        """
+        Get the cached (results, substeps) for a key, or None if there is no entry for it.
+        """
+        path = self._get_path(key)
+        try:
+            with open(path, 'rb') as f:
+                entry = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+        # Mark the entry as recently used, so that it is evicted last
+        os.utime(path)
+        return entry
+
+    def store(self, key, results, substeps):
+        try:
+            entry = pickle.dumps((results, substeps))
+        except Exception:
+            return  # Steps with results that cannot be pickled are simply not cached
+
+        # Write to a temporary file first, so that a partially written entry is never loaded
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(entry)
+        os.replace(temp_path, self._get_path(key))
+
+    def evict(self):
+        """
+        Remove entries that are older than max_age, then the least recently used entries until the cache is no larger
+        than max_size.
+        """
+        now = time.time()
+        entries = []
+
+        for entry in os.scandir(self.cache_dir):
+            if not entry.name.endswith('.pkl'):
+                continue
+
+            stat = entry.stat()
+            if self.max_age is not None and now - stat.st_mtime > self.max_age:
+                os.remove(entry.path)
+            else:
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if self.max_size is None or total_size <= self.max_size:
+                break
+
+            os.remove(path)
+            total_size -= size
+
+    def clear(self):
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.pkl'):
+                os.remove(entry.path)
+
+    def _get_path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.pkl')
+
+    @staticmethod
+    def _get_source(function):
+        try:
+            return inspect.getsource(function)
+        except (OSError, TypeError):
+            # The source is not available, e.g. for steps defined in an interactive session
+            return repr((function.__code__.co_code, function.__code__.co_consts))
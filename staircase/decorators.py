@@ -1,5 +1,35 @@
-from staircase.types import SubstepRegistration
+from staircase.types import SubstepRegistration, SubstepBatchRegistration, StepMetrics
+from staircase.executor import EXECUTORS
+from staircase.fixtures import _Fixture, _using_fixtures
+from contextlib import contextmanager
+from contextvars import ContextVar
 import inspect
+import time
+
+# The test instance and the name of the step currently running. Set whenever a step is called, so that substeps can
+# find the step they are defined in. Each thread and asyncio task sees its own values.
+_current_test = ContextVar('staircase_current_test', default=None)
+_current_step = ContextVar('staircase_current_step', default=None)
+
+# Set to a threading.Event for steps run with a timeout. Once it is set the step has timed out, and anything it records
+# afterwards is discarded.
+_step_cancelled = ContextVar('staircase_step_cancelled', default=None)
+
+
+@contextmanager
+def _running_step(test_instance, step_name):
+    test_token = _current_test.set(test_instance)
+    step_token = _current_step.set(step_name)
+    try:
+        yield
+    finally:
+        _current_step.reset(step_token)
+        _current_test.reset(test_token)
+
+
+def _step_was_cancelled():
+    cancelled = _step_cancelled.get()
+    return cancelled is not None and cancelled.is_set()
 
 
 def _to_tuple(item):
@@ -12,6 +42,10 @@ def _to_tuple(item):
     return (item,)  # Must leave parentheses to make tuple
 
 
+def _get_metrics(start, cpu_start):
+    return StepMetrics(time.perf_counter() - start, time.thread_time() - cpu_start)
+
+
 def _convert_results(results):
     if results is None:
         return True, None  # No result is interpreted as a pass
@@ -30,9 +64,26 @@ def _convert_results(results):
 
 
 class _StepDecorator:
-    def __init__(self, func, desc=None, on_pass=None, on_fail=None):
+    def __init__(self, func, desc=None, on_pass=None, on_fail=None, executor=None, cache=False, cache_inputs=None,
+                 timeout=None, fixtures=None, params=None, ids=None):
         self.function = func
         self.desc = desc
+        self.executor = executor
+
+        # The parameter sets the step is run with, each as a step of its own, and a function giving the id of each
+        self.params = params
+        self.ids = ids
+
+        # Seconds the step may run for before it is failed
+        self.timeout = timeout
+
+        # Fixtures checked out for the whole of the step, see StaircaseTest.get_fixture
+        self.fixtures = () if fixtures is None else _to_tuple(fixtures)
+
+        # Whether results may be replayed from a StepCache, and a function of the test instance giving any other inputs
+        # that the results depend on
+        self.cache = cache
+        self.cache_inputs = cache_inputs
 
         # Always pass in as None or a tuple
         self.on_pass = on_pass if on_pass is None else _to_tuple(on_pass)
@@ -41,57 +92,162 @@ class _StepDecorator:
         if self.on_pass and self.on_fail:
             raise Exception(f"Step {self.function.__name__} cannot have both on_pass and on_fail")
 
+        if self.executor not in EXECUTORS:
+            raise Exception(f"Step {self.function.__name__} has an invalid executor {self.executor}. "
+                            f"Must be one of {EXECUTORS}.")
+
+        if self.executor == 'process' and inspect.iscoroutinefunction(self.function):
+            raise Exception(f"Step {self.function.__name__} is a coroutine and cannot run in a process.")
+
+        if self.cache_inputs is not None and not self.cache:
+            raise Exception(f"Step {self.function.__name__} has cache_inputs but is not cached.")
+
+        if self.timeout is not None and (not isinstance(self.timeout, (int, float)) or self.timeout <= 0):
+            raise Exception(f"Step {self.function.__name__} has an invalid timeout {self.timeout}. "
+                            f"Must be a positive number of seconds.")
+
+        for fixture in self.fixtures:
+            if not isinstance(fixture, _Fixture):
+                raise Exception(f"Step {self.function.__name__} has an invalid fixture {fixture}. "
+                                f"Must be defined with the Fixture decorator.")
+
+        if self.params is not None and not callable(self.params) and not hasattr(self.params, '__iter__'):
+            raise Exception(f"Step {self.function.__name__} has invalid params {self.params}. "
+                            f"Must be an iterable, or a function of the test instance returning one.")
+
+        if self.params is not None and (self.executor == 'process' or self.cache):
+            raise Exception(f"Step {self.function.__name__} has params, so it cannot run in a process or be cached.")
+
+        if self.ids is not None and self.params is None:
+            raise Exception(f"Step {self.function.__name__} has ids but no params.")
+
     def __call__(self, *args, **kwargs):
-        if len(args) < 1 or not inspect.isclass(type(args[0])):
+        if len(args) < 1:
             raise Exception("Step decorated function must be called with an instance of staircase.")
 
-        is_staircase_test_subclass = False
-        for resolver in args[0].__class__.__mro__:
-            if resolver.__name__ == 'StaircaseTest':
-                is_staircase_test_subclass = True
-
-        if not is_staircase_test_subclass:
+        # Every StaircaseTest subclass has a plan, the base class and other classes do not
+        if getattr(type(args[0]), '_plan', None) is None:
             raise Exception(
                 'Step decorator can only be called when it decorates an instance method defined in a class.')
 
-        results = self.function(args[0])
+        # The body of a coroutine step only runs once it is awaited, so that is when its fixtures are checked out
+        is_coroutine = inspect.iscoroutinefunction(self.function)
+
+        if self.params is not None:
+            if is_coroutine:
+                return self._acall_with_params(args[0])
+            return self._call_with_params(args[0])
+
+        with _running_step(args[0], self.function.__name__), \
+                _using_fixtures(args[0], () if is_coroutine else self.fixtures):
+            results = self.function(args[0])
+
+        # Coroutine steps hand back an awaitable that stores the result once the step has finished
+        if inspect.isawaitable(results):
+            return self._await_results(args[0], results, self.fixtures if is_coroutine else ())
+
+        return self._store_results(args[0], results)
 
+    async def _await_results(self, test_instance, awaitable, fixtures):
+        with _running_step(test_instance, self.function.__name__), _using_fixtures(test_instance, fixtures):
+            results = await awaitable
+        return self._store_results(test_instance, results)
+
+    def _store_results(self, test_instance, results, step_name=None):
         results = _convert_results(results)
         if results is None:
             raise Exception('Invalid return from step function. Must be a tuple of type (bool, any)')
 
-        # Store the result for later analysis as well as returning it
-        args[0].step_registry[self.function.__name__].results = results
+        # Store the result for later analysis as well as returning it, unless the step has already timed out
+        with test_instance._results_lock:
+            if not _step_was_cancelled():
+                test_instance.step_registry[step_name or self.function.__name__].results = results
         return results
 
-    @classmethod
-    def get_name(cls):
-        return cls.__name__[1:]  # ex. _Step => Step
+    def _call_with_params(self, test_instance):
+        outcome = _ParamsOutcome()
+        with _using_fixtures(test_instance, self.fixtures):
+            for instance, parameters in self._get_instances(test_instance):
+                started, start, cpu_start = time.time(), time.perf_counter(), time.thread_time()
+                with _running_step(test_instance, instance):
+                    results = self._store_results(test_instance, self.function(test_instance, *parameters), instance)
+
+                if not self._finish_instance(test_instance, instance, results, outcome, started, start, cpu_start):
+                    break
+
+        return self._store_results(test_instance, outcome.get_results())
+
+    async def _acall_with_params(self, test_instance):
+        outcome = _ParamsOutcome()
+        with _using_fixtures(test_instance, self.fixtures):
+            for instance, parameters in self._get_instances(test_instance):
+                started, start, cpu_start = time.time(), time.perf_counter(), time.thread_time()
+                with _running_step(test_instance, instance):
+                    results = await self.function(test_instance, *parameters)
+                results = self._store_results(test_instance, results, instance)
+
+                if not self._finish_instance(test_instance, instance, results, outcome, started, start, cpu_start):
+                    break
+
+        return self._store_results(test_instance, outcome.get_results())
+
+    def _get_instances(self, test_instance):
+        """
+        Pull the parameter sets one at a time, so that a generator over a large file is never loaded whole, adding a
+        name[id] step to the registry for each. Tuples are passed as separate arguments, anything else as one argument.
+        """
+        params = self.params(test_instance) if callable(self.params) else self.params
+        for index, parameters in enumerate(params):
+            if _step_was_cancelled():
+                return
+
+            instance_id = str(index) if self.ids is None else str(self.ids(parameters))
+            instance = test_instance._add_step_instance(self.function.__name__, instance_id)
+            yield instance, parameters if isinstance(parameters, tuple) else (parameters,)
 
     @staticmethod
-    def _get_test_instance():
+    def _finish_instance(test_instance, instance, results, outcome, started, start, cpu_start):
         """
-        Walk the stack until it finds the calling StaircaseTest instance
+        Record the metrics of a finished instance and report it, returning whether to go on to the next parameter set.
         """
-        obj_in_frame = None
-        i = 0
-
-        try:
-            while repr(obj_in_frame) != 'StaircaseTest':
-                obj_in_frame = _Substep._get_args_for_frame(i)[3].get('self')
-                i += 1
-            return obj_in_frame
-        except IndexError as e:
-            return None
+        if _step_was_cancelled():
+            return False
+
+        test_instance.step_registry[instance].metrics = _get_metrics(start, cpu_start)
+        test_instance._store_large_result(instance)
+        if test_instance._sinks:
+            test_instance._report_step(instance, started)
+
+        outcome.count += 1
+        if not results[0]:
+            outcome.failed_count += 1
+            return test_instance._fail_fast is None
+
+        return True
+
+    @classmethod
+    def get_name(cls):
+        return cls.__name__[1:]  # ex. _Step => Step
+
+
+class _ParamsOutcome:
+    def __init__(self):
+        self.count = 0
+        self.failed_count = 0
+
+    def get_results(self):
+        return self.failed_count == 0, f'{self.count - self.failed_count} of {self.count} parameter sets passed.'
 
 
 def _get_step_decorator_func(cls):
-    def dec(func=None, desc=None, on_pass=None, on_fail=None):
+    def dec(func=None, desc=None, on_pass=None, on_fail=None, executor=None, cache=False, cache_inputs=None,
+            timeout=None, fixtures=None, params=None, ids=None):
         if func:
             return cls(func)
         else:
             def wrapper(function):
-                return cls(function, desc, on_pass, on_fail)
+                return cls(function, desc, on_pass, on_fail, executor, cache, cache_inputs, timeout, fixtures, params,
+                           ids)
 
             return wrapper
 
@@ -104,11 +260,11 @@ class _Substep:
         self.function = func
         self.desc = desc
 
-        self.test_instance = self._get_test_instance()
+        self.test_instance = _current_test.get()
         if self.test_instance is None:
             raise Exception('Substep can only be defined within a test instance.')
 
-        self.parent_function = self._get_parent_function_name()
+        self.parent_function = _current_step.get()
 
         # ex. parent_function.substep_function
         self.substep_name = f"{self.parent_function}.{self.function.__name__}"
@@ -120,18 +276,94 @@ class _Substep:
             raise Exception('A substep cannot rely on a on_pass or on_fail that the parent step does not rely on.')
 
     def __call__(self, *args, **kwargs):
+        started, start, cpu_start = time.time(), time.perf_counter(), time.thread_time()
         results = self.function(*args)
 
+        if inspect.isawaitable(results):
+            return self._await_results(results, started, start, cpu_start)
+
+        return self._register_results(results, started, _get_metrics(start, cpu_start))
+
+    async def _await_results(self, awaitable, started, start, cpu_start):
+        results = await awaitable
+        return self._register_results(results, started, _get_metrics(start, cpu_start))
+
+    def _register_results(self, results, started, metrics):
         # Result is interpreted in the same way as other steps
         results = _convert_results(results)
         if results is None:
             raise Exception('Invalid return from substep function. Must be a tuple of type (bool, any)')
 
-        substep = SubstepRegistration(desc=self.desc, substep_name=self.substep_name)
-        self.test_instance.step_registry[self.parent_function].substeps.append(substep)
+        if _step_was_cancelled():
+            return results
+
+        self.test_instance.step_registry[self.parent_function].substeps.record(self.substep_name, self.desc, results,
+                                                                               metrics)
+        if self.test_instance._substep_sinks:
+            substep = SubstepRegistration(desc=self.desc, substep_name=self.substep_name, results=results,
+                                          metrics=metrics)
+            self.test_instance._report_substep(self.parent_function, substep, started)
 
         return results
 
+    def map(self, iterable, max_failures=10):
+        """
+        Run the substep once for each item of the iterable, passing the item as its only argument. The items are
+        consumed one at a time, so the iterable may be a generator over a large file.
+
+        All the calls are recorded as a single substep, holding a pass/fail flag for each item and the return values of
+        the first max_failures failures. Returns (whether every item passed, the SubstepBatchRegistration).
+        """
+        if inspect.iscoroutinefunction(self.function):
+            return self._amap(iterable, max_failures)
+
+        started, start, cpu_start = time.time(), time.perf_counter(), time.thread_time()
+        batch = SubstepBatchRegistration(desc=self.desc, substep_name=self.substep_name)
+        for item in iterable:
+            self._add_to_batch(batch, self.function(item), max_failures)
+
+        batch.metrics = _get_metrics(start, cpu_start)
+        return self._register_batch(batch, started)
+
+    async def _amap(self, iterable, max_failures):
+        started, start, cpu_start = time.time(), time.perf_counter(), time.thread_time()
+        batch = SubstepBatchRegistration(desc=self.desc, substep_name=self.substep_name)
+        for item in iterable:
+            self._add_to_batch(batch, await self.function(item), max_failures)
+
+        batch.metrics = _get_metrics(start, cpu_start)
+        return self._register_batch(batch, started)
+
+    @staticmethod
+    def _add_to_batch(batch, results, max_failures):
+        results = _convert_results(results)
+        if results is None:
+            raise Exception('Invalid return from substep function. Must be a tuple of type (bool, any)')
+
+        index = batch.count
+        if index & 7 == 0:
+            batch.passed_flags.append(0)
+
+        if results[0]:
+            batch.passed_flags[-1] |= 1 << (index & 7)
+        else:
+            batch.failed_count += 1
+            if len(batch.failures) < max_failures:
+                batch.failures.append((index, results[1]))
+
+        batch.count += 1
+
+    def _register_batch(self, batch, started):
+        batch.results = (batch.failed_count == 0, None)
+        if _step_was_cancelled():
+            return batch.results[0], batch
+
+        self.test_instance.step_registry[self.parent_function].substeps.append(batch)
+        if self.test_instance._substep_sinks:
+            self.test_instance._report_substep(self.parent_function, batch, started)
+
+        return batch.results[0], batch
+
     def _dependencies_are_ok(self):
         parent_on_pass = self.test_instance.step_registry[self.parent_function].on_pass
         parent_on_fail = self.test_instance.step_registry[self.parent_function].on_fail
@@ -152,36 +384,10 @@ class _Substep:
 
         return on_pass_ok and on_fail_ok
 
-    def _get_parent_function_name(self):
-        return inspect.stack()[3].function
-
     @classmethod
     def get_name(cls):
         return cls.__name__[1:]
 
-    @staticmethod
-    def _get_test_instance():
-        """
-        Walk the stack until it finds the calling StaircaseTest instance
-        """
-        obj_in_frame = None
-        i = 0
-
-        try:
-            while repr(obj_in_frame) != 'StaircaseTest':
-                obj_in_frame = _Substep._get_args_for_frame(i)[3].get('self')
-                i += 1
-            return obj_in_frame
-        except IndexError as e:
-            return None
-
-    @staticmethod
-    def _get_args_for_frame(stack_level: int):
-        frame = inspect.currentframe()
-        outer_frames = inspect.getouterframes(frame)
-        caller_frame = outer_frames[stack_level][0]
-        return inspect.getargvalues(caller_frame)
-
 
 def Substep(func=None, desc=None, on_pass=None, on_fail=None):
     if func:
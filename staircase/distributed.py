@@ -0,0 +1,201 @@
+from staircase.executor import _run_step_in_worker
+from multiprocessing.connection import Listener, Client
+from concurrent.futures import Future
+from dataclasses import dataclass
+from collections import deque
+from typing import Dict
+import threading
+import socket
+import os
+
+
+@dataclass(slots=True)
+class _Job:
+    step_name: str
+    payload: bytes
+    future: Future
+    lost_workers: int = 0
+
+
+class Coordinator:
+    """
+    Hands steps to worker nodes connected over TCP, see run_worker. When a run is given a coordinator, its main flight
+    steps are sent to the workers as soon as the steps they depend on have finished, along with the results of those
+    steps, and their results and substeps are sent back into the run's step_registry. Coroutine steps and parametrized
+    steps still run in the process running the test.
+
+    Workers import the test class from its module, so it must be importable on every node, as for steps run in a
+    process. A step whose worker disconnects is handed to another worker, until it has lost max_lost_workers workers.
+    Steps wait for a worker if none are connected.
+
+    Workers must give the same authkey, which is random unless one is given. Messages are pickled, so only workers that
+    are trusted should be given the key. ResultStores used with a coordinator must keep their files in a directory
+    every node can read.
+    """
+    MAX_IN_FLIGHT = 64
+    MAX_LOST_WORKERS = 3
+
+    def __init__(self, host='127.0.0.1', port=0, authkey=None, max_in_flight=MAX_IN_FLIGHT,
+                 max_lost_workers=MAX_LOST_WORKERS):
+        self.authkey = authkey.encode() if isinstance(authkey, str) else authkey or os.urandom(16).hex().encode()
+
+        # The number of steps a run dispatches at once. Steps beyond the number of workers wait here for a free worker.
+        self.max_in_flight = max_in_flight
+        self.max_lost_workers = max_lost_workers
+
+        self._listener = Listener((host, port), authkey=self.authkey)
+        self._jobs = deque()
+        self._workers: Dict[str, threading.Thread] = {}
+        self._condition = threading.Condition()
+        self._closed = False
+
+        threading.Thread(target=self._accept_workers, daemon=True).start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def address(self):
+        """
+        The (host, port) workers connect to.
+        """
+        return self._listener.address
+
+    @property
+    def worker_count(self):
+        with self._condition:
+            return len(self._workers)
+
+    def wait_for_workers(self, count, timeout=None):
+        """
+        Wait until at least count workers are connected, returning whether they are.
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: len(self._workers) >= count, timeout)
+
+    def submit(self, step_name, payload) -> Future:
+        """
+        Queue a step for the next free worker, returning a future for its pickled (results, substeps, cpu_time).
+        """
+        job = _Job(step_name, payload, Future())
+        with self._condition:
+            if self._closed:
+                raise Exception(f'Can not run step {step_name}, the coordinator is closed.')
+            self._jobs.append(job)
+            self._condition.notify_all()
+        return job.future
+
+    def close(self):
+        """
+        Stop accepting workers and tell connected workers to exit. Steps still queued fail.
+        """
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            jobs, self._jobs = list(self._jobs), deque()
+            self._condition.notify_all()
+
+        for job in jobs:
+            job.future.set_exception(Exception(f'Step {job.step_name} did not run, the coordinator was closed.'))
+
+        self._listener.close()
+
+    def _accept_workers(self):
+        while True:
+            try:
+                connection = self._listener.accept()
+                message = connection.recv()
+            except (OSError, EOFError):
+                if self._closed:
+                    return
+                continue  # A worker that failed to connect or authenticate
+
+            if not isinstance(message, tuple) or message[0] != 'register':
+                connection.close()
+                continue
+
+            worker = threading.Thread(target=self._serve_worker, args=(connection, message[1]), daemon=True)
+            with self._condition:
+                self._workers[message[1]] = worker
+                self._condition.notify_all()
+            worker.start()
+
+    def _serve_worker(self, connection, name):
+        try:
+            while True:
+                job = self._next_job()
+                if job is None:
+                    connection.send(('stop',))
+                    return
+
+                # A step that timed out while it was queued has been cancelled
+                if not job.future.running() and not job.future.set_running_or_notify_cancel():
+                    continue
+
+                try:
+                    connection.send(('step', job.payload))
+                    status, data = connection.recv()
+                except (OSError, EOFError):
+                    self._reschedule(job, name)
+                    return
+
+                if status == 'result':
+                    job.future.set_result(data)
+                else:
+                    job.future.set_exception(Exception(data))
+        except (OSError, EOFError):
+            pass
+        finally:
+            connection.close()
+            with self._condition:
+                self._workers.pop(name, None)
+                self._condition.notify_all()
+
+    def _next_job(self):
+        with self._condition:
+            self._condition.wait_for(lambda: self._jobs or self._closed)
+            return None if self._closed else self._jobs.popleft()
+
+    def _reschedule(self, job, worker_name):
+        job.lost_workers += 1
+        if job.lost_workers >= self.max_lost_workers:
+            job.future.set_exception(Exception(f'Step {job.step_name} did not finish, {job.lost_workers} workers '
+                                               f'running it disconnected, the last was {worker_name}.'))
+            return
+
+        with self._condition:
+            if self._closed:
+                job.future.set_exception(Exception(f'Step {job.step_name} did not run, the coordinator was closed.'))
+                return
+            self._jobs.appendleft(job)
+            self._condition.notify_all()
+
+
+def run_worker(address, authkey, name=None):
+    """
+    Connect to a coordinator and run the steps it sends until it closes. Returns once the coordinator has closed or
+    gone away.
+    """
+    authkey = authkey.encode() if isinstance(authkey, str) else authkey
+    name = name or f'{socket.gethostname()}:{os.getpid()}'
+
+    with Client(tuple(address), authkey=authkey) as connection:
+        connection.send(('register', name))
+        while True:
+            try:
+                message = connection.recv()
+            except (OSError, EOFError):
+                return
+
+            if message[0] == 'stop':
+                return
+
+            try:
+                reply = ('result', _run_step_in_worker(message[1]))
+            except Exception as e:
+                reply = ('error', f'{type(e).__name__}: {str(e)}')
+            connection.send(reply)
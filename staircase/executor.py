@@ -0,0 +1,172 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from staircase.logger import DefaultLogger
+import threading
+import atexit
+import pickle
+import time
+
+EXECUTORS = (None, 'process')
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+# Test instances kept by each worker process, one per test class
+_worker_tests = {}
+
+# The pools of steps running in a process of their own, by their future
+_step_pools = {}
+_step_pools_lock = threading.Lock()
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """
+    Get the process pool shared by every process step, creating it on first use.
+    """
+    global _process_pool
+
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor()
+            atexit.register(_process_pool.shutdown)
+        return _process_pool
+
+
+def _discard_process_pool(pool):
+    global _process_pool
+
+    with _process_pool_lock:
+        if _process_pool is pool:
+            _process_pool = None
+
+
+def submit_step_to_process(test, step_name, dependencies, coordinator=None, own_process=False):
+    """
+    Run a step in a worker process, or on a worker of the coordinator if one is given, along with the results of the
+    given dependencies so that the step can read them with get_return_from_step. Returns a future for the pickled
+    (results, substeps, cpu_time) of the step.
+
+    own_process runs the step in a new process rather than the shared pool, so that stop_process_step can kill it if it
+    times out. Otherwise a step that hangs would hold a worker of the shared pool, and keep the interpreter from
+    exiting, until it returned.
+    """
+    shipped_results = {}
+    for dependency in dependencies:
+        if test.step_registry[dependency].results != (None, None):
+            shipped_results[dependency] = test.step_registry[dependency].results
+
+    payload = _dump_payload(test, step_name, shipped_results)
+    if coordinator is not None:
+        return coordinator.submit(step_name, payload)
+
+    if own_process:
+        pool = ProcessPoolExecutor(max_workers=1)
+        future = pool.submit(_run_step_in_worker, payload)
+        with _step_pools_lock:
+            _step_pools[future] = pool
+        future.add_done_callback(_release_step_pool)
+        return future
+
+    pool = get_process_pool()
+    try:
+        return pool.submit(_run_step_in_worker, payload)
+    except BrokenProcessPool:
+        # A worker of the old pool died, start a new one
+        _discard_process_pool(pool)
+        return get_process_pool().submit(_run_step_in_worker, payload)
+
+
+def stop_process_step(future):
+    """
+    Stop a step that timed out. A step in a process of its own is killed along with the process, any other step is
+    only cancelled if it has not started yet.
+    """
+    with _step_pools_lock:
+        pool = _step_pools.pop(future, None)
+
+    if pool is None:
+        future.cancel()
+        return
+
+    # ProcessPoolExecutor has no public way to stop a running call before Python 3.14
+    for process in list(pool._processes.values()):
+        process.kill()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _release_step_pool(future):
+    with _step_pools_lock:
+        pool = _step_pools.pop(future, None)
+
+    if pool is not None:
+        pool.shutdown(wait=False)
+
+
+def load_process_results(step_name, future):
+    """
+    Get the (results, substeps, cpu_time) of a step from its finished future.
+    """
+    try:
+        return pickle.loads(future.result())
+    except BrokenProcessPool:
+        raise Exception(f'The worker process running step {step_name} exited unexpectedly.')
+
+
+def _dump_payload(test, step_name, shipped_results):
+    try:
+        logger = pickle.dumps(test.logger)
+    except Exception:
+        logger = None  # The worker falls back to the default logger
+
+    try:
+        return pickle.dumps((type(test), step_name, shipped_results, logger, test.retries, test.max_restart_retries,
+                             test._result_store))
+    except Exception as e:
+        for dependency, results in shipped_results.items():
+            try:
+                pickle.dumps(results)
+            except Exception:
+                raise Exception(f'Step {step_name} cannot run in a process, the return value of step {dependency} '
+                                f'cannot be pickled. {str(e)}')
+
+        raise Exception(f'Step {step_name} cannot run in a process, test class {type(test).__name__} cannot be pickled. '
+                        f'It must be importable from its module. {str(e)}')
+
+
+def _run_step_in_worker(payload):
+    test_class, step_name, shipped_results, logger, retries, max_restart_retries, result_store = pickle.loads(payload)
+
+    test = _get_worker_test(test_class)
+    test.logger = pickle.loads(logger) if logger is not None else DefaultLogger.get_default()
+    test.retries = retries
+    test.max_restart_retries = max_restart_retries
+    test._result_store = result_store
+
+    test._reset()
+    for step, results in shipped_results.items():
+        test.step_registry[step].results = results
+
+    cpu_start = time.thread_time()
+    test.step_registry[step_name].method_reference(test)
+    cpu_time = time.thread_time() - cpu_start
+
+    # Large return values are sent back as a handle to the file they are stored in
+    test._store_large_result(step_name)
+
+    registration = test.step_registry[step_name]
+    try:
+        return pickle.dumps((registration.results, registration.substeps, cpu_time))
+    except Exception as e:
+        raise Exception(f'The return value of step {step_name} cannot be pickled to send it back from the worker process. '
+                        f'{str(e)}')
+    finally:
+        # The parent process owns these results, including any files they are stored in, so forget them here rather
+        # than letting the next reset of this test remove them
+        for step in (*shipped_results, step_name):
+            test.step_registry[step].results = (None, None)
+
+
+def _get_worker_test(test_class):
+    if test_class not in _worker_tests:
+        _worker_tests[test_class] = test_class()
+    return _worker_tests[test_class]
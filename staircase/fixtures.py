@@ -0,0 +1,209 @@
+from staircase.types import FixtureScope
+from contextlib import contextmanager, ExitStack
+from contextvars import ContextVar
+from typing import Dict
+import threading
+import inspect
+import atexit
+
+# The values of the fixtures checked out by the step currently running
+_step_fixtures = ContextVar('staircase_step_fixtures', default={})
+
+# Every fixture defined, so that their values can be closed at the end of a scope
+_fixtures = []
+_fixtures_lock = threading.Lock()
+
+
+class _FixturePool:
+    """
+    The values of a fixture for one instance of its scope. Values are created when first checked out, up to the size
+    of the pool, and then reused. Without a size, one value is shared by every checkout.
+    """
+
+    def __init__(self, fixture, size):
+        self.fixture = fixture
+        self.size = size
+        self.free = []
+        self.created = []
+        self.condition = threading.Condition()
+
+    def checkout(self):
+        with self.condition:
+            if self.size is None and self.created:
+                return self.created[0][0]
+
+            while not self.free and self.size is not None and len(self.created) >= self.size:
+                self.condition.wait()
+
+            if self.free:
+                return self.free.pop()
+
+            # Create the value while holding the lock, so that a shared value is only ever created once
+            value, finalizer = self.fixture._create()
+            self.created.append((value, finalizer))
+            return value
+
+    def check_in(self, value):
+        if self.size is None:
+            return
+
+        with self.condition:
+            self.free.append(value)
+            self.condition.notify()
+
+    def close(self):
+        with self.condition:
+            created, self.created, self.free = self.created, [], []
+
+        errors = []
+        for _, finalizer in reversed(created):
+            try:
+                finalizer()
+            except Exception as e:
+                errors.append(str(e))
+
+        if errors:
+            raise Exception(f'Fixture {self.fixture.name} could not be closed. {" ".join(errors)}')
+
+
+class _Fixture:
+    def __init__(self, func, scope: FixtureScope = FixtureScope.RUN, pool_size: int = None):
+        self.function = func
+        self.name = func.__name__
+        self.scope = scope
+        self.pool_size = pool_size
+
+        if not isinstance(self.scope, FixtureScope):
+            raise Exception(f"Fixture {self.name} has an invalid scope {self.scope}. Must be a FixtureScope.")
+
+        if self.pool_size is not None and (not isinstance(self.pool_size, int) or self.pool_size < 1):
+            raise Exception(f"Fixture {self.name} has an invalid pool size {self.pool_size}. "
+                            f"Must be a positive integer.")
+
+        # A pool of values for each instance of the scope, such as each test class for CLASS fixtures
+        self._pools: Dict[object, _FixturePool] = {}
+        self._pools_lock = threading.Lock()
+
+        with _fixtures_lock:
+            _fixtures.append(self)
+
+    def __repr__(self):
+        return f'Fixture {self.name}'
+
+    def get(self, test_instance):
+        """
+        Get the value of the fixture for a test, creating it if this is the first use in its scope. Pooled fixtures must
+        be checked out instead.
+        """
+        if self.pool_size is not None:
+            raise Exception(f'Fixture {self.name} is pooled, so it must be listed in the fixtures of the step using it.')
+        return self._get_pool(test_instance).checkout()
+
+    @contextmanager
+    def checkout(self, test_instance):
+        """
+        Take a value of the fixture for a test, giving it back to the pool once done.
+        """
+        pool = self._get_pool(test_instance)
+        value = pool.checkout()
+        try:
+            yield value
+        finally:
+            pool.check_in(value)
+
+    def close(self, key=None):
+        """
+        Close the values of the fixture for one instance of its scope, or for every instance if key is None.
+        """
+        with self._pools_lock:
+            if key is None:
+                pools, self._pools = list(self._pools.values()), {}
+            else:
+                pools = [self._pools.pop(key)] if key in self._pools else []
+
+        for pool in pools:
+            pool.close()
+
+    def _get_pool(self, test_instance):
+        key = _get_scope_key(self.scope, test_instance)
+        with self._pools_lock:
+            if key not in self._pools:
+                self._pools[key] = _FixturePool(self, self.pool_size)
+            return self._pools[key]
+
+    def _create(self):
+        # Generator fixtures yield their value, and are resumed to clean it up
+        if inspect.isgeneratorfunction(self.function):
+            generator = self.function()
+            value = next(generator)
+            return value, lambda: next(generator, None)
+
+        return self.function(), lambda: None
+
+
+def Fixture(func=None, scope: FixtureScope = FixtureScope.RUN, pool_size: int = None):
+    if func:
+        return _Fixture(func)
+    else:
+        def wrapper(function):
+            return _Fixture(function, scope, pool_size)
+
+        return wrapper
+
+
+def close_fixtures(scope: FixtureScope, test_instance=None):
+    """
+    Close the values of every fixture with the given scope. For RUN and CLASS scopes, only the values for the given
+    test instance are closed, or for every test if it is None.
+    """
+    key = _get_scope_key(scope, test_instance) if test_instance is not None else None
+
+    with _fixtures_lock:
+        fixtures = [fixture for fixture in _fixtures if fixture.scope == scope]
+
+    errors = []
+    for fixture in fixtures:
+        try:
+            fixture.close(key)
+        except Exception as e:
+            errors.append(str(e))
+
+    if errors:
+        raise Exception(' '.join(errors))
+
+
+def close_all_fixtures():
+    for scope in FixtureScope:
+        close_fixtures(scope)
+
+
+@contextmanager
+def _using_fixtures(test_instance, fixtures):
+    if not fixtures:
+        yield
+        return
+
+    # Check fixtures out in the same order for every step, so that steps waiting on pools cannot deadlock
+    values = dict(_step_fixtures.get())
+    with ExitStack() as checkouts:
+        for fixture in sorted(fixtures, key=lambda fixture: fixture.name):
+            values[fixture] = checkouts.enter_context(fixture.checkout(test_instance))
+
+        token = _step_fixtures.set(values)
+        try:
+            yield
+        finally:
+            _step_fixtures.reset(token)
+
+
+def _get_scope_key(scope, test_instance):
+    match scope:
+        case FixtureScope.RUN:
+            return id(test_instance)
+        case FixtureScope.CLASS:
+            return type(test_instance)
+        case _:
+            return scope
+
+
+atexit.register(close_all_fixtures)
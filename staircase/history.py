@@ -0,0 +1,127 @@
+from dataclasses import dataclass, field
+from typing import Dict, List
+import statistics
+import sqlite3
+import time
+
+
+class DurationStore:
+    """
+    Keeps the wall time of each step from past runs in an SQLite database, keyed on the test class and step name. Only
+    the last keep durations of each step are kept, and the expected duration of a step is their median.
+    """
+    KEEP = 20
+
+    def __init__(self, path, keep=KEEP):
+        self.path = path
+        self.keep = keep
+
+        with self._connect() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS durations (test TEXT NOT NULL, step TEXT NOT NULL, '
+                               'duration REAL NOT NULL, recorded REAL NOT NULL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS durations_by_step ON durations (test, step, recorded)')
+
+    def record(self, test_id, durations: Dict[str, float]):
+        """
+        Add the duration in seconds of each of the given steps of a run.
+        """
+        recorded = time.time()
+        with self._connect() as connection:
+            connection.executemany('INSERT INTO durations VALUES (?, ?, ?, ?)',
+                                   [(test_id, step, duration, recorded) for step, duration in durations.items()])
+
+            for step in durations:
+                connection.execute('DELETE FROM durations WHERE test = ? AND step = ? AND rowid NOT IN '
+                                   '(SELECT rowid FROM durations WHERE test = ? AND step = ? '
+                                   'ORDER BY recorded DESC, rowid DESC LIMIT ?)',
+                                   (test_id, step, test_id, step, self.keep))
+
+    def get_expected_durations(self, test_id) -> Dict[str, float]:
+        """
+        Get the expected duration in seconds of each step of a test that has run before.
+        """
+        durations = {}
+        with self._connect() as connection:
+            for step, duration in connection.execute('SELECT step, duration FROM durations WHERE test = ?', (test_id,)):
+                durations.setdefault(step, []).append(duration)
+
+        return {step: statistics.median(step_durations) for step, step_durations in durations.items()}
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.execute('PRAGMA journal_mode=WAL')
+        return _closing(connection)
+
+
+class _closing:
+    # sqlite3 connections commit as a context manager, but do not close
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self.connection.__enter__()
+
+    def __exit__(self, *exc_info):
+        try:
+            return self.connection.__exit__(*exc_info)
+        finally:
+            self.connection.close()
+
+
+@dataclass(slots=True)
+class RunEstimate:
+    """
+    How long a run of a test is expected to take, from the durations of past runs. Steps that have not run before are
+    counted as taking no time, and listed in unknown_steps.
+
+    The setup and teardown flights always run one step at a time, so parallel_time is their total plus the length of
+    the critical path through the main flight: the longest chain of steps that depend on each other.
+    """
+    expected_durations: Dict[str, float] = field(default_factory=lambda: {})
+    critical_path: List[str] = field(default_factory=lambda: [])
+    sequential_time: float = 0
+    parallel_time: float = 0
+    unknown_steps: List[str] = field(default_factory=lambda: [])
+
+
+def estimate_run(test, expected_durations: Dict[str, float], steps=None) -> RunEstimate:
+    """
+    Estimate how long running the given steps of a test takes, or every step if steps is None, given the expected
+    durations of its steps.
+    """
+    steps = set(test.ordered_list if steps is None else steps)
+    setup_steps, main_steps, teardown_steps = ([step for step in flight if step in steps]
+                                               for flight in (test._setup_steps, test._main_steps, test._teardown_steps))
+
+    estimate = RunEstimate(expected_durations=dict(expected_durations))
+    estimate.unknown_steps = [step for step in test.ordered_list if step in steps and step not in expected_durations]
+
+    def duration(step):
+        return expected_durations.get(step, 0)
+
+    estimate.sequential_time = sum(duration(step) for step in steps)
+
+    # The longest chain ending at each main flight step. Steps are in dependency order, so every dependency in the
+    # flight has been seen before the steps that depend on it.
+    finish_times = {}
+    previous = {}
+    for step in main_steps:
+        start, longest = 0, None
+        for dependency in test._get_step_dependencies(step):
+            if dependency in finish_times and (longest is None or finish_times[dependency] > start):
+                start, longest = finish_times[dependency], dependency
+
+        finish_times[step] = start + duration(step)
+        previous[step] = longest
+
+    path = []
+    if any(finish_times.values()):
+        step = max(main_steps, key=lambda main_step: finish_times[main_step])
+        while step is not None:
+            path.append(step)
+            step = previous.get(step)
+
+    estimate.critical_path = path[::-1]
+    estimate.parallel_time = sum(duration(step) for step in setup_steps + teardown_steps) + \
+        max(finish_times.values(), default=0)
+    return estimate
@@ -1,4 +1,8 @@
 from abc import ABC, abstractmethod
+import threading
+import atexit
+import queue
+import time
 
 
 class StaircaseLogger(ABC):
@@ -10,6 +14,12 @@ class StaircaseLogger(ABC):
     def error(self, *args, **kwargs):
         pass
 
+    def flush(self):
+        """
+        Write out any buffered records. Called at the end of every run.
+        """
+        pass
+
 
 class DefaultLogger(StaircaseLogger):
     def info(self, *args, **kwargs):
@@ -21,3 +31,113 @@ class DefaultLogger(StaircaseLogger):
     @staticmethod
     def get_default() -> 'StaircaseLogger':
         return DefaultLogger()
+
+
+class QueueLogger(StaircaseLogger):
+    """
+    Hands records to a background thread that writes them to another logger, so that steps never wait on slow output
+    such as files or sockets. The writer takes up to batch_size records at a time, or whatever has arrived within
+    flush_interval seconds, and writes consecutive records of the same level in a single call.
+
+    At most max_queue_size records wait to be written. When the queue is full, records either block the caller until
+    there is room, or are dropped and counted if drop_when_full is set. Everything queued is written when the logger is
+    flushed or closed, which happens at the end of each run and when the interpreter exits.
+    """
+    _STOP = object()
+
+    def __init__(self, target: StaircaseLogger = None, max_queue_size=10000, batch_size=500, flush_interval=0.1,
+                 drop_when_full=False):
+        self.target = target if target is not None else DefaultLogger.get_default()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.drop_when_full = drop_when_full
+        self.dropped_count = 0
+
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._closed = False
+        self._writer = threading.Thread(target=self._write_records, daemon=True)
+        self._writer.start()
+
+        atexit.register(self.close)
+
+    def info(self, *args, **kwargs):
+        self._put(('info', self._format(args, kwargs)))
+
+    def error(self, *args, **kwargs):
+        self._put(('error', self._format(args, kwargs)))
+
+    def flush(self):
+        """
+        Wait until every record queued so far has been written.
+        """
+        if not self._closed:
+            self._queue.join()
+
+    def close(self):
+        if self._closed:
+            return
+
+        self._queue.put(QueueLogger._STOP)
+        self._writer.join()
+        self._closed = True
+
+        # Let go of the logger, so that closed loggers are not kept until the interpreter exits
+        atexit.unregister(self.close)
+
+        if self.dropped_count > 0:
+            self.target.error(f'{self.dropped_count:,} log records were dropped, because the log queue was full or they '
+                              f'could not be written.')
+
+    @staticmethod
+    def _format(args, kwargs):
+        # Format on the caller's thread, so that later changes to the arguments don't affect the record
+        return kwargs.get('sep', ' ').join(str(arg) for arg in args)
+
+    def _put(self, record):
+        if self._closed:
+            self._write_batch([record])
+            return
+
+        try:
+            self._queue.put(record, block=not self.drop_when_full)
+        except queue.Full:
+            self.dropped_count += 1
+
+    def _write_records(self):
+        while True:
+            batch = [self._queue.get()]
+
+            # Gather more records until the batch is full or the flush interval has passed
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size and batch[-1] is not QueueLogger._STOP:
+                try:
+                    batch.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+
+            records = [record for record in batch if record is not QueueLogger._STOP]
+            try:
+                self._write_batch(records)
+            except Exception:
+                # Keep the writer running, the records are reported as dropped when the logger is closed
+                self.dropped_count += len(records)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+            if len(records) < len(batch):
+                return
+
+    def _write_batch(self, records):
+        lines = []
+        level = None
+
+        for record_level, line in records:
+            if record_level != level and lines:
+                getattr(self.target, level)('\n'.join(lines))
+                lines = []
+            level = record_level
+            lines.append(line)
+
+        if lines:
+            getattr(self.target, level)('\n'.join(lines))
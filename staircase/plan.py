@@ -0,0 +1,184 @@
+from staircase.decorators import _Task, _Setup, _Test, _Teardown
+from staircase.types import StepRegistration, SubstepLog, SubstepRetention
+from utils.classes import get_members
+from typing import Dict
+
+
+class StaircasePlan:
+    """
+    The validated and ordered steps of a StaircaseTest subclass. It is built once, when the subclass is defined, and
+    shared by every instance of it. Instances get their own copy of the step registry to hold the results of a run.
+    """
+
+    def __init__(self, test_class):
+        self.step_registry: Dict[str, StepRegistration] = {}
+        self._register_steps(test_class)
+        self._check_dependencies_exist()
+
+        setup_steps, main_steps, teardown_steps = self._get_sorted_steps()
+        self.setup_steps = tuple(setup_steps)
+        self.main_steps = tuple(main_steps)
+        self.teardown_steps = tuple(teardown_steps)
+        self.ordered_list = self.setup_steps + self.main_steps + self.teardown_steps
+
+        self._assign_indices_to_directory()
+
+        # The steps that wait on each step passing, and those that wait on it failing
+        self.pass_dependents, self.fail_dependents = self._get_dependents()
+
+    def new_step_registry(self, substep_retention=SubstepRetention.ALL,
+                          substep_limit=None) -> Dict[str, StepRegistration]:
+        """
+        Get a step registry for a test instance, with no results recorded.
+        """
+        return {
+            name: StepRegistration(step.step_type, step.step_index, step.on_pass, step.on_fail, step.desc,
+                                   step.method_reference, substeps=SubstepLog(substep_retention, substep_limit))
+            for name, step in self.step_registry.items()
+        }
+
+    def _register_steps(self, test_class):
+        for step_name in get_members(test_class):
+            for step in self._get_flight_classes():
+                if isinstance(getattr(test_class, step_name), step):
+                    self.register_step(step.__name__, -1,
+                                       step_name,
+                                       getattr(test_class, step_name),
+                                       self._get_attr_for_step(test_class, step_name, 'on_pass'),
+                                       self._get_attr_for_step(test_class, step_name, 'on_fail'),
+                                       getattr(test_class, step_name).desc)
+                    break
+
+        all_steps = tuple(self.step_registry)
+        for registered_step in self.step_registry:
+            if self.step_registry[registered_step].on_pass == ('$ALL',):
+                self.step_registry[registered_step].on_pass = tuple(
+                    step for step in all_steps if step != registered_step)
+
+            if self.step_registry[registered_step].on_fail == ('$ALL',):
+                self.step_registry[registered_step].on_fail = tuple(
+                    step for step in all_steps if step != registered_step)
+
+    def _get_flight_classes(self):
+        return [
+            _Setup,
+            _Task,
+            _Test,
+            _Teardown
+        ]
+
+    def register_step(self, stype, index, name, ref, on_pass, on_fail, desc):
+        self.step_registry[name] = StepRegistration(
+            step_type=stype,
+            step_index=index,
+            on_pass=on_pass,
+            on_fail=on_fail,
+            desc=desc,
+            method_reference=ref,
+        )
+
+    @staticmethod
+    def _get_attr_for_step(test_class, step_name: str, attr_name: str):
+        res = None
+        try:
+            res = getattr(getattr(test_class, step_name), attr_name)
+        except AttributeError:
+            pass
+
+        return res
+
+    def _check_dependencies_exist(self):
+        for step_name, step in self.step_registry.items():
+            for condition, dependencies in (('on_pass', step.on_pass), ('on_fail', step.on_fail)):
+                for dependency in dependencies or ():
+                    if dependency not in self.step_registry:
+                        raise Exception(f'Step {step_name} has {condition} step {dependency}, which does not exist.')
+
+    def _get_step_dependencies(self, step):
+        return self.step_registry[step].on_pass or self.step_registry[step].on_fail or ()
+
+    def _get_dependents(self):
+        pass_dependents = {step: [] for step in self.ordered_list}
+        fail_dependents = {step: [] for step in self.ordered_list}
+
+        # on_fail is only checked when a step has no on_pass, see _get_step_dependencies
+        for step in self.ordered_list:
+            if self.step_registry[step].on_pass:
+                for dependency in self.step_registry[step].on_pass:
+                    pass_dependents[dependency].append(step)
+            else:
+                for dependency in self.step_registry[step].on_fail or ():
+                    fail_dependents[dependency].append(step)
+
+        return ({step: tuple(dependents) for step, dependents in pass_dependents.items()},
+                {step: tuple(dependents) for step, dependents in fail_dependents.items()})
+
+    def _get_sorted_steps(self):
+        ordered_list = self._get_dependency_order()
+
+        setup_steps = []
+        task_steps = []
+        teardown_steps = []
+
+        for step_name in ordered_list:
+            match self.step_registry[step_name].step_type:
+                case '_Setup':
+                    setup_steps.append(step_name)
+                case '_Task':
+                    task_steps.append(step_name)
+                case '_Test':
+                    task_steps.append(step_name)
+                case '_Teardown':
+                    teardown_steps.append(step_name)
+                case _:
+                    raise Exception(
+                        f'An error occurred while ordering steps. Step {self.step_registry[step_name]} with type {self.step_registry[step_name].step_type} is invalid.')
+
+        return setup_steps, task_steps, teardown_steps
+
+    def _get_dependency_order(self):
+        """
+        Order the steps so that each step comes after the steps it depends on. This is a depth first search over the
+        registry, visiting each step's dependencies in the order they were declared and placing a step once all of its
+        dependencies have been placed. It keeps an explicit stack so deep dependency chains cannot hit the recursion
+        limit, and visits each step and dependency once.
+        """
+        ordered_list = []
+        placed = set()
+
+        for root in self.step_registry:
+            if root in placed:
+                continue
+
+            # The current path from the root, and the dependencies left to visit for each step on it
+            path = [root]
+            on_path = {root}
+            remaining_dependencies = [iter(self._get_step_dependencies(root))]
+
+            while path:
+                dependency = next(remaining_dependencies[-1], None)
+
+                if dependency is None:
+                    step = path.pop()
+                    remaining_dependencies.pop()
+                    on_path.remove(step)
+                    placed.add(step)
+                    ordered_list.append(step)
+
+                elif dependency in placed:
+                    continue
+
+                elif dependency in on_path:
+                    loop = path[path.index(dependency):] + [dependency]
+                    raise Exception(f"Dependency loop found between steps on_fail and/or on_pass: {' -> '.join(loop)}.")
+
+                else:
+                    path.append(dependency)
+                    on_path.add(dependency)
+                    remaining_dependencies.append(iter(self._get_step_dependencies(dependency)))
+
+        return ordered_list
+
+    def _assign_indices_to_directory(self):
+        for index, step in enumerate(self.ordered_list, 1):
+            self.step_registry[step].step_index = index
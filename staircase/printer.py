@@ -1,5 +1,6 @@
 from staircase.logger import StaircaseLogger
-from staircase.types import StepRegistration
+from staircase.types import StepRegistration, SubstepBatchRegistration
+from staircase.history import RunEstimate
 from utils.strings import pad_to
 from colorama import Fore
 from typing import Dict
@@ -17,41 +18,78 @@ class StaircasePrinter:
     RES_NUM_PADDING = 10
     STEP_TYPE_PADDING = 10
     DESC_PADDING = 30
+    METRIC_PADDING = 10
 
-    def __init__(self, steps, step_registry: Dict[str, StepRegistration], logger: StaircaseLogger):
+    def __init__(self, steps, step_registry: Dict[str, StepRegistration], logger: StaircaseLogger, attempts=1,
+                 estimate: RunEstimate = None):
         self.logger = logger
         self.steps = steps
         self.step_registry: Dict[str, StepRegistration] = step_registry
+        self.attempts = attempts
+
+        # Expected durations of the steps, shown in the preview
+        self.estimate = estimate
+
+        # Lines of the table being printed, written to the logger in one call once the table is complete
+        self._lines = []
+
+        # Which metric columns the table being printed has
+        self._show_times = False
+        self._show_memory = False
+        self._show_expected = False
 
     def print(self, mode=StaircasePrintMode.SUMMARY):
+        self._lines = []
+
+        steps_with_metrics = [self.step_registry[step].metrics for step in self.steps
+                              if getattr(self.step_registry[step], 'metrics', None) is not None]
+        self._show_times = mode != StaircasePrintMode.DISPLAY and len(steps_with_metrics) > 0
+        self._show_memory = self._show_times and any(metrics.peak_memory is not None for metrics in steps_with_metrics)
+        self._show_expected = mode == StaircasePrintMode.DISPLAY and self.estimate is not None
+
         match mode:
             case StaircasePrintMode.SUMMARY:
                 self._print_header("Staircase Execution Summary")
                 self._print_table_cap()
                 self._print_steps(print_substeps=True)
+                self._print_attempts()
             case StaircasePrintMode.DISPLAY:
                 self._print_header("Staircase Execution Preview")
                 self._print_table_cap()
                 self._print_steps(print_substeps=False, display_mode=True)
+                self._print_estimate()
             case StaircasePrintMode.RESULTS:
                 self._print_header("Staircase Test Results")
                 self._print_table_cap()
                 self._print_steps(print_substeps=True, only_tests=True)
+                self._print_attempts()
             case _:
                 self.logger.error(f"Staircase print mode not recognized. Mode: {mode}")
 
+        if self._lines:
+            self.logger.info("\n".join(self._lines))
+            self._lines = []
+
+    def _write(self, *parts):
+        self._lines.append(" ".join(parts))
+
     def _print_table_cap(self):
-        self.logger.info(
-            f"\n{pad_to('STEP #', StaircasePrinter.RES_NUM_PADDING)}{pad_to('TYPE', StaircasePrinter.STEP_TYPE_PADDING)}{'STATUS'}   {pad_to('NAME', StaircasePrinter.DESC_PADDING)}{'DESCRIPTION'}")
-        self.logger.info("-"*StaircasePrinter.HEADER_WIDTH)
+        self._write(
+            f"\n{pad_to('STEP #', StaircasePrinter.RES_NUM_PADDING)}{pad_to('TYPE', StaircasePrinter.STEP_TYPE_PADDING)}{'STATUS'}   {pad_to('NAME', StaircasePrinter.DESC_PADDING)}{self._get_metric_columns('TIME', 'CPU', 'PEAK MEM')}{self._get_expected_column('EXPECTED')}{'DESCRIPTION'}")
+        self._write("-"*StaircasePrinter.HEADER_WIDTH)
+
+    def _print_attempts(self):
+        if self.attempts > 1:
+            self._write("-" * StaircasePrinter.HEADER_WIDTH)
+            self._write(f"Completed after {self.attempts} attempts ({self.attempts - 1} restarts).")
 
     def _print_header(self, content):
         cap = f"*" * StaircasePrinter.HEADER_WIDTH
         mid_whitespace = " " * (int((StaircasePrinter.HEADER_WIDTH - len(content)) / 2) - 1)
         mid = f"*{mid_whitespace}{content}{mid_whitespace}{'' if (StaircasePrinter.HEADER_WIDTH - len(content)) % 2 == 0 else ' '}*"
-        self.logger.info(cap)
-        self.logger.info(mid)
-        self.logger.info(cap)
+        self._write(cap)
+        self._write(mid)
+        self._write(cap)
 
     def _print_steps(self, print_substeps, display_mode=False, only_tests=False):
         step_counter = 1
@@ -68,19 +106,91 @@ class StaircasePrinter:
         passed = step_registry[step].results[0]
         step_return = step_registry[step].results[1]
         desc = step_registry[step].desc
+        if getattr(step_registry[step], 'cached', False):
+            desc = f"(cached) {desc}"
 
         pf = f"SKIP" if display_mode or passed is None else f'{Fore.GREEN}PASS{Fore.RESET}' if passed else f'{Fore.RED}FAIL{Fore.RESET}'
 
-        self.logger.info(
-            f"{pad_to(str(step_no), StaircasePrinter.RES_NUM_PADDING)}{pad_to(stype, StaircasePrinter.STEP_TYPE_PADDING)}{pf}     {pad_to(step, StaircasePrinter.DESC_PADDING)}{desc}")
+        self._write(
+            f"{pad_to(str(step_no), StaircasePrinter.RES_NUM_PADDING)}{pad_to(stype, StaircasePrinter.STEP_TYPE_PADDING)}{pf}     {pad_to(step, StaircasePrinter.DESC_PADDING)}{self._get_metrics_columns(step_registry[step].metrics)}{self._get_expected_column(self._get_expected_duration(step))}{desc}")
 
         if not passed and step_return is not None:
-            self.logger.info(" " * (StaircasePrinter.RES_NUM_PADDING + StaircasePrinter.STEP_TYPE_PADDING - 1), f"{Fore.RED if passed is not None else ''}└{'x' if passed is not None else ''} {str(step_return)}{Fore.RESET if passed is not None else ''}")
+            self._write(" " * (StaircasePrinter.RES_NUM_PADDING + StaircasePrinter.STEP_TYPE_PADDING - 1), f"{Fore.RED if passed is not None else ''}└{'x' if passed is not None else ''} {str(step_return)}{Fore.RESET if passed is not None else ''}")
 
         if substeps and len(self.step_registry[step].substeps) > 0:
             self._print_substeps(step_no, step)
 
+    def _get_metrics_columns(self, metrics):
+        if metrics is None:
+            return self._get_metric_columns('-', '-', '-')
+
+        return self._get_metric_columns(_format_seconds(metrics.wall_time), _format_seconds(metrics.cpu_time),
+                                        _format_bytes(metrics.peak_memory) if metrics.peak_memory is not None else '-')
+
+    def _get_metric_columns(self, wall_time, cpu_time, peak_memory):
+        columns = ''
+        if self._show_times:
+            columns += f"{pad_to(wall_time, StaircasePrinter.METRIC_PADDING)}{pad_to(cpu_time, StaircasePrinter.METRIC_PADDING)}"
+        if self._show_memory:
+            columns += pad_to(peak_memory, StaircasePrinter.METRIC_PADDING)
+        return columns
+
+    def _get_expected_duration(self, step):
+        if not self._show_expected or step not in self.estimate.expected_durations:
+            return '-'
+
+        critical = ' *' if step in self.estimate.critical_path else ''
+        return f"{_format_seconds(self.estimate.expected_durations[step])}{critical}"
+
+    def _get_expected_column(self, expected):
+        return pad_to(expected, StaircasePrinter.METRIC_PADDING + 2) if self._show_expected else ''
+
+    def _print_estimate(self):
+        if not self._show_expected:
+            return
+
+        self._write("-" * StaircasePrinter.HEADER_WIDTH)
+        self._write(f"Expected run time: {_format_seconds(self.estimate.sequential_time)} one step at a time, "
+                    f"{_format_seconds(self.estimate.parallel_time)} with ideal parallelism.")
+        if self.estimate.critical_path:
+            self._write(f"Critical path (*): {' -> '.join(self.estimate.critical_path)}")
+        if self.estimate.unknown_steps:
+            self._write(f"{len(self.estimate.unknown_steps)} steps have not run before and are not counted.")
+
     def _print_substeps(self, step_no, step_name):
-        for i, substep in enumerate(self.step_registry[step_name].substeps):
-            full_step_no = f" └{step_no}.{i + 1}"
+        substeps = self.step_registry[step_name].substeps
+        for position, substep in substeps.items():
+            full_step_no = f" └{step_no}.{position + 1}"
             self._print_result_line(full_step_no, substep.substep_name, {substep.substep_name: substep}, substeps=False, only_tests=True)
+
+            if isinstance(substep, SubstepBatchRegistration):
+                self._print_batch_summary(substep)
+
+        if substeps.dropped_count > 0:
+            indent = " " * (StaircasePrinter.RES_NUM_PADDING + StaircasePrinter.STEP_TYPE_PADDING - 1)
+            self._write(indent, f"└ {substeps.dropped_count:,} more substeps not kept "
+                                     f"({substeps.passed_count:,} passed / {substeps.failed_count:,} failed in total)")
+
+    def _print_batch_summary(self, batch: SubstepBatchRegistration):
+        indent = " " * (StaircasePrinter.RES_NUM_PADDING + StaircasePrinter.STEP_TYPE_PADDING - 1)
+        summary = str(batch)
+        if batch.failures:
+            summary += f", first {len(batch.failures)} failures:"
+
+        self._write(indent, f"└ {summary}")
+        for index, value in batch.failures:
+            self._write(indent, f"{Fore.RED}└x [{index}] {str(value)}{Fore.RESET}")
+
+
+def _format_seconds(seconds):
+    if seconds < 1:
+        return f"{seconds * 1000:.1f}ms"
+    return f"{seconds:.2f}s"
+
+
+def _format_bytes(size):
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            return f"{size:.0f}{unit}" if unit == 'B' else f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}GB"
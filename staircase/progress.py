@@ -0,0 +1,207 @@
+from staircase.sinks import ResultSink, FLIGHTS, _get_test_id
+from typing import Dict
+import shutil
+import time
+import sys
+
+# Escape codes to return to the start of the line and clear it
+CLEAR_LINE = '\r\x1b[K'
+
+
+class ProgressSink(ResultSink):
+    """
+    Shows how far a run has got while it runs: the steps finished out of those to run in each flight, the failures so
+    far, the step running and the expected time left. Each failure is written as soon as it happens.
+
+    On a terminal the progress is a single line, redrawn at most refresh_rate times a second. Otherwise, such as when
+    output goes to a file or a CI log, a progress line is written at most every interval seconds.
+
+    The time left comes from the expected durations in the run's history, if it was given one, and otherwise from the
+    average time per step so far. Progress is kept as running totals, so redrawing costs the same however many steps
+    the test has.
+    """
+    substeps = False
+
+    def __init__(self, stream=None, refresh_rate=10, interval=10):
+        self.stream = stream
+        self.refresh_rate = refresh_rate
+        self.interval = interval
+
+        self._out = None
+        self._live = False
+        self._test = None
+
+        # The steps of the run that have not finished yet, and how many steps of each flight there are and have finished
+        self._pending = set()
+        self._totals: Dict[str, int] = {}
+        self._finished: Dict[str, int] = {}
+        self._failed_count = 0
+        self._skipped_count = 0
+        self._attempt = 1
+
+        # The steps running now, in the order they started
+        self._running: Dict[str, float] = {}
+
+        self._expected_durations: Dict[str, float] = {}
+        self._expected_remaining = 0
+        self._started = 0
+        self._last_render = 0
+
+    def start(self, test):
+        self._out = self.stream if self.stream is not None else sys.stdout
+        self._live = self._out.isatty()
+        self._test = test
+
+        history = test._open_duration_store(test.run_args.get('history'))
+        self._expected_durations = history.get_expected_durations(_get_test_id(test)) if history is not None else {}
+
+        self._attempt = 1
+        self._running = {}
+        self._count_steps()
+
+        self._started = time.monotonic()
+        self._last_render = 0
+        self._refresh()
+
+    def step_started(self, test, step_name):
+        self._running[step_name] = time.monotonic()
+        self._refresh()
+
+    def write(self, event: Dict):
+        if event['event'] != 'step':
+            return
+
+        if event['attempt'] != self._attempt:
+            # A restart clears the results of the steps it runs again
+            self._attempt = event['attempt']
+            self._count_steps()
+
+        step_name = event['step']
+        self._running.pop(step_name, None)
+
+        # Instances of parametrized steps are counted in the step they belong to, but their failures are still shown
+        if step_name in self._pending:
+            self._pending.remove(step_name)
+            self._finished[event['flight']] += 1
+            self._expected_remaining -= self._expected_durations.get(step_name, 0)
+            if event['status'] in ('fail', 'error'):
+                self._failed_count += 1
+            elif event['status'] == 'skip':
+                self._skipped_count += 1
+
+        if event['status'] in ('fail', 'error'):
+            self._write_failure(event)
+
+        self._refresh()
+
+    def finish(self, test):
+        self._render()
+        if self._live:
+            self._out.write('\n')
+        self._out.flush()
+
+        self._test = None
+        self._out = None
+
+    def _count_steps(self):
+        test = self._test
+        first_step, last_step = test.run_args.get('first_step', 1), test.run_args.get('last_step')
+        if last_step is None:
+            last_step = len(test.ordered_list)
+
+        steps = [step for step in test._get_ordered_steps(test._selected_steps)
+                 if test._step_is_qualified_to_run(first_step, last_step, step)
+                 or test.step_registry[step].results != (None, None)]
+
+        self._pending = set()
+        self._totals = {flight: 0 for flight in FLIGHTS.values()}
+        self._finished = {flight: 0 for flight in FLIGHTS.values()}
+        self._failed_count = self._skipped_count = 0
+        self._expected_remaining = 0
+
+        for step in steps:
+            flight = FLIGHTS[test.step_registry[step].step_type]
+            passed, value = test.step_registry[step].results
+            self._totals[flight] += 1
+
+            if (passed, value) == (None, None):
+                self._pending.add(step)
+                self._expected_remaining += self._expected_durations.get(step, 0)
+            else:
+                self._finished[flight] += 1
+                self._failed_count += passed is False
+                self._skipped_count += passed is None
+
+    def _refresh(self):
+        now = time.monotonic()
+        wait = 1 / self.refresh_rate if self._live else self.interval
+        if now - self._last_render >= wait:
+            self._render(now)
+
+    def _render(self, now=None):
+        self._last_render = now if now is not None else time.monotonic()
+        line = self._get_progress_line()
+
+        if self._live:
+            width = shutil.get_terminal_size().columns
+            self._out.write(CLEAR_LINE + line[:width - 1])
+        else:
+            self._out.write(line + '\n')
+        self._out.flush()
+
+    def _write_failure(self, event):
+        status = 'ERROR' if event['status'] == 'error' else 'FAIL'
+        line = f"{status:<7}{event['step']}"
+        if event['return'] is not None:
+            line += f": {event['return']}"
+
+        if self._live:
+            # Write the failure over the progress line, which is redrawn below it
+            self._out.write(CLEAR_LINE + line + '\n')
+            self._render()
+        else:
+            self._out.write(line + '\n')
+            self._out.flush()
+
+    def _get_progress_line(self):
+        parts = [f'{flight} {self._finished[flight]}/{total}' for flight, total in self._totals.items() if total]
+
+        if self._failed_count:
+            parts.append(f'{self._failed_count} failed')
+        if self._skipped_count:
+            parts.append(f'{self._skipped_count} skipped')
+
+        if self._running:
+            # Dicts keep their order, so the last key is the step that started most recently
+            running = f'running {next(reversed(self._running))}'
+            if len(self._running) > 1:
+                running += f' (+{len(self._running) - 1})'
+            parts.append(running)
+
+        time_left = self._get_time_left()
+        if time_left is not None:
+            parts.append(f'ETA {_format_duration(time_left)}')
+
+        return ' | '.join(parts)
+
+    def _get_time_left(self):
+        if not self._pending:
+            return None
+
+        if self._expected_durations:
+            return max(self._expected_remaining, 0)
+
+        finished = sum(self._finished.values())
+        if not finished:
+            return None
+        return (time.monotonic() - self._started) / finished * len(self._pending)
+
+
+def _format_duration(seconds):
+    minutes, seconds = divmod(int(seconds + 0.5), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f'{hours}h{minutes:02d}m'
+    if minutes:
+        return f'{minutes}m{seconds:02d}s'
+    return f'{seconds}s'
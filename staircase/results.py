@@ -0,0 +1,105 @@
+from dataclasses import dataclass
+from typing import Tuple
+import tempfile
+import shutil
+import atexit
+import mmap
+import os
+
+# Files mapped by this process, so that each stored result is only mapped once
+_mapped_files = {}
+
+
+@dataclass(slots=True)
+class StoredResult:
+    """
+    A handle to a step's return value kept in a file by a ResultStore, which stands in for the value in the step
+    registry. It is small enough to send to another process, which can then map the same file.
+    """
+    path: str
+    size: int
+    format: str
+    shape: Tuple[int, ...]
+    dtype: str = None  # The dtype of NumPy arrays, which are opened as arrays again
+
+    def __str__(self):
+        return f'<{self.size:,} byte result stored in {self.path}>'
+
+    def open(self):
+        """
+        Get a read-only view of the value, without copying it. NumPy arrays are returned as arrays, other values as a
+        memoryview of the same format and shape as the value.
+        """
+        if self.path not in _mapped_files:
+            with open(self.path, 'rb') as f:
+                _mapped_files[self.path] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        buffer = _mapped_files[self.path]
+        if self.dtype is not None:
+            import numpy
+            return numpy.frombuffer(buffer, dtype=self.dtype).reshape(self.shape)
+
+        view = memoryview(buffer)
+        try:
+            return view.cast(self.format, self.shape)
+        except (TypeError, ValueError):
+            return view  # Formats memoryview cannot cast to are left as bytes
+
+    def delete(self):
+        # Views of the value that are still in use keep the mapping alive, so it is only forgotten here
+        _mapped_files.pop(self.path, None)
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class ResultStore:
+    """
+    Keeps step return values that are larger than threshold bytes in memory-mapped files, rather than in the step
+    registry. Only values that support the buffer protocol, such as bytes, bytearray, array.array and NumPy arrays, can
+    be stored. Other values stay in the registry.
+
+    Files are kept in directory, a new temporary directory by default, and are removed when the results of the step
+    are cleared by the next run, or when the process that created the store exits.
+    """
+    THRESHOLD = 1024 ** 2
+
+    def __init__(self, threshold=THRESHOLD, directory=None):
+        if not isinstance(threshold, int) or threshold < 1:
+            raise Exception(f'Invalid result store threshold {threshold}. Must be a positive number of bytes.')
+
+        self.threshold = threshold
+        self.directory = directory
+        if self.directory is None:
+            self.directory = tempfile.mkdtemp(prefix='staircase-results-')
+            atexit.register(shutil.rmtree, self.directory, True)
+        else:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def store(self, value):
+        """
+        Get a StoredResult for the value if it is large enough to store, otherwise the value itself.
+        """
+        if isinstance(value, (str, StoredResult)) or value is None:
+            return value
+
+        try:
+            view = memoryview(value)
+        except TypeError:
+            return value
+
+        if view.nbytes < self.threshold or not view.c_contiguous:
+            return value
+
+        dtype = None
+        if type(value).__module__ == 'numpy' and hasattr(value, 'dtype'):
+            if value.dtype.hasobject:
+                return value  # Arrays of Python objects only hold pointers
+            dtype = value.dtype.str
+
+        fd, path = tempfile.mkstemp(dir=self.directory, prefix='result-', suffix='.bin')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(view)
+
+        return StoredResult(path, view.nbytes, view.format, tuple(view.shape), dtype)
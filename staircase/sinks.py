@@ -0,0 +1,193 @@
+from staircase.types import StepRegistration, SubstepBatchRegistration, StepMetrics
+from xml.sax.saxutils import escape, quoteattr
+from abc import ABC, abstractmethod
+from typing import Dict
+import json
+
+MAX_VALUE_LENGTH = 200
+
+FLIGHTS = {
+    '_Setup': 'setup',
+    '_Task': 'main',
+    '_Test': 'main',
+    '_Teardown': 'teardown',
+}
+
+
+class ResultSink(ABC):
+    """
+    Receives the outcome of each step and substep as soon as it finishes, while the test is running. Events are dicts,
+    see get_step_event and get_substep_event. Sinks may be called from several threads, but never concurrently.
+    """
+    # Whether the sink is sent substep events. Steps with very many substeps are cheaper to run without them.
+    substeps = True
+
+    def start(self, test):
+        """
+        Called when a run of the test starts.
+        """
+        pass
+
+    def step_started(self, test, step_name):
+        """
+        Called when a step starts running. Steps that are skipped or replayed from the cache only finish.
+        """
+        pass
+
+    @abstractmethod
+    def write(self, event: Dict):
+        pass
+
+    def finish(self, test):
+        """
+        Called when a run of the test ends, whether or not it raised.
+        """
+        pass
+
+
+class JsonLinesSink(ResultSink):
+    """
+    Writes each event as one line of JSON, flushing after every line so that the file is complete up to the last step
+    that finished, even if the process dies.
+    """
+
+    def __init__(self, path, mode='a'):
+        self.path = path
+        self.mode = mode
+        self._file = None
+
+    def start(self, test):
+        if self._file is None:
+            self._file = open(self.path, self.mode, encoding='utf-8')
+
+        self._write_line({'event': 'start', 'test': _get_test_id(test), 'steps': len(test.ordered_list)})
+
+    def write(self, event: Dict):
+        self._write_line(event)
+
+    def finish(self, test):
+        results = [step.results[0] for step in test.step_registry.values()]
+        self._write_line({'event': 'finish', 'test': _get_test_id(test), 'attempts': test.attempts,
+                          'passed': results.count(True), 'failed': results.count(False),
+                          'skipped': results.count(None)})
+
+        self._file.close()
+        self._file = None
+
+    def _write_line(self, event):
+        self._file.write(json.dumps(event) + '\n')
+        self._file.flush()
+
+
+class JUnitXmlSink(ResultSink):
+    """
+    Writes a JUnit XML report with a test case per step and substep. Test cases are written as they finish, and the
+    closing tags once the run ends. The suite's totals are left for the reader to count, as they are not known until
+    the end.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def start(self, test):
+        self._file = open(self.path, 'w', encoding='utf-8')
+        self._file.write('<?xml version="1.0" encoding="UTF-8"?>\n<testsuites>\n')
+        self._file.write(f'  <testsuite name={quoteattr(_get_test_id(test))}>\n')
+        self._file.flush()
+
+    def write(self, event: Dict):
+        name = event['substep'] if event['event'] == 'substep' else event['step']
+
+        duration = event['duration'] if event['duration'] is not None else 0
+        case = f'    <testcase classname={quoteattr(event["test"])} name={quoteattr(name)} time="{duration:.6f}"'
+
+        value = escape(event['return']) if event['return'] is not None else ''
+        match event['status']:
+            case 'pass':
+                case += '/>\n'
+            case 'fail':
+                case += f'>\n      <failure message="Step failed.">{value}</failure>\n    </testcase>\n'
+            case 'error':
+                case += f'>\n      <error message="Step raised an exception.">{value}</error>\n    </testcase>\n'
+            case _:
+                case += f'>\n      <skipped message={quoteattr(event["return"] or "")}/>\n    </testcase>\n'
+
+        self._file.write(case)
+        self._file.flush()
+
+    def finish(self, test):
+        self._file.write('  </testsuite>\n</testsuites>\n')
+        self._file.close()
+        self._file = None
+
+
+def get_step_event(test, step_name, started, error: Exception = None) -> Dict:
+    """
+    Get the event for a finished step, which started at the given timestamp. If the step raised, the exception is given
+    as error.
+    """
+    step: StepRegistration = test.step_registry[step_name]
+    return {
+        'event': 'step',
+        'test': _get_test_id(test),
+        'step': step_name,
+        'index': step.step_index,
+        'type': step.step_type[1:],
+        'flight': FLIGHTS[step.step_type],
+        'status': 'error' if error is not None else _get_status(step.results[0]),
+        'return': get_reportable_value(error if error is not None else step.results[1]),
+        'on_pass': list(step.on_pass or ()),
+        'on_fail': list(step.on_fail or ()),
+        'cached': step.cached,
+        'attempt': test.attempts,
+        'started': started,
+        **_get_timing(step.metrics),
+    }
+
+
+def get_substep_event(test, step_name, substep, started=None) -> Dict:
+    """
+    Get the event for a finished substep. The start time is None for substeps that did not run in this process.
+    """
+    return {
+        'event': 'substep',
+        'test': _get_test_id(test),
+        'step': step_name,
+        'substep': substep.substep_name,
+        'index': test.step_registry[step_name].step_index,
+        'type': 'Substep',
+        'flight': FLIGHTS[test.step_registry[step_name].step_type],
+        'status': _get_status(substep.results[0]),
+        'return': get_reportable_value(substep if isinstance(substep, SubstepBatchRegistration)
+                                       else substep.results[1]),
+        'attempt': test.attempts,
+        'started': started,
+        **_get_timing(substep.metrics),
+    }
+
+
+def _get_test_id(test):
+    return f'{type(test).__module__}::{type(test).__qualname__}'
+
+
+def _get_timing(metrics: StepMetrics):
+    if metrics is None:
+        return {'duration': None, 'cpu_time': None, 'peak_memory': None}
+
+    return {'duration': metrics.wall_time, 'cpu_time': metrics.cpu_time, 'peak_memory': metrics.peak_memory}
+
+
+def _get_status(passed):
+    return 'skip' if passed is None else 'pass' if passed else 'fail'
+
+
+def get_reportable_value(value):
+    """
+    Get a value as a string, truncated to MAX_VALUE_LENGTH characters.
+    """
+    if value is None:
+        return None
+
+    value = str(value)
+    return value if len(value) <= MAX_VALUE_LENGTH else value[:MAX_VALUE_LENGTH - 3] + '...'
@@ -24,8 +24,7 @@ class DatTest(StaircaseTest):
             else:
                 return False, 'What the hell'
 
-        for i in range(5):
-            do_some_substep(i)
+        do_some_substep.map(range(5))
 
         @Substep(desc="This is a second substep")
         def second_substep():
@@ -0,0 +1,296 @@
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from staircase.printer import StaircasePrinter, StaircasePrintMode
+from staircase.types import StepRegistration, SubstepBatchRegistration, FixtureScope
+from staircase.logger import StaircaseLogger
+from staircase.test import StaircaseTest
+from staircase.sinks import get_reportable_value
+from staircase.fixtures import close_fixtures, close_all_fixtures
+from multiprocessing.util import Finalize
+from dataclasses import dataclass, field, replace
+from typing import Dict, List
+import importlib.util
+import itertools
+import importlib
+import fnmatch
+import time
+import sys
+import os
+
+# The files searched for tests in directories
+PATTERN = 'test*.py'
+
+
+@dataclass(slots=True)
+class SuiteTest:
+    """
+    A test class found by the suite runner. source is a module name, or the path of a file to load the module from.
+    A module that could not be imported is kept as a test with no class_name, which fails with the import error.
+    """
+    source: str
+    module_name: str
+    class_name: str
+    error: str = None
+
+    @property
+    def test_id(self) -> str:
+        if self.class_name is None:
+            return self.module_name
+        return f"{self.module_name}::{self.class_name}"
+
+
+@dataclass(slots=True)
+class SuiteReport:
+    """
+    The outcome of running one test of a suite. Return values in the step registry are converted to (truncated)
+    strings so that the report can be sent back from the worker process.
+    """
+    test_id: str
+    ordered_list: List[str] = field(default_factory=lambda: [])
+    step_registry: Dict[str, StepRegistration] = field(default_factory=lambda: {})
+    attempts: int = 0
+    duration: float = 0
+    output: List[str] = field(default_factory=lambda: [])
+    error: str = None
+    skipped: str = None  # Why the test did not run, if the suite stopped before it
+
+    @property
+    def passed(self) -> bool:
+        return self.error is None and self.skipped is None and all(step.results[0] is not False for step in self.step_registry.values())
+
+
+class _CapturingLogger(StaircaseLogger):
+    def __init__(self):
+        self.lines = []
+
+    def info(self, *args, **kwargs):
+        self.lines.append(' '.join(str(arg) for arg in args))
+
+    def error(self, *args, **kwargs):
+        self.lines.append(' '.join(str(arg) for arg in args))
+
+
+def discover_tests(paths, pattern=PATTERN) -> List[SuiteTest]:
+    """
+    Find the StaircaseTest subclasses defined in the given modules, files and directories. Directories are searched
+    recursively for files matching the pattern. Tests are sorted by their id. A module that cannot be imported does not
+    stop the others from being found, and is reported as a failed test when the suite runs.
+    """
+    tests = []
+    for path in paths:
+        for source in _get_sources(path, pattern):
+            try:
+                module = _import_source(source)
+            except (Exception, SystemExit) as e:
+                module_name = _get_module_name(os.path.abspath(source)) if source.endswith('.py') else source
+                error = f'Could not import {source}. {type(e).__name__}: {str(e)}'
+                tests.append(SuiteTest(source, module_name, None, error))
+                continue
+
+            for member in _get_test_classes(module):
+                tests.append(SuiteTest(source, module.__name__, member.__qualname__))
+
+    return sorted(tests, key=lambda test: test.test_id)
+
+
+def _get_test_classes(module):
+    return [member for member in vars(module).values()
+            if isinstance(member, type) and issubclass(member, StaircaseTest) and member is not StaircaseTest
+            and member.__module__ == module.__name__ and member._plan.ordered_list]
+
+
+def get_shard(tests: List[SuiteTest], shard: int, shard_count: int) -> List[SuiteTest]:
+    """
+    Get the tests for one of shard_count shards, numbered from 1. Tests are dealt out in order of their id, so every
+    node given the same tests gets the same, disjoint shards.
+    """
+    if not 1 <= shard <= shard_count:
+        raise Exception(f'Invalid shard {shard}/{shard_count}. The shard must be between 1 and {shard_count}.')
+
+    return tests[shard - 1::shard_count]
+
+
+def run_suite(tests: List[SuiteTest], processes=None, run_kwargs=None) -> List[SuiteReport]:
+    """
+    Run each test in a pool of worker processes, returning a report per test in the order given. A worker process
+    that crashes is reported as an error for the test it was running, and the rest of the suite carries on.
+
+    If run_kwargs has fail_fast='suite', no more tests are started once one fails. The tests that are already running
+    finish, and the rest are reported as skipped.
+    """
+    run_kwargs = run_kwargs or {}
+    fail_fast = run_kwargs.get('fail_fast') == 'suite'
+    reports = {}
+    interrupted = []
+    stop_reason = None
+
+    with ProcessPoolExecutor(max_workers=processes, initializer=_start_worker) as pool:
+        # Only submit as many tests as there are workers, so that the suite can stop without the pool having queued
+        # the rest already
+        pending = iter(tests)
+        futures = {pool.submit(_run_test_in_worker, test, run_kwargs): test
+                   for test in itertools.islice(pending, processes or os.cpu_count() or 1)}
+
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                test = futures.pop(future)
+                try:
+                    report = reports[test.test_id] = future.result()
+                except BrokenProcessPool:
+                    interrupted.append(test)
+                    continue
+
+                if fail_fast and stop_reason is None and not report.passed:
+                    stop_reason = f'Did not run, the suite stopped after {report.test_id} failed.'
+
+            if stop_reason is None:
+                for test in itertools.islice(pending, len(done)):
+                    try:
+                        futures[pool.submit(_run_test_in_worker, test, run_kwargs)] = test
+                    except BrokenProcessPool:
+                        interrupted.append(test)
+
+        # Tests that were never submitted because the pool broke
+        if stop_reason is None:
+            interrupted.extend(pending)
+
+    # A crash breaks the whole pool, so run the tests it interrupted one at a time to find the one that crashed
+    for test in interrupted:
+        if stop_reason is not None:
+            break
+
+        with ProcessPoolExecutor(max_workers=1, initializer=_start_worker) as pool:
+            try:
+                reports[test.test_id] = pool.submit(_run_test_in_worker, test, run_kwargs).result()
+            except BrokenProcessPool:
+                reports[test.test_id] = SuiteReport(test.test_id, error='The worker process running the test crashed.')
+
+        if fail_fast and not reports[test.test_id].passed:
+            stop_reason = f'Did not run, the suite stopped after {test.test_id} failed.'
+
+    return [reports.get(test.test_id) or SuiteReport(test.test_id, skipped=stop_reason) for test in tests]
+
+
+def print_suite_summary(reports: List[SuiteReport], logger: StaircaseLogger, show_all=True):
+    """
+    Print the steps of every test as one summary, followed by the outcome of each test.
+    """
+    ordered_list = []
+    step_registry = {}
+    for report in reports:
+        for step in report.ordered_list:
+            merged_name = f"{report.test_id.split('::')[-1]}.{step}"
+            ordered_list.append(merged_name)
+            step_registry[merged_name] = report.step_registry[step]
+
+    printer = StaircasePrinter(ordered_list, step_registry, logger)
+    printer.print(StaircasePrintMode.SUMMARY if show_all else StaircasePrintMode.RESULTS)
+
+    logger.info("-" * StaircasePrinter.HEADER_WIDTH)
+    for report in reports:
+        if report.skipped is not None:
+            logger.info(f"{'SKIP':<7}{report.test_id}")
+            logger.info(f"       └x {report.skipped}")
+            continue
+
+        status = 'PASS' if report.passed else 'ERROR' if report.error is not None else 'FAIL'
+        retries = f", {report.attempts} attempts" if report.attempts > 1 else ''
+        logger.info(f"{status:<7}{report.test_id} ({report.duration:.2f}s{retries})")
+        if report.error is not None:
+            logger.info(f"       └x {report.error}")
+
+    passed = sum(1 for report in reports if report.passed)
+    skipped = sum(1 for report in reports if report.skipped is not None)
+    skipped_count = f", {skipped} skipped" if skipped else ''
+    logger.info(f"\n{len(reports)} tests, {passed} passed, {len(reports) - passed - skipped} failed{skipped_count}.")
+
+
+def _start_worker():
+    # Worker processes exit without running atexit handlers, so close the fixtures they shared when the pool shuts down
+    Finalize(None, close_all_fixtures, exitpriority=10)
+
+
+def _run_test_in_worker(test: SuiteTest, run_kwargs) -> SuiteReport:
+    report = SuiteReport(test.test_id)
+    if test.error is not None:
+        report.error = test.error
+        return report
+
+    logger = _CapturingLogger()
+    start = time.perf_counter()
+
+    try:
+        test_class = getattr(_import_source(test.source), test.class_name)
+        test_instance = test_class(logger=logger)
+        test_instance.run(**run_kwargs)
+
+        report.ordered_list = test_instance._expand_instances(test_instance.ordered_list)
+        report.step_registry = {name: _get_reportable_step(step) for name, step in test_instance.step_registry.items()}
+        report.attempts = test_instance.attempts
+    except Exception as e:
+        report.error = f'{type(e).__name__}: {str(e)}'
+
+    try:
+        close_fixtures(FixtureScope.CLASS)
+    except Exception as e:
+        report.error = report.error or f'{type(e).__name__}: {str(e)}'
+
+    report.duration = time.perf_counter() - start
+    report.output = logger.lines
+    return report
+
+
+def _get_reportable_step(step: StepRegistration) -> StepRegistration:
+    return replace(step, method_reference=None, results=(step.results[0], _get_reportable_value(step.results[1])),
+                   substeps=step.substeps.map_values(_get_reportable_value))
+
+
+def _get_reportable_value(value):
+    if value is None:
+        return None
+
+    if isinstance(value, SubstepBatchRegistration):
+        return replace(value, failures=[(index, _get_reportable_value(failure)) for index, failure in value.failures])
+
+    return get_reportable_value(value)
+
+
+def _get_sources(path, pattern):
+    if os.path.isdir(path):
+        for directory, subdirectories, files in os.walk(path):
+            subdirectories[:] = sorted(d for d in subdirectories if not d.startswith(('.', '__')))
+            for file in sorted(fnmatch.filter(files, pattern)):
+                yield os.path.join(directory, file)
+    else:
+        yield path
+
+
+def _get_module_name(path):
+    # Name the module after its path, so that tests in files with the same name in different directories don't clash
+    return os.path.splitext(os.path.relpath(path))[0].replace(os.sep, '.').lstrip('.')
+
+
+def _import_source(source):
+    if not source.endswith('.py'):
+        return importlib.import_module(source)
+
+    path = os.path.abspath(source)
+    module_name = _get_module_name(path)
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+
+    # Let the file import its neighbours, as it would when run as a script
+    if os.path.dirname(path) not in sys.path:
+        sys.path.insert(0, os.path.dirname(path))
+
+    spec = importlib.util.spec_from_file_location(module_name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    try:
+        spec.loader.exec_module(module)
+    except BaseException:
+        del sys.modules[module_name]
+        raise
+
+    return module
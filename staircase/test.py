@@ -1,10 +1,28 @@
-from staircase.decorators import _Task, _Setup, _Test, _Teardown
 from staircase.logger import StaircaseLogger, DefaultLogger
 from staircase import StaircasePrinter, StaircasePrintMode
-from staircase.types import StepRegistration
-from utils.classes import get_members
+from staircase.types import StepRegistration, StepMetrics, SubstepLog, SubstepRetention, FixtureScope
+from staircase.executor import submit_step_to_process, stop_process_step, load_process_results
+from staircase.plan import StaircasePlan
+from staircase.cache import StepCache
+from staircase.sinks import ResultSink, get_step_event, get_substep_event, _get_test_id
+from staircase.history import DurationStore, estimate_run
+from staircase.fixtures import _step_fixtures, close_fixtures
+from staircase.results import ResultStore, StoredResult
+from staircase.distributed import Coordinator
+from staircase.decorators import _current_step, _step_cancelled, _step_was_cancelled
+from concurrent.futures import ThreadPoolExecutor, Future, TimeoutError, wait, FIRST_COMPLETED
 from typing_extensions import final
+from contextlib import contextmanager
 from typing import Dict
+import tracemalloc
+import contextvars
+import fnmatch
+import threading
+import cProfile
+import asyncio
+import inspect
+import time
+import os
 
 """
   █████████  ███████████   █████████   █████ ███████████     █████████    █████████    █████████  ██████████
@@ -55,7 +73,9 @@ The steps are run in an arbitrary order unless the on_pass or on_fail parameters
 
 
 class ResetSignal(Exception):
-    pass
+    def __init__(self, message='', from_step=None):
+        super().__init__(message, from_step)
+        self.from_step = from_step
 
 class MaxResetsExceeded(Exception):
     pass
@@ -66,7 +86,15 @@ class StaircaseTest:
         "step_no_padding": 6
     }
 
-    def __init__(self, logger: StaircaseLogger = None, restart_retries=1):
+    # The ordered steps of the test, built once per subclass when the subclass is defined
+    _plan: StaircasePlan = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._plan = StaircasePlan(cls)
+
+    def __init__(self, logger: StaircaseLogger = None, restart_retries=1,
+                 substep_retention: SubstepRetention = SubstepRetention.ALL, substep_limit: int = None):
         if self.__class__.__name__ == "StaircaseTest":
             raise Exception("StaircaseTest cannot be instantiated on its own, it must be subclassed by the test class.")
 
@@ -80,60 +108,440 @@ class StaircaseTest:
         self.max_restart_retries = restart_retries
         self.retries = 0
 
-        self.ordered_list = []
+        # The number of times the last run was attempted, and the steps that keep their results from an earlier attempt
+        self.attempts = 0
+        self._kept_steps = set()
+
+        # Which substeps are kept for the summary, see SubstepRetention
+        self.substep_retention = substep_retention
+        self.substep_limit = substep_limit
+
         self.run_args = {}
 
-        self.step_registry: Dict[str, StepRegistration] = {}
-        self._register_steps()
+        self._step_cache = None
+        self._cache_keys = {}
+
+        # Where the outcome of each step is sent as it finishes, for the current run
+        self._sinks = ()
+        self._substep_sinks = ()
+        self._sink_lock = threading.Lock()
+
+        # Held while the results of a step are stored or it times out, so a step cannot store results once it timed out
+        self._results_lock = threading.Lock()
+
+        # Whether the current run measures the memory of each step, and where it writes a profile of each step
+        self._track_memory = False
+        self._started_tracemalloc = False
+        self._profile_dir = None
+
+        # The CPU time each step's body used on the thread that ran it, see _running_body
+        self._body_cpu_times = {}
+
+        # The only steps the current run runs, if it was asked to run some steps and what they need
+        self._selected_steps = None
+
+        # The steps a rerun runs again, keeping the results of the other steps, see rerun
+        self._rerun_steps = None
+
+        # Where large return values are kept instead of the step registry, see ResultStore
+        self._result_store = None
 
-        self._setup_steps, self._main_steps, self._teardown_steps = self._get_sorted_steps()
-        self.ordered_list = self._setup_steps + self._main_steps + self._teardown_steps
+        # Where the current run sends its main flight steps to run on other nodes, see Coordinator
+        self._coordinator = None
 
-        self._assign_indices_to_directory()
+        # When the current run stops starting new steps after a failure, why it stopped, and the steps that are already
+        # known to be skipped with the reason for each
+        self._fail_fast = None
+        self._stop_reason = None
+        self._skipped_steps: Dict[str, str] = {}
+
+        # Why the current run was cancelled, see cancel, and the event that cancels the current rerun once set, see rerun
+        self._cancel_reason = None
+        self._cancel_event = None
+
+        # The monotonic time the current run must finish by, and the seconds before it kept for the teardown flight
+        self._deadline = None
+        self._teardown_budget = 0
+
+        self._event_loop = None
+        self._event_loop_thread = None
+        self._event_loop_lock = threading.Lock()
+
+        self._setup_steps = self._plan.setup_steps
+        self._main_steps = self._plan.main_steps
+        self._teardown_steps = self._plan.teardown_steps
+        self.ordered_list = list(self._plan.ordered_list)
+
+        self.step_registry: Dict[str, StepRegistration] = self._plan.new_step_registry(substep_retention, substep_limit)
 
     def __repr__(self):
         return 'StaircaseTest'
 
     @final
-    def run(self, first_step=1, last_step=None, show_all=True):
-        if last_step is None:
-            last_step = len(self.ordered_list)
+    def run(self, first_step=1, last_step=None, show_all=True, workers=None, cache_dir=None, no_cache=False,
+            sinks=None, track_memory=False, profile=False, deadline=None, teardown_budget=None, history=None,
+            result_store=None, only=None, match=None, fail_fast=None, coordinator=None):
+        """
+        Run the test, one flight after another. The main flight is run on a thread pool if workers is greater than 1,
+        and on the worker nodes of a coordinator if one is given. See the README for what each option does.
+        """
+        history = self._prepare_run({name: value for name, value in locals().items() if name != 'self'})
+        last_step = self.run_args['last_step']
 
-        self.run_args = {
-            'first_step': first_step,
-            'last_step': last_step,
-            'show_all': show_all,
-        }
+        try:
+            while True:
+                try:
+                    self._run_flight(first_step, last_step, self._setup_steps)
+                    self._run_flight(first_step, last_step, self._main_steps, self._get_main_workers(workers))
+                    self._run_flight(first_step, last_step, self._teardown_steps)
+                    break
+                except ResetSignal as reset:
+                    self._resume_from(reset.from_step)
 
-        self._check_first_last(first_step, last_step)
+            self._log_test_results(show_all)
+            self._record_durations(history)
+        finally:
+            self._close_event_loop()
+            self._finish_run()
 
-        self._reset()
+    @final
+    async def arun(self, first_step=1, last_step=None, show_all=True, cache_dir=None, no_cache=False, sinks=None,
+                   track_memory=False, profile=False, deadline=None, teardown_budget=None, history=None,
+                   result_store=None, only=None, match=None, fail_fast=None, coordinator=None):
+        """
+        Run the test on the running event loop.
+
+        Main flight steps are started as soon as the steps they depend on (on_pass/on_fail) have finished, so
+        independent coroutine steps run concurrently. Synchronous steps are called directly on the event loop. Takes the
+        same arguments as run, except workers.
+        """
+        history = self._prepare_run({name: value for name, value in locals().items() if name != 'self'})
+        last_step = self.run_args['last_step']
 
         try:
-            self._run_flight(first_step, last_step, self._setup_steps)
-            self._run_flight(first_step, last_step, self._main_steps)
-            self._run_flight(first_step, last_step, self._teardown_steps)
+            while True:
+                try:
+                    await self._arun_flight(first_step, last_step, self._setup_steps)
+                    await self._arun_flight(first_step, last_step, self._main_steps,
+                                            concurrent=not self._measures_one_step_at_a_time())
+                    await self._arun_flight(first_step, last_step, self._teardown_steps)
+                    break
+                except ResetSignal as reset:
+                    self._resume_from(reset.from_step)
 
             self._log_test_results(show_all)
-        except ResetSignal:
-            self.run(**self.run_args)
+            self._record_durations(history)
+        finally:
+            self._finish_run()
+
+    def _prepare_run(self, run_args):
+        """
+        Check the arguments of run or arun and set up the run, returning the DurationStore to record the run to.
+        """
+        if run_args['last_step'] is None:
+            run_args['last_step'] = len(self.ordered_list)
+        self.run_args = run_args
+
+        self._check_first_last(run_args['first_step'], run_args['last_step'])
+        self._check_workers(run_args.get('workers'))
+        self._check_sinks(run_args['sinks'])
+        history = self._open_duration_store(run_args['history'])
+        self._check_result_store(run_args['result_store'])
+        selected_steps = self._get_selected_steps(run_args['only'], run_args['match']) \
+            if self._rerun_steps is None else self._rerun_steps
+        self._check_fail_fast(run_args['fail_fast'])
+        self._check_coordinator(run_args['coordinator'])
+
+        self._step_cache = self._open_step_cache(run_args['cache_dir'], run_args['no_cache'])
+        self._start_run()
+        self._selected_steps = selected_steps
+        self._result_store = run_args['result_store']
+        self._fail_fast = run_args['fail_fast']
+        self._coordinator = run_args['coordinator']
+        self._start_instrumentation(run_args['track_memory'], run_args['profile'])
+        self._start_deadline(run_args['deadline'], run_args['teardown_budget'])
+        self._start_sinks(run_args['sinks'])
+        return history
+
+    def _finish_run(self):
+        # Release what the run set up, whether or not it finished
+        close_fixtures(FixtureScope.RUN, self)
+        self._stop_instrumentation()
+        self._deadline = None
+        self._coordinator = None
+        self._finish_sinks()
+        self.logger.flush()
+
+    @final
+    def rerun(self, steps, teardown=True, cancelled=None, **run_kwargs):
+        """
+        Run the given steps again, along with every step that depends on them directly or transitively, keeping the
+        results of the other steps from the last run. teardown=False leaves out the teardown steps that depend on them,
+        so that whatever the setup steps made is kept for the next rerun. cancelled is a threading.Event that cancels
+        the rerun as cancel does once it is set, even if it was set before the rerun started. Takes the same arguments
+        as run, except only and match.
+        """
+        for step in steps:
+            if step not in self._plan.step_registry:
+                raise Exception(f'Can not rerun step {step}, which is not a step.')
+
+        rerun_steps = self._get_dependents_closure(steps)
+        if not teardown:
+            rerun_steps -= set(self._teardown_steps)
 
-    def display(self):
-        printer = StaircasePrinter(self.ordered_list, self.step_registry, self.logger)
+        self._rerun_steps = rerun_steps
+        self._cancel_event = cancelled
+        try:
+            self.run(**run_kwargs)
+        finally:
+            self._rerun_steps = None
+            self._cancel_event = None
+
+    def cancel(self, reason='Did not run, the run was cancelled.'):
+        """
+        Stop the current run from starting any more setup and main flight steps, which are skipped with the given
+        reason. Steps that are running finish, and the teardown flight still runs. May be called from any thread.
+        """
+        self._cancel_reason = reason
+
+    def display(self, history=None, only=None, match=None):
+        """
+        Print the steps in the order they will run. If history is given, as for run, the expected duration of each step
+        is shown along with the critical path and the expected run time. only and match preview the steps that run
+        would run with them.
+        """
+        history = self._open_duration_store(history)
+        steps = self._get_ordered_steps(self._get_selected_steps(only, match))
+
+        estimate = None
+        if history is not None:
+            estimate = estimate_run(self, history.get_expected_durations(_get_test_id(self)), steps)
+
+        printer = StaircasePrinter(steps, self.step_registry, self.logger, estimate=estimate)
         printer.print(StaircasePrintMode.DISPLAY)
 
-    def _reset(self):
-        # Clear step and substep results
-        for step in self.step_registry:
+    def _get_selected_steps(self, only, match):
+        """
+        Get the steps needed to run the steps named in only or matching the pattern match, or None to run every step.
+        """
+        if only is None and match is None:
+            return None
+
+        targets = set()
+        for step in only or ():
+            if step not in self.step_registry:
+                raise Exception(f'Can not run step {step}, which is not a step.')
+            targets.add(step)
+
+        if match is not None:
+            targets.update(fnmatch.filter(self.ordered_list, match))
+
+        if not targets:
+            raise Exception(f'No steps match {match}.')
+
+        selected = set(targets)
+        for step in targets:
+            selected |= self._get_dependency_closure(step)
+
+        # Teardown steps that clean up after the selected steps, and need nothing else
+        for step in self._teardown_steps:
+            dependencies = set(self._get_step_dependencies(step))
+            if dependencies and dependencies <= selected:
+                selected.add(step)
+
+        return selected
+
+    def _get_ordered_steps(self, selected_steps):
+        if selected_steps is None:
+            return self.ordered_list
+        return [step for step in self.ordered_list if step in selected_steps]
+
+    def _start_run(self):
+        self.retries = 0
+        self.attempts = 1
+        self._kept_steps = set()
+        self._cancel_reason = None
+        self._reset(steps=self._rerun_steps)
+
+    def _resume_from(self, from_step):
+        """
+        Prepare to run the test again after a restart, from the given step onwards. Steps before it keep their results if
+        they finished. Those that had not, such as steps still waiting on a slow step when a parallel run restarted,
+        run again.
+        """
+        self.attempts += 1
+        restart_index = self._get_restart_index(from_step)
+        self._kept_steps = {step for step in self._plan.step_registry
+                            if self.step_registry[step].step_index < restart_index
+                            and self.step_registry[step].results != (None, None)}
+        self._reset(self._rerun_steps, self._kept_steps)
+
+    def _reset(self, steps=None, keep=()):
+        # Clear step and substep results, keeping those of the steps in keep, and of steps not in steps if given. The
+        # instances of parametrized steps are removed, as the next run pulls their parameters again.
+        for step in self._plan.step_registry:
+            if step in keep or steps is not None and step not in steps:
+                continue
+
+            for instance in self.step_registry[step].instances:
+                self._delete_stored_result(instance)
+                del self.step_registry[instance]
+            self.step_registry[step].instances = []
+
+            self._delete_stored_result(step)
             self.step_registry[step].results = (None, None)
-            self.step_registry[step].substeps = []
+            self.step_registry[step].substeps = SubstepLog(self.substep_retention, self.substep_limit)
+            self.step_registry[step].cached = False
+            self.step_registry[step].metrics = None
+            self.step_registry[step].timed_out = False
+            self._cache_keys.pop(step, None)
+
+        self._stop_reason = None
+        self._skipped_steps = {}
+
+    def _delete_stored_result(self, step):
+        if isinstance(self.step_registry[step].results[1], StoredResult):
+            self.step_registry[step].results[1].delete()
+
+    def _add_step_instance(self, step_name, instance_id):
+        """
+        Add the step for one parameter set of a parametrized step to the registry, returning its name.
+        """
+        step = self.step_registry[step_name]
+        instance = f'{step_name}[{instance_id}]'
+        if instance in self.step_registry:
+            raise Exception(f'Step {step_name} has more than one parameter set with the id {instance_id}.')
+
+        self.step_registry[instance] = StepRegistration(step.step_type, step.step_index, step.on_pass, step.on_fail,
+                                                        step.desc, step.method_reference,
+                                                        substeps=SubstepLog(self.substep_retention, self.substep_limit))
+        step.instances.append(instance)
+        return instance
+
+    def _expand_instances(self, steps):
+        """
+        Get the given steps with the instances of each parametrized step following it.
+        """
+        return [name for step in steps for name in (step, *self.step_registry[step].instances)]
+
+    def _run_flight(self, first_step, last_step, steps, workers=None):
+        self._start_flight()
+        if workers is not None and workers > 1:
+            self._run_flight_parallel(first_step, last_step, steps, workers)
+            return
 
-    def _run_flight(self, first_step, last_step, steps):
         for step in steps:
             if self._step_is_qualified_to_run(first_step, last_step, step):
                 self._call_step_function(step)
 
+    def _run_flight_parallel(self, first_step, last_step, steps, workers):
+        steps_to_run, waiting_on, dependents = self._get_flight_schedule(first_step, last_step, steps)
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            running = {pool.submit(self._call_step_function, step): step
+                       for step in steps_to_run if not waiting_on[step]}
+
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    finished_step = running.pop(future)
+                    future.result()  # Re-raise any exception from the step
+
+                    for dependent in dependents[finished_step]:
+                        waiting_on[dependent].discard(finished_step)
+                        if not waiting_on[dependent]:
+                            running[pool.submit(self._call_step_function, dependent)] = dependent
+
+    async def _arun_flight(self, first_step, last_step, steps, concurrent=False):
+        self._start_flight()
+        if not concurrent:
+            for step in steps:
+                if self._step_is_qualified_to_run(first_step, last_step, step):
+                    await self._acall_step_function(step)
+            return
+
+        steps_to_run, waiting_on, dependents = self._get_flight_schedule(first_step, last_step, steps)
+
+        running = {asyncio.ensure_future(self._acall_step_function(step)): step
+                   for step in steps_to_run if not waiting_on[step]}
+
+        try:
+            while running:
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    finished_step = running.pop(future)
+                    future.result()  # Re-raise any exception from the step
+
+                    for dependent in dependents[finished_step]:
+                        waiting_on[dependent].discard(finished_step)
+                        if not waiting_on[dependent]:
+                            running[asyncio.ensure_future(self._acall_step_function(dependent))] = dependent
+        finally:
+            # Let steps that are still running finish, as the thread pool does when a step raises
+            if running:
+                await asyncio.wait(running)
+
+    def _start_flight(self):
+        if self._fail_fast == 'flight':
+            self._stop_reason = None
+
+    def _get_flight_schedule(self, first_step, last_step, steps):
+        """
+        Get the steps of a flight that will run, the dependencies each of them is waiting on, and the steps that depend
+        on each of them.
+        """
+        steps_to_run = [step for step in steps if self._step_is_qualified_to_run(first_step, last_step, step)]
+
+        # Only wait on dependencies that will run in this flight. Any other dependency has either already run in an
+        # earlier flight or will not run before this flight finishes, just as when running sequentially.
+        waiting_on = {step: set(self._get_step_dependencies(step)) & set(steps_to_run) for step in steps_to_run}
+        dependents = {step: [] for step in steps_to_run}
+        for step, dependencies in waiting_on.items():
+            for dependency in dependencies:
+                dependents[dependency].append(step)
+
+        return steps_to_run, waiting_on, dependents
+
+    def _get_step_dependencies(self, step):
+        return self.step_registry[step].on_pass or self.step_registry[step].on_fail or ()
+
+    def _get_dependents_closure(self, steps):
+        """
+        Get the given steps and every step that depends on them, directly or transitively.
+        """
+        closure = set()
+        to_visit = list(steps)
+        while to_visit:
+            step = to_visit.pop()
+            if step not in closure:
+                closure.add(step)
+                to_visit.extend(self._plan.pass_dependents[step])
+                to_visit.extend(self._plan.fail_dependents[step])
+
+        return closure
+
+    def _get_dependency_closure(self, step):
+        """
+        Get every step that the given step depends on, directly or transitively.
+        """
+        closure = set()
+        to_visit = list(self._get_step_dependencies(step))
+        while to_visit:
+            dependency = to_visit.pop()
+            if dependency not in closure:
+                closure.add(dependency)
+                to_visit.extend(self._get_step_dependencies(dependency))
+
+        return closure
+
     def _step_is_qualified_to_run(self, first_step, last_step, step):
+        # Steps that finished before the point a restart resumes from keep their results from the earlier attempt
+        if step in self._kept_steps:
+            return False
+
+        if self._selected_steps is not None:
+            return step in self._selected_steps
+
         in_range = first_step <= self.step_registry[step].step_index <= last_step
 
         # Always run if setup or teardown (contingent on dependencies being met of course)
@@ -142,30 +550,548 @@ class StaircaseTest:
         return in_range or is_setup_teardown
 
     def _call_step_function(self, step_name):
-        try:
+        with self._step_execution(step_name):
             self._run_step(step_name)
 
+    async def _acall_step_function(self, step_name):
+        with self._step_execution(step_name):
+            await self._arun_step(step_name)
+
+    @contextmanager
+    def _step_execution(self, step_name):
+        started = time.time()
+        try:
+            with self._measuring_step(step_name):
+                yield
+
         except MaxResetsExceeded as max_resets_exception:
             self.step_registry[step_name].results = (False, str(max_resets_exception))
 
+        except ResetSignal:
+            raise
+
         except Exception as e:
             self.logger.error(f'An exception occurred while executing step {step_name}. {str(e)}')
+            self._report_step(step_name, started, e)
             raise e
 
         results = self.get_step_results(step_name)
         if results == (None, None):
             raise Exception(f'Step {step_name} requires a success value of the form (pass/fail [bool], result [any])')
 
+        self._store_large_result(step_name)
+
+        if results[0] is not True:
+            self._skip_dependents(step_name)
+
+        self._report_step(step_name, started)
+
+    @contextmanager
+    def _measuring_step(self, step_name):
+        step = self.step_registry[step_name]
+        step.metrics = None
+        self._body_cpu_times.pop(step_name, None)
+
+        memory_start = None
+        if self._track_memory:
+            tracemalloc.reset_peak()
+            memory_start = tracemalloc.get_traced_memory()[0]
+
+        start, cpu_start = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            wall_time, cpu_time = time.perf_counter() - start, time.thread_time() - cpu_start
+
+            # Steps run in a worker process report the CPU time they used there, and steps run on another thread the
+            # CPU time of that thread
+            if step.metrics is not None:
+                cpu_time = step.metrics.cpu_time
+            elif step_name in self._body_cpu_times:
+                cpu_time = self._body_cpu_times.pop(step_name)
+
+            peak_memory = tracemalloc.get_traced_memory()[1] - memory_start if memory_start is not None else None
+            step.metrics = StepMetrics(wall_time, cpu_time, peak_memory)
+
+    @contextmanager
+    def _running_body(self, step_name):
+        # Measure and profile the body of a step on the thread that runs it, which is not the one measuring the step for
+        # steps with a timeout or coroutine steps run from run
+        profiler = self._start_profiler(step_name) if self._profile_dir is not None else None
+        cpu_start = time.thread_time()
+        try:
+            yield
+        finally:
+            # A step that timed out is no longer measured, and anything it records afterwards is discarded
+            cancelled = _step_was_cancelled()
+            if not cancelled:
+                self._body_cpu_times[step_name] = time.thread_time() - cpu_start
+
+            if profiler is not None:
+                profiler.disable()
+                if not cancelled:
+                    profiler.dump_stats(os.path.join(self._profile_dir, f'{type(self).__name__}.{step_name}.pstats'))
+
+    def _start_profiler(self, step_name):
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Newer versions of Python allow one profiler at a time, which a step that timed out may still be using
+            self.logger.error(f'Step {step_name} was not profiled, another profiler is active.')
+            return None
+        return profiler
+
+    async def _running_coroutine(self, step_name, awaitable):
+        with self._running_body(step_name):
+            return await awaitable
+
+    def _call_body(self, step_name, method):
+        with self._running_body(step_name):
+            return method(self)
+
     def _run_step(self, step_name):
-        if self._check_pre_requisites_for_step(step_name):
-            self.step_registry[step_name].method_reference(self)
+        skip_reason = self._get_skip_reason(step_name)
+        if skip_reason is not None:
+            self._skip_step(step_name, skip_reason)
+
+        elif not self._check_pre_requisites_for_step(step_name):
+            self._skip_step(step_name)
+
+        elif not self._load_cached_step(step_name):
+            self._invoke_step(step_name)
+            self._store_cached_step(step_name)
+
+    async def _arun_step(self, step_name):
+        skip_reason = self._get_skip_reason(step_name)
+        if skip_reason is not None:
+            self._skip_step(step_name, skip_reason)
+
+        elif not self._check_pre_requisites_for_step(step_name):
+            self._skip_step(step_name)
+
+        elif not self._load_cached_step(step_name):
+            await self._ainvoke_step(step_name)
+            self._store_cached_step(step_name)
+
+    def _invoke_step(self, step_name):
+        method = self.step_registry[step_name].method_reference
+        timeout = self._get_step_timeout(step_name)
+        self._report_step_started(step_name)
+
+        if timeout is not None and timeout <= 0:
+            self._time_out_step(step_name, timeout)
+
+        elif self._runs_elsewhere(step_name):
+            future = self._submit_to_process(step_name, timeout)
+            if future is not None:  # Otherwise the step could not be sent, and has failed
+                if self._wait_for_step(step_name, future, timeout):
+                    self._store_process_results(step_name, future)
+                else:
+                    stop_process_step(future)
+
+        elif timeout is None:
+            if inspect.iscoroutinefunction(method.function):
+                self._run_coroutine(self._running_coroutine(step_name, method(self)))
+            else:
+                self._call_body(step_name, method)
+
+        elif inspect.iscoroutinefunction(method.function):
+            future = self._submit_coroutine(self._running_coroutine(step_name, method(self)))
+            if not self._wait_for_step(step_name, future, timeout):
+                future.cancel()  # The coroutine is cancelled at its next await
+
         else:
-            self.step_registry[step_name].results = (None, "Did not run due to step dependency check failure.")
+            cancelled = threading.Event()
+            future = self._call_in_thread(lambda: self._call_body(step_name, method), cancelled)
+            self._wait_for_step(step_name, future, timeout, cancelled)  # If it times out, the thread is left running
+
+    async def _ainvoke_step(self, step_name):
+        method = self.step_registry[step_name].method_reference
+        timeout = self._get_step_timeout(step_name)
+        self._report_step_started(step_name)
+
+        if timeout is not None and timeout <= 0:
+            self._time_out_step(step_name, timeout)
+
+        elif self._runs_elsewhere(step_name):
+            future = self._submit_to_process(step_name, timeout)
+            if future is not None:  # Otherwise the step could not be sent, and has failed
+                waiter = asyncio.wrap_future(future)
+                await asyncio.wait([waiter], timeout=timeout)
+                if future.done():
+                    self._store_process_results(step_name, future)
+                else:
+                    waiter.cancel()  # So that the error of the killed process is not reported as never retrieved
+                    stop_process_step(future)
+                    self._time_out_step(step_name, timeout)
+
+        elif timeout is None:
+            if inspect.iscoroutinefunction(method.function):
+                await self._running_coroutine(step_name, method(self))
+            else:
+                self._call_body(step_name, method)
+
+        elif inspect.iscoroutinefunction(method.function):
+            try:
+                await asyncio.wait_for(self._running_coroutine(step_name, method(self)), timeout)
+            except asyncio.TimeoutError:
+                self._time_out_step(step_name, timeout)
+
+        else:
+            cancelled = threading.Event()
+            future = self._call_in_thread(lambda: self._call_body(step_name, method), cancelled)
+            await asyncio.wait([asyncio.wrap_future(future)], timeout=timeout)
+            if future.done():
+                future.result()
+            else:
+                self._time_out_step(step_name, timeout, cancelled)
+
+    def _get_step_timeout(self, step_name):
+        """
+        Get the seconds a step may run for, given its own timeout and the deadline of the run, or None if it has no
+        limit.
+        """
+        timeout = self.step_registry[step_name].method_reference.timeout
+        if self._deadline is None:
+            return timeout
+
+        finish_by = self._deadline
+        if self.step_registry[step_name].step_type != '_Teardown':
+            finish_by -= self._teardown_budget
+
+        remaining = max(finish_by - time.monotonic(), 0)
+        return remaining if timeout is None else min(timeout, remaining)
+
+    def _wait_for_step(self, step_name, future, timeout, cancelled=None):
+        """
+        Wait for a step running in the background to finish, re-raising any exception from it. Returns False if it
+        timed out instead.
+        """
+        try:
+            future.result(timeout)
+            return True
+        except TimeoutError:
+            self._time_out_step(step_name, timeout, cancelled)
+            return False
+
+    def _time_out_step(self, step_name, timeout, cancelled=None):
+        step_timeout = self.step_registry[step_name].method_reference.timeout
+        if timeout <= 0:
+            reason = 'Did not run, the deadline of the run had passed.'
+        elif step_timeout is None or timeout < step_timeout:
+            reason = f'Step timed out after {timeout:.3g} seconds, at the deadline of the run.'
+        else:
+            reason = f'Step timed out after {timeout:.3g} seconds.'
+
+        with self._results_lock:
+            if cancelled is not None:
+                cancelled.set()
+            self.step_registry[step_name].results = (False, reason)
+            self.step_registry[step_name].timed_out = True
+
+    def _call_in_thread(self, function, cancelled):
+        # Run a step on a thread of its own, which can be abandoned if the step times out
+        future = Future()
+
+        def run():
+            _step_cancelled.set(cancelled)
+            try:
+                future.set_result(function())
+            except BaseException as e:
+                future.set_exception(e)
+
+        context = contextvars.copy_context()
+        threading.Thread(target=context.run, args=(run,), daemon=True).start()
+        return future
+
+    def _start_deadline(self, deadline, teardown_budget):
+        if deadline is None:
+            self._deadline = None
+            return
+
+        if not isinstance(deadline, (int, float)) or deadline <= 0:
+            raise Exception(f'Invalid deadline {deadline}. Must be a positive number of seconds.')
+
+        if teardown_budget is None:
+            teardown_budget = deadline / 10
+        elif not isinstance(teardown_budget, (int, float)) or not 0 <= teardown_budget <= deadline:
+            raise Exception(f'Invalid teardown budget {teardown_budget}. Must be between 0 and the deadline.')
+
+        self._deadline = time.monotonic() + deadline
+        self._teardown_budget = teardown_budget
+
+    def get_fixture(self, fixture):
+        """
+        Get the value of a fixture. Steps get the value they checked out if the fixture is listed in their fixtures,
+        otherwise the value shared in the fixture's scope, which is created on first use.
+        """
+        values = _step_fixtures.get()
+        if fixture in values:
+            return values[fixture]
+        return fixture.get(self)
+
+    def step_timed_out(self):
+        """
+        Whether the step calling this has timed out. Synchronous steps with a timeout can check it to stop early, as
+        they cannot be stopped from outside.
+        """
+        return _step_was_cancelled()
+
+    def _submit_to_process(self, step_name, timeout=None):
+        """
+        Send a step to a worker process or node, returning a future for its results. Steps with a timeout run in a
+        process of their own, which is killed if they time out. If the step cannot be sent, such as when the return
+        value of a step it depends on cannot be pickled, it fails and None is returned.
+        """
+        try:
+            return submit_step_to_process(self, step_name, self._get_dependency_closure(step_name),
+                                          self._get_step_coordinator(step_name), own_process=timeout is not None)
+        except Exception as e:
+            self.step_registry[step_name].results = (False, str(e))
+            return None
+
+    def _store_process_results(self, step_name, future):
+        try:
+            results, substeps, cpu_time = load_process_results(step_name, future)
+        except ResetSignal:
+            # The worker's copy of the test asked for the restart
+            self.retries += 1
+            raise
+
+        self.step_registry[step_name].results = results
+        self.step_registry[step_name].substeps.extend(substeps)
+        self.step_registry[step_name].metrics = StepMetrics(0, cpu_time)
+
+    def _start_instrumentation(self, track_memory, profile):
+        self._track_memory = track_memory
+        if track_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+
+        self._profile_dir = None
+        if profile:
+            self._profile_dir = 'staircase_profiles' if profile is True else profile
+            os.makedirs(self._profile_dir, exist_ok=True)
+
+    def _stop_instrumentation(self):
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+        self._track_memory = False
+        self._profile_dir = None
+
+    def _open_duration_store(self, history):
+        if history is None or isinstance(history, DurationStore):
+            return history
+        return DurationStore(history)
+
+    def _record_durations(self, history):
+        if history is None:
+            return
+
+        # Steps that were skipped, replayed from the cache or cut short tell nothing about how long they take. The
+        # instances of parametrized steps are counted in the duration of the step.
+        durations = {}
+        for step_name in self._get_ordered_steps(self._selected_steps):
+            step = self.step_registry[step_name]
+            if step.metrics is not None and step.results[0] is not None and not step.cached and not step.timed_out:
+                durations[step_name] = step.metrics.wall_time
+
+        history.record(_get_test_id(self), durations)
+
+    def _open_step_cache(self, cache_dir, no_cache):
+        if cache_dir is None or no_cache:
+            return None
+
+        cache = cache_dir if isinstance(cache_dir, StepCache) else StepCache(cache_dir)
+        cache.evict()
+        return cache
+
+    def _load_cached_step(self, step_name):
+        """
+        Replay the results of a cacheable step from the cache, if it has them. Returns whether it did.
+        """
+        if self._step_cache is None or not self.step_registry[step_name].method_reference.cache:
+            return False
+
+        # Cached dependencies are identified by their own cache key, others by their results
+        dependency_keys = {}
+        try:
+            for dependency in self._get_step_dependencies(step_name):
+                if dependency in self._cache_keys:
+                    dependency_keys[dependency] = self._cache_keys[dependency]
+                else:
+                    dependency_keys[dependency] = StepCache.get_results_key(dependency,
+                                                                            self.step_registry[dependency].results)
+
+            key = self._step_cache.get_key(self, step_name, dependency_keys)
+        except Exception as e:
+            # Such as a dependency returning a connection, which cannot be pickled. The step runs without the cache.
+            self.logger.error(f'Step {step_name} is not cached this run. {str(e)}')
+            return False
+
+        self._cache_keys[step_name] = key
+
+        entry = self._step_cache.load(key)
+        if entry is None:
+            return False
+
+        results, substeps = entry
+        self.step_registry[step_name].results = results
+        self.step_registry[step_name].substeps.extend(substeps)
+        self.step_registry[step_name].cached = True
+        return True
+
+    def _store_cached_step(self, step_name):
+        # Only passing results are cached, so that a failing step is tried again on the next run
+        key = self._cache_keys.get(step_name)
+        if key is not None and self.step_registry[step_name].results[0]:
+            passed, value = self.step_registry[step_name].results
+
+            # Values stored by a worker process are cached themselves, as their files do not outlive the run
+            if isinstance(value, StoredResult):
+                value = bytes(value.open())
+
+            self._step_cache.store(key, (passed, value), self.step_registry[step_name].substeps)
+
+    def _check_result_store(self, result_store):
+        if result_store is not None and not isinstance(result_store, ResultStore):
+            raise Exception(f'Invalid result store {result_store}. Must be a ResultStore.')
+
+    def _store_large_result(self, step_name):
+        if self._result_store is not None:
+            passed, value = self.step_registry[step_name].results
+            self.step_registry[step_name].results = (passed, self._result_store.store(value))
+
+    def _check_sinks(self, sinks):
+        for sink in sinks or ():
+            if not isinstance(sink, ResultSink):
+                raise Exception(f'Invalid result sink {sink}. Must be a subclass of ResultSink.')
+
+    def _start_sinks(self, sinks):
+        self._sinks = tuple(sinks or ())
+        self._substep_sinks = tuple(sink for sink in self._sinks if sink.substeps)
+        for sink in self._sinks:
+            sink.start(self)
+
+    def _finish_sinks(self):
+        sinks, self._sinks, self._substep_sinks = self._sinks, (), ()
+        for sink in sinks:
+            sink.finish(self)
+
+    def _report_step(self, step_name, started, error=None):
+        if not self._sinks:
+            return
+
+        # Substeps of steps that ran in a worker process or were replayed from the cache were not reported as they ran
+        step = self.step_registry[step_name]
+        if self._substep_sinks and (step.cached or self._runs_elsewhere(step_name)):
+            for _, substep in step.substeps.items():
+                self._write_event(get_substep_event(self, step_name, substep), self._substep_sinks)
+
+        self._write_event(get_step_event(self, step_name, started, error), self._sinks)
+
+    def _report_step_started(self, step_name):
+        with self._sink_lock:
+            for sink in self._sinks:
+                sink.step_started(self, step_name)
+
+    def _report_substep(self, step_name, substep, started):
+        self._write_event(get_substep_event(self, step_name, substep, started), self._substep_sinks)
+
+    def _write_event(self, event, sinks):
+        with self._sink_lock:
+            for sink in sinks:
+                sink.write(event)
+
+    def _skip_step(self, step_name, reason="Did not run due to step dependency check failure."):
+        self.step_registry[step_name].results = (None, reason)
+
+    def _get_skip_reason(self, step_name):
+        """
+        Get why a step will not run, if that is already known without checking its dependencies.
+        """
+        if step_name in self._skipped_steps:
+            return self._skipped_steps[step_name]
+
+        if self._cancel_reason is None and self._cancel_event is not None and self._cancel_event.is_set():
+            self.cancel()
+
+        stop_reason = self._cancel_reason or self._stop_reason
+        if stop_reason is not None and self.step_registry[step_name].step_type != '_Teardown':
+            return stop_reason
+
+        return None
+
+    def _skip_dependents(self, step_name):
+        """
+        Mark every step that can no longer run because the given step did not pass as skipped, following the dependents
+        index of the plan, and stop the run from starting new steps if it fails fast.
+        """
+        step = self.step_registry[step_name]
+        reason = f'Did not run, step {step_name} did not pass.'
+
+        # Steps waiting on a step to fail still run if it failed, unless it timed out
+        to_skip = list(self._plan.pass_dependents[step_name])
+        if step.timed_out:
+            to_skip.extend(self._plan.fail_dependents[step_name])
+
+        while to_skip:
+            dependent = to_skip.pop()
+            if dependent not in self._skipped_steps:
+                self._skipped_steps[dependent] = reason
+                to_skip.extend(self._plan.pass_dependents[dependent])
+
+        if step.results[0] is False and self._fail_fast is not None and self._stop_reason is None \
+                and step.step_type != '_Teardown':
+            scope = 'flight' if self._fail_fast == 'flight' else 'test'
+            self._stop_reason = f'Did not run, the {scope} stopped after step {step_name} failed.'
+
+    def _run_coroutine(self, coroutine):
+        return self._submit_coroutine(coroutine).result()
+
+    def _submit_coroutine(self, coroutine):
+        # Coroutine steps of a synchronous run share one event loop. It runs on its own thread so that steps can be
+        # submitted to it from any of the worker threads.
+        with self._event_loop_lock:
+            if self._event_loop is None:
+                self._event_loop = asyncio.new_event_loop()
+                self._event_loop_thread = threading.Thread(target=self._event_loop.run_forever, daemon=True)
+                self._event_loop_thread.start()
+
+        return asyncio.run_coroutine_threadsafe(coroutine, self._event_loop)
+
+    @staticmethod
+    async def _cancel_coroutines():
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _close_event_loop(self):
+        with self._event_loop_lock:
+            if self._event_loop is None:
+                return
+
+            # Coroutine steps that timed out may not have been cancelled yet, let them finish on the loop they ran on
+            asyncio.run_coroutine_threadsafe(self._cancel_coroutines(), self._event_loop).result()
+            self._event_loop.call_soon_threadsafe(self._event_loop.stop)
+            self._event_loop_thread.join()
+            self._event_loop.close()
+
+            self._event_loop = None
+            self._event_loop_thread = None
 
     def _check_pre_requisites_for_step(self, step):
         on_pass = self.step_registry[step].on_pass
         on_fail = self.step_registry[step].on_fail
 
+        # Steps that depend on a step that timed out are skipped, whether they wait for it to pass or to fail
+        if any(self.step_registry[dep].timed_out for dep in on_pass or on_fail or ()):
+            return False
+
         if on_pass:
             dependencies_have_passed = []
             for dep in on_pass:
@@ -180,70 +1106,13 @@ class StaircaseTest:
 
         return True
 
-    def _register_steps(self):
-        for step_name in get_members(self):
-            for step in self._get_flight_classes():
-                if isinstance(getattr(self, step_name), step):
-                    self.register_step(step.__name__, -1,
-                                       step_name,
-                                       getattr(self, step_name),
-                                       self._get_attr_for_step(step_name, 'on_pass'),
-                                       self._get_attr_for_step(step_name, 'on_fail'),
-                                       getattr(self, step_name).desc)
-                    break
-
-        for registered_step in self.step_registry:
-            on_pass = self.step_registry[registered_step].on_pass
-            on_fail = self.step_registry[registered_step].on_fail
-
-            if on_pass == ('$ALL',):
-                all_steps = tuple([])
-                for step in self.step_registry:
-                    if step != registered_step:
-                        all_steps += (step,)
-                on_pass = all_steps
-
-            if on_fail == ('$ALL',):
-                all_steps = tuple([])
-                for step in self.step_registry:
-                    if step != registered_step:
-                        all_steps += (step,)
-                on_fail = all_steps
-
-            self.step_registry[registered_step].on_pass = on_pass
-            self.step_registry[registered_step].on_fail = on_fail
-
-    def _get_flight_classes(self):
-        return [
-            _Setup,
-            _Task,
-            _Test,
-            _Teardown
-        ]
-
-    def register_step(self, stype, index, name, ref, on_pass, on_fail, desc):
-        self.step_registry[name] = StepRegistration(
-            step_type=stype,
-            step_index=index,
-            on_pass=on_pass,
-            on_fail=on_fail,
-            desc=desc,
-            method_reference=ref,
-        )
-
-    def _get_attr_for_step(self, step_name: str, attr_name: str):
-        res = None
-        try:
-            res = getattr(getattr(self, step_name), attr_name)
-        except AttributeError:
-            pass
-
-        return res
-
     def get_return_from_step(self, step):
         results = self.step_registry[step].results
         if results == (None, None):
             raise Exception(f"Error attempting to fetch results from step {step}, which has not yet run.")
+
+        if isinstance(results[1], StoredResult):
+            return results[1].open()
         return results[1]
 
     def step_passed(self, step):
@@ -259,70 +1128,94 @@ class StaircaseTest:
             raise Exception(f"Error attempting to fetch results from step {step}, which has not yet run.")
         return results
 
+    def get_step_metrics(self, step) -> StepMetrics:
+        """
+        Get the wall time, CPU time and peak memory of a step from the last run. The metrics of each substep are on the
+        substeps in step_registry[step].substeps.
+        """
+        metrics = self.step_registry[step].metrics
+        if metrics is None:
+            raise Exception(f"Error attempting to fetch metrics from step {step}, which has not yet run.")
+        return metrics
+
     def _log_test_results(self, show_all):
-        printer = StaircasePrinter(self.ordered_list, self.step_registry, self.logger)
+        printer = StaircasePrinter(self._expand_instances(self._get_ordered_steps(self._selected_steps)),
+                                   self.step_registry, self.logger, self.attempts)
         printer.print(StaircasePrintMode.SUMMARY if show_all else StaircasePrintMode.RESULTS)
 
-    def _get_sorted_steps(self):
-        ordered_list = []
-
-        try:
-            for step_name in self.step_registry:
-                ordered_list = self._recur_step_dependencies(step_name, ordered_list)
-        except Exception as e:
-            if 'recursion depth' in str(e):
-                raise Exception(f"Dependency loop found between steps on_fail and/or on_pass for step {step_name}.")
-            raise Exception(f'An error occurred while ordering steps. {str(e)}')
-
-        setup_steps = []
-        task_steps = []
-        teardown_steps = []
-
-        for step_name in ordered_list:
-            match self.step_registry[step_name].step_type:
-                case '_Setup':
-                    setup_steps.append(step_name)
-                case '_Task':
-                    task_steps.append(step_name)
-                case '_Test':
-                    task_steps.append(step_name)
-                case '_Teardown':
-                    teardown_steps.append(step_name)
-                case _:
-                    raise Exception(
-                        f'An error occurred while ordering steps. Step {self.step_registry[step_name]} with type {self.step_registry[step_name].step_type} is invalid.')
-
-        return setup_steps, task_steps, teardown_steps
-
-    def _recur_step_dependencies(self, node, ordered_list):
-        if self.step_registry[node].on_pass:
-            for pointer in self.step_registry[node].on_pass:
-                self._recur_step_dependencies(pointer, ordered_list)
-
-        if self.step_registry[node].on_fail:
-            for pointer in self.step_registry[node].on_fail:
-                self._recur_step_dependencies(pointer, ordered_list)
-
-        if node not in ordered_list:
-            ordered_list.append(node)
-
-        return ordered_list
-
-    def _assign_indices_to_directory(self):
-        for index, step in enumerate(self.ordered_list, 1):
-            self.step_registry[step].step_index = index
-
     def _check_first_last(self, first_step, last_step):
         if first_step > last_step or first_step < 1 or last_step > len(self.ordered_list):
             raise Exception(f'The first step function comes after the last step function listed.')
         else:
             return True
 
-    def restart(self):
-        if self.retries > self.max_restart_retries:
+    def _check_coordinator(self, coordinator):
+        if coordinator is not None and not isinstance(coordinator, Coordinator):
+            raise Exception(f'Invalid coordinator {coordinator}. Must be a Coordinator.')
+
+    def _measures_one_step_at_a_time(self):
+        # Only one profiler can be active at a time, and the peak memory tracemalloc reports is shared by the whole
+        # process, so steps run one at a time while they are profiled or their memory is tracked
+        return self._profile_dir is not None or self._track_memory
+
+    def _get_main_workers(self, workers):
+        if self._measures_one_step_at_a_time():
+            return None
+        if workers is None and self._coordinator is not None:
+            return self._coordinator.max_in_flight
+        return workers
+
+    def _get_step_coordinator(self, step_name):
+        """
+        Get the coordinator to send a step to, or None if it runs in this process or a worker process of its own.
+        Coroutine and parametrized steps stay here, as they need the event loop and step registry of the run.
+        """
+        method = self.step_registry[step_name].method_reference
+        if self._coordinator is None or self.step_registry[step_name].step_type not in ('_Task', '_Test') \
+                or inspect.iscoroutinefunction(method.function) or method.params is not None:
+            return None
+        return self._coordinator
+
+    def _runs_elsewhere(self, step_name):
+        return self.step_registry[step_name].method_reference.executor == 'process' \
+            or self._get_step_coordinator(step_name) is not None
+
+    def _check_fail_fast(self, fail_fast):
+        if fail_fast not in (None, 'flight', 'test', 'suite'):
+            raise Exception(f"Invalid fail_fast {fail_fast}. Must be None, 'flight', 'test' or 'suite'.")
+
+    def _check_workers(self, workers):
+        if workers is not None and (not isinstance(workers, int) or workers < 1):
+            raise Exception(f'Invalid number of workers {workers}. Must be a positive integer.')
+
+    def restart(self, from_step='$SETUP'):
+        """
+        Stop the current attempt at the test and run it again from the given step, keeping the results of the steps
+        before it. from_step is a step name, or one of $SETUP, $MAIN or $TEARDOWN to restart from the start of that
+        flight. It cannot come after the step that is restarting the test.
+        """
+        if self.retries >= self.max_restart_retries:
             raise MaxResetsExceeded('Can not restart test: Max retries exceeded.')
 
-        self.logger.info('Attempting to restart the test...')
+        restart_index = self._get_restart_index(from_step)
+        current_step = _current_step.get()
+        if current_step is not None and restart_index > self.step_registry[current_step].step_index:
+            raise Exception(f'Can not restart test from {from_step}, which comes after step {current_step}.')
+
+        self.logger.info(f'Attempting to restart the test from {from_step}...')
         self.retries += 1
 
-        raise ResetSignal('Attempting to restart...')
+        raise ResetSignal('Attempting to restart...', from_step)
+
+    def _get_restart_index(self, from_step):
+        match from_step:
+            case '$SETUP':
+                return 1
+            case '$MAIN':
+                return len(self._setup_steps) + 1
+            case '$TEARDOWN':
+                return len(self._setup_steps) + len(self._main_steps) + 1
+            case _ if from_step in self.step_registry:
+                return self.step_registry[from_step].step_index
+            case _:
+                raise Exception(f'Can not restart test from {from_step}, which is not a step.')
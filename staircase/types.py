@@ -1,16 +1,212 @@
 from dataclasses import dataclass, field
-from typing import Tuple, List, Any, Callable
+from typing import Tuple, List, Any, Callable, Iterator, Union
+from array import array
+from enum import Enum
+import math
 
 
-@dataclass
+@dataclass(slots=True)
+class StepMetrics:
+    """
+    What running a step or substep cost. Times are in seconds, CPU time is that of the thread the step ran on.
+    peak_memory is the most memory allocated at once while the step ran, in bytes, if memory was tracked.
+    """
+    wall_time: float
+    cpu_time: float
+    peak_memory: int = None
+
+
+@dataclass(slots=True)
 class SubstepRegistration:
     desc: str
     substep_name: str
     step_type: str = '_Substep'
     results: Tuple[bool, Any] = (None, None)
+    metrics: StepMetrics = None
+
+
+@dataclass(slots=True)
+class SubstepBatchRegistration:
+    """
+    The results of running a substep over many items with Substep.map. Pass/fail flags are kept as a bitset, one bit per
+    item, and only the first few failure return values are kept.
+    """
+    desc: str
+    substep_name: str
+    step_type: str = '_Substep'
+    results: Tuple[bool, Any] = (None, None)
+    metrics: StepMetrics = None
+    count: int = 0
+    failed_count: int = 0
+    passed_flags: bytearray = field(default_factory=bytearray)
+    failures: List[Tuple[int, Any]] = field(default_factory=lambda: [])
+
+    def __str__(self):
+        return f"{self.passed_count:,} passed / {self.failed_count:,} failed"
+
+    @property
+    def passed_count(self) -> int:
+        return self.count - self.failed_count
+
+    def item_passed(self, index: int) -> bool:
+        return bool(self.passed_flags[index >> 3] & (1 << (index & 7)))
+
+    def failed_indices(self) -> Iterator[int]:
+        for index in range(self.count):
+            if not self.item_passed(index):
+                yield index
+
+
+class SubstepRetention(Enum):
+    ALL = 1  # Keep every substep
+    FAILURES = 2  # Keep failed substeps, up to the substep limit if there is one
+    LAST = 3  # Keep the most recent substeps, up to the substep limit
+
+
+class FixtureScope(Enum):
+    RUN = 1  # Created for each run of a test, and closed at the end of the run
+    CLASS = 2  # Shared by every instance of a test class, and closed once the suite runner has run the class
+    SUITE = 3  # Shared by every test a suite worker process runs, and closed when the suite ends
+    PROCESS = 4  # Shared by everything in the process, and closed when it exits
+
+
+class SubstepLog:
+    """
+    The substeps recorded for one step, kept as parallel arrays rather than an object per substep. Each distinct
+    substep name and description is stored once and referred to by an integer id. Which substeps are kept is decided by
+    the retention policy, but every substep is counted.
+
+    Iterating the log gives a SubstepRegistration (or SubstepBatchRegistration) for each kept substep, in order.
+    """
+    __slots__ = ('retention', 'limit', 'count', 'failed_count',
+                 '_names', '_name_ids', '_positions', '_passed', '_values', '_wall_times', '_cpu_times', '_next_slot')
+
+    def __init__(self, retention: SubstepRetention = SubstepRetention.ALL, limit: int = None):
+        if retention == SubstepRetention.LAST and (limit is None or limit < 1):
+            raise Exception('Keeping the last substeps requires a substep limit of at least 1.')
+
+        self.retention = retention
+        self.limit = limit
+
+        self.count = 0
+        self.failed_count = 0
+
+        # The distinct (substep_name, desc, is_batch) of the substeps, and a lookup from them to their id
+        self._names = {}
+
+        # One entry per kept substep. For LAST these are a ring buffer, written at _next_slot once full.
+        self._name_ids = array('I')
+        self._positions = array('Q')
+        self._passed = array('b')
+        self._values = []
+        self._wall_times = array('d')  # NaN where the substep was not timed
+        self._cpu_times = array('d')
+        self._next_slot = 0
+
+    def __len__(self):
+        return len(self._passed)
+
+    def __iter__(self):
+        for _, substep in self.items():
+            yield substep
+
+    @property
+    def passed_count(self) -> int:
+        return self.count - self.failed_count
+
+    @property
+    def dropped_count(self) -> int:
+        return self.count - len(self)
+
+    def items(self) -> Iterator[Tuple[int, Union[SubstepRegistration, SubstepBatchRegistration]]]:
+        """
+        Get (position, substep) for each kept substep, where position is the order the substep was recorded in.
+        """
+        names = list(self._names)
+        kept = len(self._passed)
+        start = self._next_slot if self.retention == SubstepRetention.LAST and kept == self.limit else 0
+
+        for offset in range(kept):
+            slot = (start + offset) % kept
+            substep_name, desc, is_batch = names[self._name_ids[slot]]
+
+            if is_batch:
+                yield self._positions[slot], self._values[slot]
+            else:
+                results = (bool(self._passed[slot]), self._values[slot])
+                metrics = None
+                if not math.isnan(self._wall_times[slot]):
+                    metrics = StepMetrics(self._wall_times[slot], self._cpu_times[slot])
+
+                yield self._positions[slot], SubstepRegistration(desc=desc, substep_name=substep_name, results=results,
+                                                                 metrics=metrics)
+
+    def record(self, substep_name, desc, results, metrics: StepMetrics = None):
+        """
+        Record the (passed, value) results of one substep call, and optionally what it cost.
+        """
+        self._keep((substep_name, desc, False), results[0], results[1], metrics)
+
+    def append(self, substep: Union[SubstepRegistration, SubstepBatchRegistration]):
+        if isinstance(substep, SubstepBatchRegistration):
+            self._keep((substep.substep_name, substep.desc, True), substep.results[0], substep, substep.metrics)
+        else:
+            self.record(substep.substep_name, substep.desc, substep.results, substep.metrics)
+
+    def extend(self, substeps):
+        for substep in substeps:
+            self.append(substep)
+
+    def map_values(self, function) -> 'SubstepLog':
+        """
+        Get a copy of the log with the function applied to the value of each kept substep. For batches the function is
+        applied to the SubstepBatchRegistration itself.
+        """
+        log = SubstepLog(self.retention, self.limit)
+        log.count = self.count
+        log.failed_count = self.failed_count
+        log._names = dict(self._names)
+        log._name_ids = array('I', self._name_ids)
+        log._positions = array('Q', self._positions)
+        log._passed = array('b', self._passed)
+        log._values = [function(value) for value in self._values]
+        log._wall_times = array('d', self._wall_times)
+        log._cpu_times = array('d', self._cpu_times)
+        log._next_slot = self._next_slot
+        return log
+
+    def _keep(self, name, passed, value, metrics):
+        position = self.count
+        self.count += 1
+        if not passed:
+            self.failed_count += 1
+
+        if self.retention == SubstepRetention.FAILURES and (passed or self.limit is not None and len(self) >= self.limit):
+            return
+
+        name_id = self._names.setdefault(name, len(self._names))
+        wall_time, cpu_time = (metrics.wall_time, metrics.cpu_time) if metrics is not None else (math.nan, math.nan)
+
+        if self.retention == SubstepRetention.LAST and len(self) >= self.limit:
+            slot = self._next_slot
+            self._next_slot = (slot + 1) % self.limit
+            self._name_ids[slot] = name_id
+            self._positions[slot] = position
+            self._passed[slot] = bool(passed)
+            self._values[slot] = value
+            self._wall_times[slot] = wall_time
+            self._cpu_times[slot] = cpu_time
+            return
+
+        self._name_ids.append(name_id)
+        self._positions.append(position)
+        self._passed.append(bool(passed))
+        self._values.append(value)
+        self._wall_times.append(wall_time)
+        self._cpu_times.append(cpu_time)
 
 
-@dataclass
+@dataclass(slots=True)
 class StepRegistration:
     step_type: str
     step_index: int
@@ -19,4 +215,8 @@ class StepRegistration:
     desc: str
     method_reference: Callable
     results: Tuple[bool, Any] = (None, None)
-    substeps: List[SubstepRegistration] = field(default_factory=lambda: [])
+    substeps: SubstepLog = field(default_factory=SubstepLog)
+    cached: bool = False
+    metrics: StepMetrics = None
+    timed_out: bool = False
+    instances: List[str] = field(default_factory=lambda: [])  # The name[id] steps a parametrized step expanded into
@@ -0,0 +1,435 @@
+from staircase.suite import PATTERN, _get_sources, _get_test_classes, _get_module_name, _import_source
+from staircase.decorators import _StepDecorator
+from staircase.fixtures import _Fixture
+from staircase.logger import StaircaseLogger, DefaultLogger
+from staircase.test import StaircaseTest
+from dataclasses import replace
+from typing import Dict, Set
+import importlib
+import threading
+import hashlib
+import types
+import time
+import sys
+import os
+
+# Values whose repr shows everything about them, so that a change to them can be seen
+SIMPLE_TYPES = (int, float, complex, str, bytes, bool, type(None))
+
+
+class Watcher:
+    """
+    Runs the tests found in the given modules, files and directories, then watches their source and re-runs only the
+    steps affected by each change, along with the steps that depend on them.
+
+    A step is affected when its own code changes, or the code of anything it uses that is defined in the watched
+    source: functions, classes, methods of its test class, fixtures and simple module constants, followed through
+    whatever they use in turn. Changed modules are reloaded, and each test gets a new instance that keeps the results,
+    and any attributes set by its steps, of the previous instance.
+
+    The teardown flight of each test is held back while watching, so that what the setup steps made can be used by
+    later re-runs. It runs before a setup step is run again, in which case the whole test is run again, and when
+    watching stops.
+
+    Changes are picked up by checking modification times every poll_interval seconds, and acted on once nothing has
+    changed for debounce seconds. A change cancels the run in progress. Steps that are running finish, and no more are
+    started.
+    """
+    POLL_INTERVAL = 0.5
+    DEBOUNCE = 0.3
+
+    def __init__(self, paths, pattern=PATTERN, run_kwargs=None, logger: StaircaseLogger = None,
+                 poll_interval=POLL_INTERVAL, debounce=DEBOUNCE):
+        self.paths = paths
+        self.pattern = pattern
+        self.run_kwargs = run_kwargs or {}
+        self.logger = logger if logger is not None else DefaultLogger.get_default()
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+
+        self._sources = []
+        self._roots = []
+        self._modification_times: Dict[str, float] = {}
+
+        self._tests: Dict[str, StaircaseTest] = {}
+        self._fingerprints: Dict[str, Dict[str, str]] = {}
+
+        # Steps of each test that still have to be run, and the tests whose teardown flight has not run since setup
+        self._pending: Dict[str, Set[str]] = {}
+        self._set_up = set()
+
+        self._run_thread = None
+        self._cancelled = threading.Event()
+
+    def watch(self):
+        """
+        Run every test, then re-run the steps affected by each change until interrupted.
+        """
+        self.load()
+        self._start_run()
+        try:
+            while True:
+                time.sleep(self.poll_interval)
+                changed = self.find_changes()
+                if not changed:
+                    continue
+
+                self.cancel()
+                while True:
+                    time.sleep(self.debounce)
+                    more_changes = self.find_changes()
+                    if not more_changes:
+                        break
+                    changed |= more_changes
+
+                self._wait_for_run()
+                self.reload(changed)
+                self._start_run()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.cancel()
+            self._wait_for_run()
+            self.close()
+
+    def load(self) -> Dict[str, Set[str]]:
+        """
+        Import every test and mark all of their setup and main flight steps to run. Returns the steps to run of each
+        test.
+        """
+        self._sources = [source for path in self.paths for source in _get_sources(path, self.pattern)]
+        modules = [self._reimport(lambda: _import_source(source), source) for source in self._sources]
+
+        self._roots = [os.path.abspath(path) for path in self._get_watched_paths()]
+        for module in modules:
+            if module is not None:
+                self._load_module(module)
+
+        self.find_changes()
+        return self._pending
+
+    def find_changes(self) -> Set[str]:
+        """
+        Get the watched files that were added, changed or removed since the last call.
+        """
+        modification_times = {}
+        for path in self._get_watched_files():
+            try:
+                modification_times[path] = os.stat(path).st_mtime
+            except OSError:
+                pass
+
+        changed = {path for path in modification_times.keys() | self._modification_times.keys()
+                   if modification_times.get(path) != self._modification_times.get(path)}
+        self._modification_times = modification_times
+        return changed
+
+    def reload(self, changed) -> Dict[str, Set[str]]:
+        """
+        Reload the modules of the changed files and find the steps the changes affect. Returns the steps to run of each
+        test.
+        """
+        sources = {os.path.abspath(source): source for source in self._sources if source.endswith('.py')}
+        changed_sources = [sources[path] for path in changed if path in sources]
+
+        # Changing any other module reloads it, and every test module, to pick up what they import from it
+        other_files = [path for path in changed if path not in sources]
+        for path in other_files:
+            for module in self._get_modules_of_file(path):
+                self._reimport(lambda: importlib.reload(module), path)
+
+        self._sources = [source for path in self.paths for source in _get_sources(path, self.pattern)]
+        if other_files:
+            changed_sources = self._sources
+
+        self.logger.info(f"\nChanged: {', '.join(sorted(os.path.relpath(path) for path in changed))}")
+
+        test_ids = set()
+        for source in changed_sources:
+            module = self._reimport(lambda: self._reimport_source(source), source)
+            if module is not None:
+                test_ids |= self._load_module(module)
+
+        # Tests whose module was changed and no longer defines them
+        changed_modules = {_get_module_name(os.path.abspath(source)) for source in changed_sources}
+        for test_id in list(self._tests):
+            if test_id.split('::')[0] in changed_modules and test_id not in test_ids:
+                self._remove_test(test_id)
+
+        return self._pending
+
+    def run(self):
+        """
+        Run the pending steps of each test, one test at a time, until they have all run or the run is cancelled.
+        """
+        for test_id in sorted(self._pending):
+            if self._cancelled.is_set():
+                return
+
+            try:
+                self._run_test(test_id)
+            except Exception as e:
+                self._pending.pop(test_id, None)  # Run it again once it is changed
+                self.logger.error(f'{test_id} raised {type(e).__name__}: {str(e)}')
+
+    def cancel(self):
+        """
+        Stop the run in progress from starting any more steps or tests.
+        """
+        self._cancelled.set()
+
+    def close(self):
+        """
+        Run the teardown flight of every test that has run its setup flight.
+        """
+        for test_id in sorted(self._set_up):
+            try:
+                self._tear_down(test_id)
+            except Exception as e:
+                self.logger.error(f'The teardown of {test_id} raised {type(e).__name__}: {str(e)}')
+
+    def _start_run(self):
+        self._cancelled.clear()
+        self._run_thread = threading.Thread(target=self.run, daemon=True)
+        self._run_thread.start()
+
+    def _wait_for_run(self):
+        if self._run_thread is not None:
+            self._run_thread.join()
+            self._run_thread = None
+
+    def _run_test(self, test_id):
+        test = self._tests[test_id]
+        steps = self._pending[test_id]
+
+        # What the setup flight made is released by the teardown flight before it runs again, so every step that may
+        # use it runs again too
+        if steps & set(test._setup_steps) and test_id in self._set_up:
+            self._tear_down(test_id)
+            steps = set(test._setup_steps) | set(test._main_steps)
+
+        # The test checks the event itself, so a cancel that comes before the rerun starts is not lost
+        test.rerun(steps, teardown=False, cancelled=self._cancelled, **self.run_kwargs)
+
+        self._set_up.add(test_id)
+        if self._cancelled.is_set():
+            # Only the steps the cancelled run skipped or did not reach are left to run
+            self._pending[test_id] = {step for step in steps if test.step_registry[step].results[0] is None}
+        else:
+            del self._pending[test_id]
+
+    def _tear_down(self, test_id):
+        test = self._tests[test_id]
+        self._set_up.discard(test_id)
+        if test._teardown_steps:
+            test.rerun(test._teardown_steps, **self.run_kwargs)
+
+    def _remove_test(self, test_id):
+        if test_id in self._set_up:
+            self._tear_down(test_id)
+
+        del self._tests[test_id]
+        del self._fingerprints[test_id]
+        self._pending.pop(test_id, None)
+
+    def _load_module(self, module):
+        """
+        Make an instance of each test class in the module, marking the steps that changed since the last instance to
+        run. Returns the ids of the tests.
+        """
+        test_ids = set()
+        for test_class in _get_test_classes(module):
+            test_id = f'{module.__name__}::{test_class.__qualname__}'
+            test_ids.add(test_id)
+
+            fingerprints = self._get_fingerprints(test_class)
+            old_fingerprints = self._fingerprints.get(test_id, {})
+            changed_steps = {step for step in fingerprints if fingerprints[step] != old_fingerprints.get(step)}
+
+            test = test_class(logger=self.logger)
+            if test_id in self._tests:
+                _carry_over(self._tests[test_id], test)
+
+            self._tests[test_id] = test
+            self._fingerprints[test_id] = fingerprints
+
+            # Steps still waiting from a cancelled run, and the setup and main flight steps that changed. Changed
+            # teardown steps run with the rest of the teardown flight.
+            pending = {step for step in self._pending.get(test_id, ()) if step in fingerprints}
+            pending |= changed_steps - set(test._teardown_steps)
+            if pending:
+                self._pending[test_id] = pending
+            else:
+                self._pending.pop(test_id, None)
+
+        return test_ids
+
+    def _reimport(self, function, path):
+        try:
+            return function()
+        except Exception as e:
+            self.logger.error(f'Could not import {os.path.relpath(path)}. {type(e).__name__}: {str(e)}')
+            return None
+
+    @staticmethod
+    def _reimport_source(source):
+        if not source.endswith('.py'):
+            return importlib.reload(importlib.import_module(source))
+
+        sys.modules.pop(_get_module_name(os.path.abspath(source)), None)
+        return _import_source(source)
+
+    def _get_watched_paths(self):
+        for path in self.paths:
+            if os.path.exists(path):
+                yield path
+            else:
+                module = sys.modules.get(path)
+                if getattr(module, '__file__', None):
+                    yield module.__file__
+
+    def _get_watched_files(self):
+        for root in self._roots:
+            if os.path.isdir(root):
+                for directory, subdirectories, files in os.walk(root):
+                    subdirectories[:] = sorted(d for d in subdirectories if not d.startswith(('.', '__')))
+                    for file in sorted(files):
+                        if file.endswith('.py'):
+                            yield os.path.join(directory, file)
+            else:
+                yield root
+
+    @staticmethod
+    def _get_modules_of_file(path):
+        return [module for module in list(sys.modules.values())
+                if getattr(module, '__file__', None) and os.path.abspath(module.__file__) == path]
+
+    def _is_watched(self, value):
+        module = value if isinstance(value, types.ModuleType) else sys.modules.get(getattr(value, '__module__', None))
+        path = getattr(module, '__file__', None)
+        if not path:
+            return False
+
+        path = os.path.abspath(path)
+        return any(path == root or path.startswith(root + os.sep) for root in self._roots)
+
+    def _get_fingerprints(self, test_class) -> Dict[str, str]:
+        """
+        Get a hash of each step of a test class, covering its declaration and the code it runs.
+        """
+        fingerprints = {}
+        for step_name, step in test_class._plan.step_registry.items():
+            method = step.method_reference
+            parts = [step.step_type, step.on_pass, step.on_fail, method.desc, method.timeout, method.executor,
+                     method.cache, sorted(fixture.name for fixture in method.fixtures)]
+
+            seen = set()
+            for value in (method.function, *method.fixtures, method.params, method.ids, method.cache_inputs):
+                parts.append(self._get_fingerprint(value, test_class, seen))
+
+            fingerprints[step_name] = hashlib.sha256(repr(parts).encode()).hexdigest()
+
+        return fingerprints
+
+    def _get_fingerprint(self, value, owner, seen):
+        if isinstance(value, SIMPLE_TYPES):
+            return repr(value)
+
+        if isinstance(value, (tuple, list)):
+            return repr([self._get_fingerprint(item, owner, seen) for item in value])
+
+        if isinstance(value, (staticmethod, classmethod)):
+            value = value.__func__
+        elif isinstance(value, property):
+            value = value.fget
+
+        if isinstance(value, _Fixture):
+            return f'Fixture {value.scope} {value.pool_size} {self._get_fingerprint(value.function, owner, seen)}'
+
+        if isinstance(value, types.ModuleType):
+            name = value.__name__
+        else:
+            name = f"{getattr(value, '__module__', None)}.{getattr(value, '__qualname__', type(value).__qualname__)}"
+
+        # Only code in the watched source can change, anything else is known by its name
+        if id(value) in seen or not self._is_watched(value):
+            return name
+        seen.add(id(value))
+
+        if isinstance(value, types.FunctionType):
+            return f'{name} {self._get_function_fingerprint(value, owner, seen)}'
+
+        if isinstance(value, (type, types.ModuleType)):
+            members = sorted((member_name, member) for member_name, member in vars(value).items()
+                             if not member_name.startswith('__') and _is_code_or_constant(member))
+            return f'{name} {[(member_name, self._get_fingerprint(member, owner, seen)) for member_name, member in members]}'
+
+        return name
+
+    def _get_function_fingerprint(self, function, owner, seen):
+        names = set()
+        parts = [_get_code_fingerprint(function.__code__, names)]
+
+        # The globals and methods of the test class that the function uses, such as helper functions and self.helper()
+        for name in sorted(names):
+            if name in function.__globals__:
+                parts.append((name, self._get_fingerprint(function.__globals__[name], owner, seen)))
+            else:
+                member = _get_class_member(owner, name)
+                if member is not None and not isinstance(member, _StepDecorator):
+                    parts.append((name, self._get_fingerprint(member, owner, seen)))
+
+        for cell in function.__closure__ or ():
+            try:
+                parts.append(self._get_fingerprint(cell.cell_contents, owner, seen))
+            except ValueError:
+                pass  # An empty cell
+
+        parts.append(self._get_fingerprint(function.__defaults__, owner, seen))
+        return repr(parts)
+
+
+def _get_code_fingerprint(code, names):
+    """
+    Get a fingerprint of compiled code that stays the same when only its line numbers change, adding the names it
+    uses to names.
+    """
+    names.update(code.co_names)
+    consts = [_get_code_fingerprint(const, names) if isinstance(const, types.CodeType) else repr(const)
+              for const in code.co_consts]
+    return hashlib.sha256(repr((code.co_code, code.co_names, code.co_varnames, consts)).encode()).hexdigest()
+
+
+def _is_code_or_constant(value):
+    return isinstance(value, (types.FunctionType, type, staticmethod, classmethod, property, _Fixture, *SIMPLE_TYPES))
+
+
+def _get_class_member(owner, name):
+    for cls in owner.__mro__:
+        if name in vars(cls):
+            return vars(cls)[name]
+    return None
+
+
+def _carry_over(old_test, new_test):
+    """
+    Give a new instance of a reloaded test the results of the previous instance, and the attributes its steps set.
+    """
+    for name, value in vars(old_test).items():
+        if name not in vars(new_test):
+            setattr(new_test, name, value)
+
+    for step_name, old_step in old_test.step_registry.items():
+        if step_name not in new_test._plan.step_registry:
+            continue
+
+        new_step = new_test.step_registry[step_name]
+        new_step.results = old_step.results
+        new_step.substeps = old_step.substeps
+        new_step.cached = old_step.cached
+        new_step.metrics = old_step.metrics
+        new_step.timed_out = old_step.timed_out
+        new_step.instances = list(old_step.instances)
+        for instance in old_step.instances:
+            new_test.step_registry[instance] = replace(old_test.step_registry[instance],
+                                                       method_reference=new_step.method_reference)
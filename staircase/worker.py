@@ -0,0 +1,36 @@
+from staircase.distributed import run_worker
+import importlib
+import argparse
+import sys
+
+
+def _parse_address(address):
+    host, _, port = address.rpartition(':')
+    try:
+        return host or '127.0.0.1', int(port)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'Invalid address {address}. Must be of the form host:port.')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m staircase.worker',
+                                     description='Run steps sent by a staircase coordinator.')
+    parser.add_argument('address', type=_parse_address, help='The host:port of the coordinator.')
+    parser.add_argument('--authkey', required=True, help='The authkey of the coordinator.')
+    parser.add_argument('--path', action='append', default=[],
+                        help='Directory to import test modules from. May be given more than once.')
+    parser.add_argument('--import', dest='modules', action='append', default=[],
+                        help='Module to import before connecting, to check the tests can be loaded.')
+    parser.add_argument('--name', default=None, help='Name of the worker. Defaults to host:pid.')
+    args = parser.parse_args(argv)
+
+    sys.path[:0] = args.path
+    for module in args.modules:
+        importlib.import_module(module)
+
+    run_worker(args.address, args.authkey, args.name)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
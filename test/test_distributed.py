@@ -0,0 +1,61 @@
+from staircase import StaircaseTest, Setup, Test, Substep, Coordinator, run_worker
+import multiprocessing
+import os
+
+import pytest
+
+
+class DistributedTest(StaircaseTest):
+    @Setup
+    def prepare(self):
+        return True, 21
+
+    @Test(on_pass='prepare')
+    def double(self):
+        @Substep(desc='Is positive', on_pass='prepare')
+        def is_positive(number):
+            return number > 0
+
+        is_positive(self.get_return_from_step('prepare'))
+        return True, (self.get_return_from_step('prepare') * 2, os.getpid())
+
+    @Test
+    def lose_worker(self):
+        # Exit the first worker that runs this step, so that it has to be run again on another worker
+        marker = os.environ['STAIRCASE_LOST_WORKER_MARKER']
+        if not os.path.exists(marker):
+            open(marker, 'w').close()
+            os._exit(1)
+        return True, os.getpid()
+
+    @Test(on_pass='double')
+    def fail(self):
+        return False, 'failed remotely'
+
+
+def _start_workers(coordinator, count):
+    workers = [multiprocessing.Process(target=run_worker, args=(coordinator.address, coordinator.authkey))
+               for _ in range(count)]
+    for worker in workers:
+        worker.start()
+    assert coordinator.wait_for_workers(count, timeout=10)
+    return workers
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != 'fork', reason='Workers must import this module')
+def test_coordinator_runs_main_steps_on_workers_and_survives_worker_loss(tmp_path, monkeypatch):
+    monkeypatch.setenv('STAIRCASE_LOST_WORKER_MARKER', str(tmp_path / 'lost'))
+
+    with Coordinator() as coordinator:
+        workers = _start_workers(coordinator, 3)
+        test = DistributedTest()
+        test.run(coordinator=coordinator)
+
+    for worker in workers:
+        worker.join(10)
+
+    value, pid = test.get_return_from_step('double')
+    assert value == 42 and pid != os.getpid()
+    assert len(test.step_registry['double'].substeps) == 1
+    assert test.step_passed('lose_worker')
+    assert test.get_step_results('fail') == (False, 'failed remotely')
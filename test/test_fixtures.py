@@ -0,0 +1,96 @@
+from staircase import StaircaseTest, Setup, Task, Test, Teardown, Fixture, FixtureScope
+from staircase.fixtures import close_fixtures
+import threading
+import time
+
+events = []
+
+
+@Fixture
+def connection():
+    events.append('open')
+    yield 'connection'
+    events.append('close')
+
+
+@Fixture(scope=FixtureScope.CLASS)
+def parsed_file():
+    events.append('parse')
+    return {'rows': 3}
+
+
+handles = iter(range(100))
+in_use = set()
+in_use_lock = threading.Lock()
+max_in_use = [0]
+
+
+@Fixture(scope=FixtureScope.CLASS, pool_size=2)
+def handle():
+    return next(handles)
+
+
+class FixtureTest(StaircaseTest):
+    @Setup(fixtures=connection)
+    def connect(self):
+        return self.get_fixture(connection) == 'connection'
+
+    @Test(on_pass='connect')
+    def read(self):
+        return self.get_fixture(connection) == 'connection' and self.get_fixture(parsed_file)['rows'] == 3
+
+    @Teardown
+    def disconnect(self):
+        return 'close' not in events
+
+
+def test_fixtures_are_created_once_and_closed_at_the_end_of_their_scope():
+    events.clear()
+    FixtureTest().run()
+    FixtureTest().run()
+
+    assert events == ['open', 'parse', 'close', 'open', 'close']
+
+    close_fixtures(FixtureScope.CLASS)
+    FixtureTest().run()
+    assert events.count('parse') == 2
+
+
+def _use_handle(self):
+    value = self.get_fixture(handle)
+    with in_use_lock:
+        assert value not in in_use
+        in_use.add(value)
+        max_in_use[0] = max(max_in_use[0], len(in_use))
+
+    time.sleep(0.05)
+    with in_use_lock:
+        in_use.discard(value)
+    return True
+
+
+class PooledFixtureTest(StaircaseTest):
+    @Task(fixtures=handle)
+    def first(self):
+        return _use_handle(self)
+
+    @Task(fixtures=handle)
+    def second(self):
+        return _use_handle(self)
+
+    @Task(fixtures=handle)
+    def third(self):
+        return _use_handle(self)
+
+    @Task(fixtures=handle)
+    def fourth(self):
+        return _use_handle(self)
+
+
+def test_pooled_fixtures_are_checked_out_by_one_step_at_a_time():
+    test = PooledFixtureTest()
+    test.run(workers=4)
+
+    assert all(test.step_passed(step) for step in test.ordered_list)
+    assert max_in_use[0] == 2
+    assert next(handles) == 2
@@ -0,0 +1,44 @@
+from staircase import StaircaseTest, Setup, Task, Test, DurationStore
+from staircase.history import estimate_run
+from staircase.sinks import _get_test_id
+import time
+
+
+class HistoryTest(StaircaseTest):
+    @Setup
+    def prepare(self):
+        return True
+
+    @Task
+    def fast(self):
+        return True
+
+    @Task
+    def slow(self):
+        time.sleep(0.05)
+        return True
+
+    @Test(on_pass=('fast', 'slow'))
+    def check(self):
+        return True
+
+
+def test_duration_store_keeps_the_last_durations(tmp_path):
+    store = DurationStore(tmp_path / 'history.db', keep=3)
+    for duration in (10, 1, 2, 3):
+        store.record('test', {'step': duration})
+
+    assert store.get_expected_durations('test') == {'step': 2}
+    assert store.get_expected_durations('other') == {}
+
+
+def test_run_estimate_follows_the_critical_path(tmp_path):
+    path = tmp_path / 'history.db'
+    test = HistoryTest()
+    test.run(history=path)
+
+    estimate = estimate_run(test, DurationStore(path).get_expected_durations(_get_test_id(test)))
+    assert estimate.critical_path == ['slow', 'check']
+    assert estimate.unknown_steps == []
+    assert estimate.parallel_time < estimate.sequential_time
+    assert estimate.parallel_time >= 0.05
@@ -1,2 +1,63 @@
+from staircase.logger import StaircaseLogger, QueueLogger
+import weakref
+import time
+import gc
+
+
 def test():
-    pass
\ No newline at end of file
+    pass
+
+
+class RecordingLogger(StaircaseLogger):
+    def __init__(self):
+        self.calls = []
+
+    def info(self, *args, **kwargs):
+        self.calls.append(('info', *args))
+
+    def error(self, *args, **kwargs):
+        self.calls.append(('error', *args))
+
+
+def test_queue_logger_batches_records():
+    target = RecordingLogger()
+    logger = QueueLogger(target, flush_interval=1)
+
+    for i in range(100):
+        logger.info('line', i)
+    logger.error('failed')
+    logger.flush()
+
+    assert len(target.calls) == 2
+    assert target.calls[0] == ('info', '\n'.join(f'line {i}' for i in range(100)))
+    assert target.calls[1] == ('error', 'failed')
+    logger.close()
+
+
+def test_queue_logger_drops_when_full():
+    class SlowLogger(RecordingLogger):
+        def info(self, *args, **kwargs):
+            time.sleep(0.2)
+            super().info(*args, **kwargs)
+
+    target = SlowLogger()
+    logger = QueueLogger(target, max_queue_size=1, batch_size=1, drop_when_full=True)
+
+    for i in range(10):
+        logger.info(i)
+    logger.close()
+
+    assert logger.dropped_count > 0
+    assert len(target.calls) == 10 - logger.dropped_count + 1
+    assert target.calls[-1][0] == 'error'
+
+
+def test_closed_queue_loggers_are_released():
+    logger = QueueLogger(RecordingLogger())
+    logger.info('line')
+    logger.close()
+
+    reference = weakref.ref(logger)
+    del logger
+    gc.collect()
+    assert reference() is None
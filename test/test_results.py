@@ -0,0 +1,40 @@
+from staircase import StaircaseTest, Setup, Test, ResultStore
+from staircase.results import StoredResult
+from array import array
+import os
+
+
+class LargeResultTest(StaircaseTest):
+    @Setup
+    def load(self):
+        return True, array('d', range(200000))
+
+    @Setup
+    def small(self):
+        return True, b'small'
+
+    @Test(on_pass='load', executor='process')
+    def total(self):
+        values = self.get_return_from_step('load')
+        return sum(values) == 199999 * 100000, bytes(2 * 1024 ** 2)
+
+
+def test_large_results_are_stored_out_of_band(tmp_path):
+    test = LargeResultTest()
+    test.run(result_store=ResultStore(threshold=1024 ** 2, directory=str(tmp_path)))
+
+    stored = test.step_registry['load'].results[1]
+    assert isinstance(stored, StoredResult)
+    assert test.get_return_from_step('load')[10] == 10.0
+    assert test.get_return_from_step('load').format == 'd'
+    assert test.get_return_from_step('small') == b'small'
+
+    # The worker process stored its own large result, and sent back a handle to it
+    assert test.step_passed('total')
+    assert isinstance(test.step_registry['total'].results[1], StoredResult)
+    assert len(test.get_return_from_step('total')) == 2 * 1024 ** 2
+
+    # Files are removed when the next run clears the results
+    test.run()
+    assert not os.path.exists(stored.path)
+    assert isinstance(test.get_return_from_step('load'), array)
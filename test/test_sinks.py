@@ -0,0 +1,58 @@
+from staircase import StaircaseTest, Setup, Test, Substep, JsonLinesSink, JUnitXmlSink, ProgressSink
+import xml.etree.ElementTree as ElementTree
+import json
+import io
+
+
+class SinkTest(StaircaseTest):
+    @Setup
+    def prepare(self):
+        return True, 'x' * 1000
+
+    @Test(on_pass='prepare')
+    def check(self):
+        @Substep(desc='Is even', on_pass='prepare')
+        def is_even(number):
+            return number % 2 == 0, number
+
+        is_even(1)
+        return True
+
+    @Test(on_fail='prepare')
+    def recover(self):
+        return True
+
+
+def test_json_lines_sink(tmp_path):
+    path = tmp_path / 'results.jsonl'
+    SinkTest().run(sinks=[JsonLinesSink(path)])
+
+    events = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [event['event'] for event in events] == ['start', 'step', 'substep', 'step', 'step', 'finish']
+
+    prepare, substep, check, recover = events[1:5]
+    assert prepare['flight'] == 'setup' and prepare['status'] == 'pass' and len(prepare['return']) == 200
+    assert substep['substep'] == 'check.is_even' and substep['status'] == 'fail' and substep['return'] == '1'
+    assert check['on_pass'] == ['prepare'] and check['duration'] >= 0
+    assert recover['status'] == 'skip'
+    assert events[-1]['passed'] == 2 and events[-1]['skipped'] == 1
+
+
+def test_junit_xml_sink(tmp_path):
+    path = tmp_path / 'results.xml'
+    SinkTest().run(sinks=[JUnitXmlSink(path)])
+
+    cases = ElementTree.parse(path).getroot().findall('./testsuite/testcase')
+    assert [case.get('name') for case in cases] == ['prepare', 'check.is_even', 'check', 'recover']
+    assert cases[1].find('failure') is not None
+    assert cases[3].find('skipped') is not None
+
+
+def test_progress_sink_writes_lines_when_not_on_a_terminal():
+    stream = io.StringIO()
+    SinkTest().run(sinks=[ProgressSink(stream, interval=0)])
+
+    lines = stream.getvalue().splitlines()
+    assert lines[0] == 'setup 0/1 | main 0/2'
+    assert lines[-1] == 'setup 1/1 | main 2/2 | 1 skipped'
+    assert any(line.startswith('running check') for line in ' '.join(lines).split(' | '))
@@ -0,0 +1,83 @@
+from staircase.suite import discover_tests, get_shard, run_suite
+from staircase.__main__ import get_parser
+
+import pytest
+
+TEST_MODULE = '''
+import os
+from staircase import StaircaseTest, Setup, Test
+
+
+class PassingTest(StaircaseTest):
+    @Setup
+    def prepare(self):
+        return True, 'ready'
+
+    @Test(on_pass='prepare')
+    def check(self):
+        return True
+
+
+class FailingTest(StaircaseTest):
+    @Test
+    def check(self):
+        return False, 'x' * 1000
+
+
+class CrashingTest(StaircaseTest):
+    @Test
+    def crash(self):
+        os._exit(1)
+'''
+
+
+def _write_suite(tmp_path):
+    (tmp_path / 'test_suite_module.py').write_text(TEST_MODULE)
+    (tmp_path / 'helpers.py').write_text('raise Exception("not a test module")')
+    return discover_tests([str(tmp_path)])
+
+
+def test_discover_tests_finds_subclasses_sorted_by_id(tmp_path):
+    tests = _write_suite(tmp_path)
+
+    assert [test.class_name for test in tests] == ['CrashingTest', 'FailingTest', 'PassingTest']
+
+
+def test_modules_that_fail_to_import_are_reported_per_file(tmp_path):
+    (tmp_path / 'test_broken.py').write_text('import not_a_module')
+    tests = _write_suite(tmp_path)
+    broken = next(test for test in tests if test.class_name is None)
+
+    assert len(tests) == 4 and broken.test_id.endswith('test_broken')
+    assert run_suite([broken], processes=1)[0].error.startswith('Could not import')
+
+
+def test_shards_are_disjoint_and_cover_the_suite(tmp_path):
+    tests = _write_suite(tmp_path)
+    shards = [get_shard(tests, shard, 2) for shard in (1, 2)]
+
+    assert sorted(test.test_id for shard in shards for test in shard) == [test.test_id for test in tests]
+    assert not {test.test_id for test in shards[0]} & {test.test_id for test in shards[1]}
+
+
+def test_run_suite_reports_each_test_and_survives_crashes(tmp_path):
+    tests = _write_suite(tmp_path)
+    crashing, failing, passing = run_suite(tests, processes=2)
+
+    assert crashing.error == 'The worker process running the test crashed.'
+    assert not failing.passed and len(failing.step_registry['check'].results[1]) == 200
+    assert passing.passed and passing.step_registry['prepare'].results == (True, 'ready')
+
+
+def test_fail_fast_suite_stops_starting_tests(tmp_path):
+    tests = _write_suite(tmp_path)
+    crashing, failing, passing = run_suite(tests, processes=1, run_kwargs={'fail_fast': 'suite'})
+
+    assert crashing.error == 'The worker process running the test crashed.'
+    assert failing.skipped == passing.skipped == f'Did not run, the suite stopped after {crashing.test_id} failed.'
+
+
+@pytest.mark.parametrize('shard', ['3/2', '0/2', '1'])
+def test_invalid_shards_are_rejected_by_the_parser(shard):
+    with pytest.raises(SystemExit):
+        get_parser().parse_args(['tests', '--shard', shard])
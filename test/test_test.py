@@ -0,0 +1,770 @@
+import multiprocessing
+import threading
+import asyncio
+import inspect
+import pstats
+import time
+import os
+
+import pytest
+
+from staircase import StaircaseTest, Setup, Task, Test, Teardown, Substep, SubstepRetention, StepCache
+
+
+class ParallelTest(StaircaseTest):
+    # Set to a Barrier(2) to make task_a and task_b wait for each other, which only passes if they run at the same time
+    overlap = None
+
+    @Setup
+    def setup(self):
+        self.finished = []
+        self.lock = threading.Lock()
+        return True
+
+    def _finish(self, name):
+        time.sleep(0.1)
+        with self.lock:
+            self.finished.append(name)
+
+    @Task
+    def task_a(self):
+        if self.overlap is not None:
+            self.overlap.wait()
+        self._finish('task_a')
+        return True, 1
+
+    @Task
+    def task_b(self):
+        if self.overlap is not None:
+            self.overlap.wait()
+        self._finish('task_b')
+        return False, 'b failed'
+
+    @Task(on_pass=('task_a',))
+    def after_a(self):
+        self._finish('after_a')
+        return True, self.get_return_from_step('task_a') + 1
+
+    @Task(on_fail='task_b')
+    def after_b_fails(self):
+        self._finish('after_b_fails')
+        return True
+
+    @Test(on_pass=('task_a', 'task_b'))
+    def after_both(self):
+        return True
+
+    @Teardown
+    def teardown(self):
+        return True
+
+
+def _results(test):
+    return {step: test.step_registry[step].results for step in test.ordered_list}
+
+
+def test_parallel_run_matches_sequential_run():
+    sequential = ParallelTest()
+    sequential.run()
+
+    parallel = ParallelTest()
+    parallel.run(workers=4)
+
+    assert _results(parallel) == _results(sequential)
+    assert parallel.get_return_from_step('after_a') == 2
+    assert parallel.step_registry['after_both'].results[0] is None
+
+
+def test_parallel_run_waits_on_dependencies():
+    test = ParallelTest()
+    test.overlap = threading.Barrier(2, timeout=10)
+    test.run(workers=4)
+
+    assert test.step_registry['task_a'].results == (True, 1)
+    assert test.finished.index('task_a') < test.finished.index('after_a')
+    assert test.finished.index('task_b') < test.finished.index('after_b_fails')
+
+
+class AsyncTest(StaircaseTest):
+    # Set to an Event for each of fetch_a and fetch_b to make them wait for each other
+    overlap = None
+
+    async def _meet(self, name):
+        if self.overlap is not None:
+            self.overlap[name].set()
+            await asyncio.wait_for(asyncio.gather(*(event.wait() for event in self.overlap.values())), 10)
+
+    @Setup
+    async def setup(self):
+        await asyncio.sleep(0)
+        return True
+
+    @Task
+    async def fetch_a(self):
+        await self._meet('fetch_a')
+        await asyncio.sleep(0.2)
+        return True, 1
+
+    @Task
+    async def fetch_b(self):
+        await self._meet('fetch_b')
+        await asyncio.sleep(0.2)
+        return True, 2
+
+    @Test(on_pass=('fetch_a', 'fetch_b'))
+    async def combine(self):
+        @Substep(on_pass='fetch_a')
+        async def check_a(value):
+            await asyncio.sleep(0)
+            return value == 1, value
+
+        passed, a = await check_a(self.get_return_from_step('fetch_a'))
+        return passed, a + self.get_return_from_step('fetch_b')
+
+    @Teardown
+    def teardown(self):
+        return True
+
+
+def test_arun_runs_independent_coroutine_steps_concurrently():
+    test = AsyncTest()
+    test.overlap = {'fetch_a': asyncio.Event(), 'fetch_b': asyncio.Event()}
+    asyncio.run(test.arun())
+
+    assert test.get_step_results('fetch_a') == (True, 1)
+    assert test.get_step_results('combine') == (True, 3)
+    assert len(test.step_registry['combine'].substeps) == 1
+
+
+def test_run_awaits_coroutine_steps():
+    sequential = AsyncTest()
+    sequential.run()
+
+    concurrent = AsyncTest()
+    asyncio.run(concurrent.arun())
+
+    assert _results(sequential) == _results(concurrent)
+
+
+class ProcessTest(StaircaseTest):
+    @Setup
+    def load(self):
+        return True, list(range(1000))
+
+    @Test(on_pass='load', executor='process')
+    def validate(self):
+        @Substep(on_pass='load')
+        def check_sum(values):
+            return sum(values) == 499500
+
+        check_sum(self.get_return_from_step('load'))
+        return True, len(self.get_return_from_step('load'))
+
+
+class UnpicklableProcessTest(StaircaseTest):
+    @Setup
+    def connect(self):
+        return True, threading.Lock()
+
+    @Test(on_pass='connect', executor='process')
+    def validate(self):
+        return True
+
+    @Test(on_pass='validate')
+    def report(self):
+        return True
+
+    @Teardown
+    def disconnect(self):
+        return True
+
+
+def test_process_steps_run_in_a_worker():
+    test = ProcessTest()
+    test.run()
+
+    assert test.get_step_results('validate') == (True, 1000)
+    assert [substep.substep_name for substep in test.step_registry['validate'].substeps] == ['validate.check_sum']
+
+
+def test_process_step_with_unpicklable_dependency_fails_clearly():
+    test = UnpicklableProcessTest()
+    test.run()
+
+    passed, reason = test.get_step_results('validate')
+    assert passed is False and 'return value of step connect cannot be pickled' in reason
+    assert test.get_step_results('report')[0] is None
+    assert test.get_step_results('disconnect') == (True, None)
+
+
+def test_dependency_loop_names_the_steps_in_the_loop():
+    with pytest.raises(Exception, match='a -> b -> c -> a'):
+        class LoopTest(StaircaseTest):
+            @Task(on_pass='b')
+            def a(self):
+                return True
+
+            @Task(on_pass='c')
+            def b(self):
+                return True
+
+            @Task(on_fail='a')
+            def c(self):
+                return True
+
+
+def test_unknown_dependency_is_reported_when_the_class_is_defined():
+    with pytest.raises(Exception, match='Step a has on_pass step missing, which does not exist.'):
+        class UnknownDependencyTest(StaircaseTest):
+            @Task(on_pass='missing')
+            def a(self):
+                return True
+
+
+def test_instances_share_the_plan_but_not_results():
+    first = ParallelTest()
+    second = ParallelTest()
+    first.run()
+
+    assert first._plan is second._plan
+    assert second.step_registry['task_a'].results == (None, None)
+
+
+def test_long_dependency_chain_is_ordered():
+    steps = {}
+    for i in range(5000):
+        def step(self):
+            return True
+        step.__name__ = f'step_{i:04d}'
+        steps[step.__name__] = Task(on_pass=f'step_{i - 1:04d}')(step) if i else Task(step)
+
+    test = type('ChainTest', (StaircaseTest,), steps)()
+
+    assert test.ordered_list == sorted(steps)
+
+
+class ManySubstepsTest(StaircaseTest):
+    @Test
+    def check_items(self):
+        for item in range(10000):
+            @Substep
+            def check_item():
+                return item >= 0
+
+            check_item()
+        return True
+
+
+def test_defining_substeps_in_a_loop_is_cheap(monkeypatch):
+    # Substeps find their step and test from context variables, rather than by walking the stack for each one
+    stack_calls = []
+    monkeypatch.setattr(inspect, 'stack', lambda *args, **kwargs: stack_calls.append(args) or [])
+
+    test = ManySubstepsTest()
+    test.run(show_all=False)
+
+    assert not stack_calls
+    assert len(test.step_registry['check_items'].substeps) == 10000
+
+
+def test_substep_outside_of_a_step_is_rejected():
+    with pytest.raises(Exception, match='Substep can only be defined within a test instance.'):
+        @Substep
+        def orphan():
+            return True
+
+
+class MappedSubstepTest(StaircaseTest):
+    @Test
+    def check_records(self):
+        @Substep(desc='Record is even')
+        def is_even(record):
+            return record % 2 == 0, f'{record} is odd'
+
+        passed, batch = is_even.map(range(1001), max_failures=3)
+        return passed, batch
+
+
+def test_substep_map_records_one_batch():
+    test = MappedSubstepTest()
+    test.run()
+
+    passed, batch = test.get_step_results('check_records')
+    assert not passed
+    assert list(test.step_registry['check_records'].substeps) == [batch]
+    assert (batch.count, batch.passed_count, batch.failed_count) == (1001, 501, 500)
+    assert batch.failures == [(1, '1 is odd'), (3, '3 is odd'), (5, '5 is odd')]
+    assert list(batch.failed_indices())[:3] == [1, 3, 5]
+    assert batch.item_passed(1000)
+
+
+class SubstepRetentionTest(StaircaseTest):
+    @Test
+    def check_items(self):
+        @Substep
+        def check_item(item):
+            return item % 1000 != 0, item
+
+        for item in range(100000):
+            check_item(item)
+        return True
+
+
+def test_substep_retention_keeps_failures_and_counts():
+    test = SubstepRetentionTest(substep_retention=SubstepRetention.FAILURES)
+    test.run(show_all=False)
+
+    substeps = test.step_registry['check_items'].substeps
+    assert (substeps.count, substeps.failed_count, len(substeps)) == (100000, 100, 100)
+    assert [position for position, _ in substeps.items()][:2] == [0, 1000]
+    assert all(not substep.results[0] for substep in substeps)
+
+
+def test_substep_retention_keeps_the_last_substeps():
+    test = SubstepRetentionTest(substep_retention=SubstepRetention.LAST, substep_limit=3)
+    test.run(show_all=False)
+
+    substeps = test.step_registry['check_items'].substeps
+    assert [substep.results[1] for substep in substeps] == [99997, 99998, 99999]
+    assert [position for position, _ in substeps.items()] == [99997, 99998, 99999]
+    assert substeps.dropped_count == 99997
+
+
+class CachedTest(StaircaseTest):
+    calls = []
+    version = 1
+
+    @Setup(cache=True, cache_inputs=lambda self: self.version)
+    def prepare(self):
+        self.calls.append('prepare')
+        return True, [1, 2, 3]
+
+    @Test(on_pass='prepare', cache=True)
+    def check(self):
+        self.calls.append('check')
+        return True, sum(self.get_return_from_step('prepare'))
+
+
+def test_cached_steps_are_replayed(tmp_path):
+    CachedTest.calls = []
+    CachedTest().run(cache_dir=str(tmp_path))
+    test = CachedTest()
+    test.run(cache_dir=str(tmp_path))
+
+    assert CachedTest.calls == ['prepare', 'check']
+    assert test.get_step_results('check') == (True, 6)
+    assert test.step_registry['prepare'].cached
+
+
+def test_changed_cache_inputs_and_no_cache_run_steps_again(tmp_path):
+    CachedTest.calls = []
+    CachedTest().run(cache_dir=str(tmp_path))
+
+    test = CachedTest()
+    test.version = 2
+    test.run(cache_dir=str(tmp_path))
+    CachedTest().run(cache_dir=str(tmp_path), no_cache=True)
+
+    assert CachedTest.calls == ['prepare', 'check', 'prepare', 'check', 'prepare', 'check']
+
+
+class UnpicklableCachedTest(StaircaseTest):
+    @Setup
+    def connect(self):
+        return True, threading.Lock()
+
+    @Test(on_pass='connect', cache=True)
+    def query(self):
+        return True, 'rows'
+
+    @Teardown
+    def disconnect(self):
+        return True
+
+
+def test_cached_step_with_unpicklable_dependency_runs_uncached(tmp_path):
+    for _ in range(2):
+        test = UnpicklableCachedTest()
+        test.run(cache_dir=str(tmp_path))
+
+        assert test.get_step_results('query') == (True, 'rows')
+        assert not test.step_registry['query'].cached
+        assert test.get_step_results('disconnect') == (True, None)
+
+
+def test_step_cache_evicts_old_and_oversized_entries(tmp_path):
+    cache = StepCache(str(tmp_path), max_size=10, max_age=60)
+    cache.store('old', (True, None), [])
+    cache.store('new', (True, 'x' * 100), [])
+    os.utime(tmp_path / 'old.pkl', (0, 0))
+
+    cache.evict()
+
+    assert cache.load('old') is None
+    assert cache.load('new') is None
+
+
+class RestartTest(StaircaseTest):
+    calls = []
+
+    @Setup
+    def warm_up(self):
+        self.calls.append('warm_up')
+        return True
+
+    @Task(on_pass='warm_up')
+    def flaky(self):
+        self.calls.append('flaky')
+        if self.calls.count('flaky') < 3:
+            self.restart('$MAIN')
+        return True
+
+    @Teardown
+    def cool_down(self):
+        self.calls.append('cool_down')
+        return True
+
+
+def test_restart_resumes_from_the_main_flight():
+    RestartTest.calls = []
+    test = RestartTest(restart_retries=2)
+    test.run()
+
+    assert RestartTest.calls == ['warm_up', 'flaky', 'flaky', 'flaky', 'cool_down']
+    assert test.attempts == 3
+    assert test.get_step_results('flaky') == (True, None)
+
+
+def test_restart_limit_fails_the_restarting_step():
+    RestartTest.calls = []
+    test = RestartTest(restart_retries=1)
+    test.run()
+
+    assert RestartTest.calls == ['warm_up', 'flaky', 'flaky', 'cool_down']
+    assert test.attempts == 2
+    assert test.get_step_results('flaky') == (False, 'Can not restart test: Max retries exceeded.')
+
+    # Retries start again from zero on the next run
+    RestartTest.calls = []
+    test.run()
+    assert test.attempts == 2
+
+
+class ParallelRestartTest(StaircaseTest):
+    @Setup
+    def setup(self):
+        self.restarted = threading.Event()
+        return True
+
+    @Task
+    def a_slow(self):
+        # Still running when d_restarter restarts the test, so b_after_slow has not started yet
+        self.restarted.wait(10)
+        time.sleep(0.2)
+        return True
+
+    @Task(on_pass='a_slow')
+    def b_after_slow(self):
+        return True, 'ran'
+
+    @Task
+    def d_restarter(self):
+        if not self.restarted.is_set():
+            self.restarted.set()
+            self.restart('d_restarter')
+        return True
+
+
+def test_parallel_restart_runs_steps_that_had_not_finished():
+    test = ParallelRestartTest()
+    test.run(workers=4)
+    assert test.ordered_list.index('b_after_slow') < test.ordered_list.index('d_restarter')
+
+    # The same results as running the steps one at a time, where b_after_slow finishes before the restart
+    assert test.attempts == 2
+    assert _results(test) == {'setup': (True, None), 'a_slow': (True, None), 'b_after_slow': (True, 'ran'),
+                              'd_restarter': (True, None)}
+
+
+class MetricsTest(StaircaseTest):
+    @Setup
+    def allocate(self):
+        return True, len(bytearray(10 ** 6))
+
+    @Test(on_pass='allocate')
+    def wait(self):
+        @Substep(desc='Sleeps', on_pass='allocate')
+        def sleep():
+            time.sleep(0.05)
+            return True
+
+        sleep()
+        return True
+
+    @Test(timeout=5)
+    def spin(self):
+        # Runs on a thread of its own because of the timeout
+        start = time.thread_time()
+        while time.thread_time() - start < 0.2:
+            pass
+        return True
+
+
+def test_step_metrics_are_recorded(tmp_path):
+    test = MetricsTest()
+    test.run(track_memory=True, profile=str(tmp_path))
+
+    assert test.get_step_metrics('allocate').peak_memory >= 10 ** 6
+    assert test.get_step_metrics('wait').wall_time >= 0.05
+    assert test.get_step_metrics('wait').cpu_time < 0.05
+    assert list(test.step_registry['wait'].substeps)[0].metrics.wall_time >= 0.05
+    assert (tmp_path / 'MetricsTest.wait.pstats').exists()
+
+    # Memory is only tracked when asked for
+    test.run()
+    assert test.get_step_metrics('allocate').peak_memory is None
+
+
+def test_cpu_time_is_measured_on_the_thread_that_runs_the_step():
+    test = MetricsTest()
+    test.run()
+    assert test.get_step_metrics('spin').cpu_time >= 0.2
+
+    asyncio.run(test.arun())
+    assert test.get_step_metrics('spin').cpu_time >= 0.2
+
+
+def test_measured_steps_run_one_at_a_time(tmp_path):
+    for measuring in ({'profile': str(tmp_path)}, {'track_memory': True}):
+        test = ParallelTest()
+        test.run(workers=4, **measuring)
+        assert test.finished == [step for step in test.ordered_list if step in test.finished]
+
+    test = AsyncTest()
+    asyncio.run(test.arun(profile=str(tmp_path)))
+    assert (tmp_path / 'AsyncTest.fetch_b.pstats').exists()
+
+
+def _profiled_functions(path):
+    return {function for _, _, function in pstats.Stats(str(path)).stats}
+
+
+def test_steps_are_profiled_on_the_thread_that_runs_them(tmp_path):
+    # Steps with a timeout run on a thread of their own
+    MetricsTest().run(profile=str(tmp_path))
+    assert 'spin' in _profiled_functions(tmp_path / 'MetricsTest.spin.pstats')
+
+    # Coroutine steps run from run are awaited on the background event loop
+    AsyncTest().run(profile=str(tmp_path))
+    assert 'fetch_b' in _profiled_functions(tmp_path / 'AsyncTest.fetch_b.pstats')
+
+
+class TimeoutTest(StaircaseTest):
+    @Task(timeout=0.1)
+    def hang(self):
+        while not self.step_timed_out():
+            time.sleep(0.01)
+        return True
+
+    @Task(on_fail='hang')
+    def recover(self):
+        return True
+
+    @Task(timeout=0.1)
+    async def hang_async(self):
+        await asyncio.sleep(10)
+        return True
+
+    @Task
+    def slow(self):
+        # Passes after half a second, unless the deadline of the run comes first
+        finish = time.monotonic() + 0.5
+        while time.monotonic() < finish:
+            if self.step_timed_out():
+                return False
+            time.sleep(0.01)
+        return True
+
+    @Task(on_pass='slow')
+    def after_slow(self):
+        return True
+
+    @Teardown
+    def clean_up(self):
+        return True
+
+
+def test_timed_out_steps_fail_and_skip_their_dependents():
+    test = TimeoutTest()
+    test.run()
+
+    assert test.get_step_results('hang') == (False, 'Step timed out after 0.1 seconds.')
+    assert test.get_step_results('hang_async') == (False, 'Step timed out after 0.1 seconds.')
+    assert test.step_registry['hang'].timed_out and test.step_registry['hang_async'].timed_out
+    assert test.step_registry['recover'].results[0] is None
+    assert test.step_passed('after_slow')
+
+
+def test_steps_still_running_at_the_deadline_time_out():
+    # The main flight has 0.2 seconds, well short of the half second slow needs
+    test = TimeoutTest()
+    test.run(deadline=0.3, teardown_budget=0.1)
+
+    passed, reason = test.get_step_results('slow')
+    assert passed is False and 'deadline of the run' in reason and test.step_registry['slow'].timed_out
+    assert test.step_registry['after_slow'].results[0] is None
+    assert test.step_passed('clean_up')
+
+
+class ProcessTimeoutTest(StaircaseTest):
+    @Task(timeout=0.2, executor='process')
+    def hang(self):
+        with open(os.environ['STAIRCASE_HANG_PID'], 'w') as f:
+            f.write(str(os.getpid()))
+        time.sleep(60)
+        return True
+
+
+def test_timed_out_process_steps_are_killed(tmp_path, monkeypatch):
+    pid_path = tmp_path / 'pid'
+    monkeypatch.setenv('STAIRCASE_HANG_PID', str(pid_path))
+
+    test = ProcessTimeoutTest()
+    test.run()
+    assert test.get_step_results('hang') == (False, 'Step timed out after 0.2 seconds.')
+
+    # The process running the step is killed, rather than left holding a worker until the step returns
+    pid = int(pid_path.read_text())
+    for _ in range(100):
+        if pid not in [child.pid for child in multiprocessing.active_children()]:
+            break
+        time.sleep(0.05)
+    else:
+        raise AssertionError(f'The process running the step, {pid}, is still alive.')
+
+
+def test_timed_out_steps_are_cancelled_by_arun():
+    test = TimeoutTest()
+    asyncio.run(test.arun())
+
+    assert test.get_step_results('hang') == (False, 'Step timed out after 0.1 seconds.')
+    assert test.get_step_results('hang_async') == (False, 'Step timed out after 0.1 seconds.')
+    assert test.step_passed('after_slow')
+
+
+class TargetedTest(StaircaseTest):
+    @Setup
+    def open_database(self):
+        return True
+
+    @Setup
+    def load_files(self):
+        return True
+
+    @Task(on_pass='open_database')
+    def query(self):
+        return True
+
+    @Test(on_pass='query')
+    def check_query(self):
+        return True
+
+    @Test(on_pass='load_files')
+    def check_files(self):
+        return True
+
+    @Teardown(on_pass='open_database')
+    def close_database(self):
+        return True
+
+    @Teardown(on_pass='load_files')
+    def delete_files(self):
+        return True
+
+
+def test_only_runs_the_closure_of_the_targets():
+    test = TargetedTest()
+    test.run(only=['check_query'])
+
+    ran = {step for step in test.ordered_list if test.step_registry[step].results != (None, None)}
+    assert ran == {'open_database', 'query', 'check_query', 'close_database'}
+
+    test.run(match='check_f*')
+    ran = {step for step in test.ordered_list if test.step_registry[step].results != (None, None)}
+    assert ran == {'load_files', 'check_files', 'delete_files'}
+
+    with pytest.raises(Exception):
+        test.run(only=['missing'])
+
+
+class FailFastTest(StaircaseTest):
+    @Setup
+    def connect(self):
+        return False, 'refused'
+
+    @Setup
+    def load_config(self):
+        return True
+
+    @Task(on_pass='connect')
+    def query(self):
+        return True
+
+    @Test(on_pass='query')
+    def check_query(self):
+        return True
+
+    @Test
+    def check_config(self):
+        return True
+
+    @Teardown
+    def clean_up(self):
+        return True
+
+
+def test_failures_skip_dependents_and_fail_fast_stops_new_steps():
+    test = FailFastTest()
+    test.run()
+    assert test.get_step_results('check_query') == (None, 'Did not run, step connect did not pass.')
+    assert test.step_passed('load_config') and test.step_passed('check_config')
+
+    test.run(fail_fast='flight')
+    assert test.get_step_results('load_config') == (None, 'Did not run, the flight stopped after step connect failed.')
+    assert test.step_passed('check_config')
+
+    test.run(fail_fast='test')
+    assert test.get_step_results('check_config') == (None, 'Did not run, the test stopped after step connect failed.')
+    assert test.get_step_results('check_query') == (None, 'Did not run, step connect did not pass.')
+    assert test.step_passed('clean_up')
+
+    with pytest.raises(Exception):
+        test.run(fail_fast='always')
+
+
+class ParametrizedTest(StaircaseTest):
+    @Test(params=lambda test: ((number, number * 2) for number in range(3)), ids=lambda row: f'n{row[0]}')
+    def check_double(self, number, doubled):
+        return doubled == number * 2 and number != 1, doubled
+
+    @Task(params=['a', 'b'])
+    def upper(self, letter):
+        return True, letter.upper()
+
+    @Teardown(on_pass='upper')
+    def clean_up(self):
+        return True
+
+
+def test_params_expand_into_a_step_per_parameter_set():
+    test = ParametrizedTest()
+    test.run()
+
+    assert test.get_step_results('check_double') == (False, '2 of 3 parameter sets passed.')
+    assert test.get_step_results('check_double[n2]') == (True, 4)
+    assert not test.step_passed('check_double[n1]')
+    assert test.get_return_from_step('upper[1]') == 'B'
+    assert test.step_passed('clean_up')
+
+    test.run()
+    assert test.step_registry['upper'].instances == ['upper[0]', 'upper[1]']
@@ -0,0 +1,102 @@
+from staircase.watch import Watcher
+import os
+
+TEST_MODULE = '''
+import os
+from staircase import StaircaseTest, Setup, Task, Test, Teardown
+
+
+def log(step):
+    with open(os.environ['STAIRCASE_WATCH_LOG'], 'a') as f:
+        f.write(step + '\\n')
+
+
+def expected():
+    return 1
+
+
+class WatchedTest(StaircaseTest):
+    @Setup
+    def prepare(self):
+        log('prepare')
+        self.resource = 'ready'
+        return True
+
+    @Task(on_pass='prepare')
+    def load(self):
+        log('load')
+        return True, self.resource
+
+    @Test(on_pass='prepare')
+    def check(self):
+        log('check')
+        return expected() == 1
+
+    @Teardown
+    def clean_up(self):
+        log('clean_up')
+        return True
+
+
+class OtherTest(StaircaseTest):
+    @Test
+    def other(self):
+        log('other')
+        return True
+'''
+
+
+def _read_log(log_path):
+    steps = log_path.read_text().split() if log_path.exists() else []
+    log_path.unlink(missing_ok=True)
+    return steps
+
+
+def test_watcher_reruns_only_the_steps_a_change_affects(tmp_path, monkeypatch):
+    log_path = tmp_path / 'steps.log'
+    monkeypatch.setenv('STAIRCASE_WATCH_LOG', str(log_path))
+    source = tmp_path / 'test_watched.py'
+    source.write_text(TEST_MODULE)
+
+    watcher = Watcher([str(tmp_path)])
+    watcher.load()
+    watcher.run()
+    assert sorted(_read_log(log_path)) == ['check', 'load', 'other', 'prepare']
+
+    # The helper check calls changes, so only check runs, using what prepare set on the previous instance
+    source.write_text(TEST_MODULE.replace('return 1', 'return 2'))
+    os.utime(source, (1, 1))
+    watcher.reload(watcher.find_changes())
+    watcher.run()
+    assert _read_log(log_path) == ['check']
+
+    test = next(test for test_id, test in watcher._tests.items() if test_id.endswith('WatchedTest'))
+    assert test.step_registry['check'].results[0] is False
+    assert test.step_registry['load'].results == (True, 'ready')
+
+    # Changing a setup step tears the test down before running it again
+    source.write_text(TEST_MODULE.replace("self.resource = 'ready'", "self.resource = 'set'"))
+    os.utime(source, (2, 2))
+    watcher.reload(watcher.find_changes())
+    watcher.run()
+    steps = _read_log(log_path)
+    assert steps[:2] == ['clean_up', 'prepare'] and sorted(steps[2:]) == ['check', 'load']
+
+    watcher.close()
+    assert _read_log(log_path) == ['clean_up']
+
+
+def test_watcher_keeps_a_cancel_made_before_a_test_starts(tmp_path, monkeypatch):
+    log_path = tmp_path / 'steps.log'
+    monkeypatch.setenv('STAIRCASE_WATCH_LOG', str(log_path))
+    (tmp_path / 'test_watched.py').write_text(TEST_MODULE)
+
+    watcher = Watcher([str(tmp_path)])
+    watcher.load()
+    test_id = next(test_id for test_id in watcher._tests if test_id.endswith('WatchedTest'))
+
+    # Cancelled after run checked for a cancel, but before the test started
+    watcher.cancel()
+    watcher._run_test(test_id)
+    assert _read_log(log_path) == []
+    assert watcher._pending[test_id] == {'prepare', 'load', 'check'}